@@ -420,7 +420,7 @@ vector<string> processMatch(string queryMatch)
                             char type2=OrderBook[j].getType();
                             char side2=OrderBook[j].getSide();
 
-                            if(sym==OrderBook[i].getSymbol()&&side1!=side2&&type1==type2)
+                            if(sym==OrderBook[j].getSymbol()&&side1!=side2&&type1==type2)
                             {
                                     if(OrderBook[j].getPrice()>maxPrice)
                                     {
@@ -556,7 +556,7 @@ vector<string> processMatch(string queryMatch)
                             char type2=OrderBook[j].getType();
                             char side2=OrderBook[j].getSide();
 
-                            if(sym==OrderBook[i].getSymbol()&&side1!=side2&&type1==type2)
+                            if(sym==OrderBook[j].getSymbol()&&side1!=side2&&type1==type2)
                             {
                                 if(OrderBook[j].getPrice()>=OrderBook[i].getPrice())
                                 {
@@ -568,7 +568,7 @@ vector<string> processMatch(string queryMatch)
                                     if(order1.getQuantity()>order2.getQuantity())
                                     {
                                         ll min_qty=order2.getQuantity();
-                                        OrderBook[i].setQuantity(min_qty);
+                                        OrderBook[i].setQuantity(OrderBook[i].getQuantity()-min_qty);
                                         order1.setQuantity(min_qty);
                                         OrderBook.erase(OrderBook.begin()+j);
                                         if(j<i)
@@ -582,7 +582,7 @@ vector<string> processMatch(string queryMatch)
                                     else if(order1.getQuantity()<order2.getQuantity())
                                     {
                                         ll min_qty=order1.getQuantity();
-                                        OrderBook[j].setQuantity(min_qty);
+                                        OrderBook[j].setQuantity(OrderBook[j].getQuantity()-min_qty);
                                         order2.setQuantity(min_qty);
                                         OrderBook.erase(OrderBook.begin()+i);
                                         if(i<j)
@@ -702,7 +702,7 @@ vector<string> processMatch(string queryMatch)
                             char type2=OrderBook[j].getType();
                             char side2=OrderBook[j].getSide();
 
-                            if(sym==OrderBook[i].getSymbol()&&side1!=side2&&type1==type2)
+                            if(sym==OrderBook[j].getSymbol()&&side1!=side2&&type1==type2)
                             {
                                 if(OrderBook[j].getPrice()>=OrderBook[i].getPrice())
                                 {
@@ -862,7 +862,7 @@ vector<string> processMatch(string queryMatch)
                         if(order1.getQuantity()>order2.getQuantity())
                         {
                             ll min_qty=order2.getQuantity();
-                            OrderBook[i].setQuantity(min_qty);
+                            OrderBook[i].setQuantity(OrderBook[i].getQuantity()-min_qty);
                             order1.setQuantity(min_qty);
                             OrderBook.erase(OrderBook.begin()+ind);
                             if(ind<i)
@@ -0,0 +1,272 @@
+"""Opening and closing call auctions for MatchingEngine.
+
+``CallAuction(engine)`` sits in front of an engine the way ``JournaledEngine``
+does. ``start(symbols)`` puts symbols into an auction phase. Their resting
+orders move off the book, and new orders for them are collected without
+matching. ``uncross()`` then opens every symbol in the phase at once.
+
+Each symbol trades at a single price: the one that maximizes executable
+volume. Ties go to the smallest imbalance, then the price nearest the
+symbol's last trade, then the lowest price. The search runs over aggregated
+price levels. Cumulative bid volume at or above each level and ask volume at
+or below it are computed for every symbol in one numpy pass, so the work is
+O(levels) rather than matching orders against each other. The executed volume
+is allocated on each side in price-time priority, market orders first, and
+the two allocations are paired into fills in that order.
+
+Fills go to the engine's fill sink and trade tape, with the buy order as the
+aggressor. Leftover orders rest on the book; market and IOC remainders are
+dropped. The auction price becomes the symbol's last trade price, so stops it
+crosses trigger as they would after any trade. The market-data feed sees
+orders leave the book when their symbol enters the auction and the remainders
+rest afterwards, but auction trades are not published.
+"""
+import gc
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from mini_matching_engine import MatchingEngine, Order, SYMBOLS, BUY, MARKET, STOP, IOC
+
+# Sorts market orders ahead of every limit price
+_MARKET_PRIORITY = -(1 << 62)
+
+def _segments(keys):
+    """Start of each run of equal values in sorted ``keys``, and each element's run number."""
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.intp)
+    runs = np.zeros(len(keys), dtype=np.intp)
+    runs[starts[1:]] = 1
+    return starts, np.cumsum(runs)
+
+def _within(values, starts, runs):
+    """Cumulative sum of ``values`` restarting at every run."""
+    total = np.cumsum(values)
+    return total - (total[starts] - values[starts])[runs]
+
+def equilibrium(symbol_ids, is_buy, ticks, quantities, is_market, reference=None):
+    """Auction price and executable volume for every symbol with limit orders.
+
+    Takes one array entry per order; ``reference`` optionally maps symbol id to
+    the tick price used to break ties. Returns ``(symbol_ids, ticks, volume,
+    level)`` with one entry per symbol, sorted by symbol id. ``level`` indexes the
+    order whose price the auction price came from.
+    """
+    limit = np.flatnonzero(~is_market)
+    by_level = limit[np.lexsort((ticks[limit], symbol_ids[limit]))]
+    level_symbols, level_ticks = symbol_ids[by_level], ticks[by_level]
+    new_level = np.r_[True, (level_symbols[1:] != level_symbols[:-1]) | (level_ticks[1:] != level_ticks[:-1])] \
+        if len(by_level) else np.empty(0, dtype=bool)
+    level_of = np.cumsum(new_level) - 1
+    first = by_level[new_level]
+    symbols, ticks_at = level_symbols[new_level], level_ticks[new_level]
+    buys = is_buy[by_level]
+    bid = np.bincount(level_of, np.where(buys, quantities[by_level], 0), len(first)).astype(np.int64)
+    ask = np.bincount(level_of, np.where(buys, 0, quantities[by_level]), len(first)).astype(np.int64)
+
+    # Market orders trade at any price, so they count towards every level of their symbol
+    size = int(symbol_ids.max()) + 1 if len(symbol_ids) else 0
+    market_bid = np.bincount(symbol_ids, np.where(is_market & is_buy, quantities, 0), size).astype(np.int64)
+    market_ask = np.bincount(symbol_ids, np.where(is_market & ~is_buy, quantities, 0), size).astype(np.int64)
+
+    starts, runs = _segments(symbols)
+    asks_at_or_below = _within(ask, starts, runs) + market_ask[symbols]
+    bid_total = np.add.reduceat(bid, starts) if len(starts) else bid
+    bids_at_or_above = bid_total[runs] - _within(bid, starts, runs) + bid + market_bid[symbols]
+    volume = np.minimum(bids_at_or_above, asks_at_or_below)
+    imbalance = np.abs(bids_at_or_above - asks_at_or_below)
+    distance = np.zeros(len(symbols), dtype=np.int64)
+    if reference:
+        known = np.array([symbol in reference for symbol in symbols.tolist()], dtype=bool)
+        anchor = np.array([reference.get(symbol, 0) for symbol in symbols.tolist()], dtype=np.int64)
+        distance = np.where(known, np.abs(ticks_at - anchor), 0)
+
+    best = np.lexsort((ticks_at, distance, imbalance, -volume, runs))
+    best = best[np.r_[True, runs[best][1:] != runs[best][:-1]]] if len(best) else best
+    return symbols[best], ticks_at[best], volume[best], first[best]
+
+def _allocate(order_symbols, priority, arrival, quantities, auction_symbols, auction_volume):
+    """Rows of the orders that trade, in priority order, with the position each one's fill ends at.
+
+    Each symbol's volume is laid out after the previous symbol's, so positions
+    from both sides can be paired across every symbol in one pass.
+    """
+    rows = np.lexsort((arrival, priority, order_symbols))
+    slot = np.searchsorted(auction_symbols, order_symbols[rows])
+    volume = auction_volume[slot]
+    starts, runs = _segments(order_symbols[rows])
+    filled_before = _within(quantities[rows], starts, runs) - quantities[rows]
+    trades = filled_before < volume
+    offset = (np.cumsum(auction_volume) - auction_volume)[slot]
+    ends = offset + np.minimum(filled_before + quantities[rows], volume)
+    return rows[trades], ends[trades]
+
+def match_auction(order_symbols, is_buy, ticks, quantities, is_market, auction_symbols, auction_ticks, auction_volume):
+    """Fills as ``(buy rows, sell rows, quantities)`` for orders crossing at each symbol's auction price.
+
+    ``auction_symbols`` must be sorted, and every entry of ``auction_volume``
+    must be executable at its price, as ``equilibrium`` guarantees.
+    """
+    slot = np.minimum(np.searchsorted(auction_symbols, order_symbols), len(auction_symbols) - 1)
+    price = auction_ticks[slot]
+    in_auction = auction_symbols[slot] == order_symbols
+    arrival = np.arange(len(order_symbols))
+    sides = []
+    for buying in (True, False):
+        through = ticks >= price if buying else ticks <= price
+        eligible = np.flatnonzero((is_buy == buying) & in_auction & (is_market | through))
+        priority = np.where(is_market[eligible], _MARKET_PRIORITY, -ticks[eligible] if buying else ticks[eligible])
+        rows, ends = _allocate(order_symbols[eligible], priority, arrival[eligible], quantities[eligible],
+                               auction_symbols, auction_volume)
+        sides.append((eligible[rows], ends))
+    (buy_rows, buy_ends), (sell_rows, sell_ends) = sides
+
+    # Every position where either side's fill ends closes one fill, between the two orders covering it
+    ends = np.union1d(buy_ends, sell_ends)
+    begins = np.r_[0, ends[:-1]]
+    return (buy_rows[np.searchsorted(buy_ends, begins, side='right')],
+            sell_rows[np.searchsorted(sell_ends, begins, side='right')],
+            ends - begins)
+
+class CallAuction:
+    """Auction phases for a set of symbols in front of a MatchingEngine.
+
+    Orders for symbols in an auction must come through ``add_order``,
+    ``amend_order`` and ``cancel_order`` here. Orders for other symbols are
+    passed straight to the engine.
+    """
+    def __init__(self, engine: MatchingEngine):
+        self.engine = engine
+        self.symbols = set()
+        # order_id -> collected order, in priority order of arrival
+        self.orders: Dict[int, Order] = {}
+
+    def start(self, symbols: Iterable[str]):
+        """Put ``symbols`` into the auction phase, taking their resting orders off the book in priority order."""
+        symbol_ids = {SYMBOLS.intern(symbol) for symbol in symbols} - self.symbols
+        if not symbol_ids:
+            return
+        self.symbols |= symbol_ids
+        book, market_data = self.engine.order_book, self.engine.market_data
+        resting = [order for order in book.iter_orders() if order.symbol_id in symbol_ids]
+        for order in resting:
+            book.remove_order(order)
+            if market_data is not None:
+                market_data.on_delete(order)
+            self.orders[order.order_id] = order
+
+    def add_order(self, order: Order):
+        if order.symbol_id not in self.symbols:
+            self.engine.add_order(order)
+        elif order.type_id >= STOP:
+            # Held without checking the trigger, which only moves once the auction has traded
+            self.engine.stop_book.add_order(order)
+        else:
+            self.orders[order.order_id] = order
+
+    def cancel_order(self, order_id: int) -> bool:
+        if self.orders.pop(order_id, None) is not None:
+            return True
+        return self.engine.cancel_order(order_id)
+
+    def amend_order(self, order_id: int, price: float, quantity: int, timestamp: int = None) -> bool:
+        order = self.orders.get(order_id)
+        if order is None:
+            return self.engine.amend_order(order_id, price, quantity, timestamp)
+        if quantity <= 0:
+            return False
+        same_price = SYMBOLS.to_ticks(order.symbol_id, price) == order.ticks
+        if same_price and quantity == order.quantity:
+            return False
+        if not (same_price and quantity < order.quantity):
+            # As on the book, only a quantity-down amend keeps the order's place
+            del self.orders[order_id]
+            self.orders[order_id] = order
+            order.price = price
+            order.timestamp = timestamp if timestamp is not None else int(time.time())
+        order.quantity = quantity
+        return True
+
+    def _columns(self, orders: List[Order]):
+        count = len(orders)
+        return (np.fromiter((o.symbol_id for o in orders), np.int64, count),
+                np.fromiter((o.side_id == BUY for o in orders), bool, count),
+                np.fromiter((o.ticks for o in orders), np.int64, count),
+                np.fromiter((o.quantity for o in orders), np.int64, count),
+                np.fromiter((o.type_id == MARKET for o in orders), bool, count))
+
+    def _collected(self, symbol_ids) -> List[Order]:
+        return [order for order in self.orders.values() if order.symbol_id in symbol_ids]
+
+    def _symbol_ids(self, symbols) -> set:
+        if symbols is None:
+            return set(self.symbols)
+        return {SYMBOLS.ids[symbol] for symbol in symbols if SYMBOLS.ids.get(symbol) in self.symbols}
+
+    def indicative(self, symbols: Iterable[str] = None) -> Dict[str, Tuple[float, int]]:
+        """The (price, volume) each auction symbol would open at now, for symbols that would trade."""
+        orders = self._collected(self._symbol_ids(symbols))
+        symbol_ids, ticks, volume, level = equilibrium(*self._columns(orders), self.engine.last_ticks)
+        return {SYMBOLS.names[symbol_id]: (orders[row].price, int(executed))
+                for symbol_id, executed, row in zip(symbol_ids.tolist(), volume.tolist(), level.tolist()) if executed}
+
+    def uncross(self, symbols: Iterable[str] = None) -> Dict[str, Tuple[float, int]]:
+        """Open ``symbols`` (default: every symbol in the auction phase) and return each one's (price, volume)."""
+        # Resting the leftovers creates book nodes by the hundred thousand, and each
+        # automatic collection would scan the whole heap; nothing here becomes garbage.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self._uncross(self._symbol_ids(symbols))
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _uncross(self, symbol_ids: set) -> Dict[str, Tuple[float, int]]:
+        orders = self._collected(symbol_ids)
+        order_symbols, is_buy, ticks, quantities, is_market = self._columns(orders)
+        traded, prices, volumes, level = equilibrium(order_symbols, is_buy, ticks, quantities, is_market,
+                                                     self.engine.last_ticks)
+        keep = volumes > 0
+        traded, prices, volumes, level = traded[keep], prices[keep], volumes[keep], level[keep]
+        buyers = sellers = quantity = np.empty(0, dtype=np.int64)
+        if len(traded):
+            buyers, sellers, quantity = match_auction(order_symbols, is_buy, ticks, quantities, is_market,
+                                                      traded, prices, volumes)
+
+        engine = self.engine
+        auction_price = {symbol_id: orders[row].price for symbol_id, row in zip(traded.tolist(), level.tolist())}
+        filled = np.bincount(buyers, quantity, len(orders)) + np.bincount(sellers, quantity, len(orders))
+        for row in np.flatnonzero(filled).tolist():
+            orders[row].quantity -= int(filled[row])
+
+        buy_orders = [orders[row] for row in buyers.tolist()]
+        sell_orders = [orders[row] for row in sellers.tolist()]
+        names = [SYMBOLS.names[symbol_id] for symbol_id in order_symbols[buyers].tolist()]
+        fill_prices = [auction_price[order.symbol_id] for order in buy_orders]
+        order_ids = np.fromiter((o.order_id for o in orders), np.int64, len(orders))
+        engine.trade_tape.extend(names, order_ids[buyers], order_ids[sellers], quantity, fill_prices)
+        on_fill = engine.fill_sink.on_fill
+        for fill in zip(names, buy_orders, sell_orders, quantity.tolist(), fill_prices):
+            on_fill(*fill)
+
+        # Leftovers rest grouped by level, and in arrival order within each one to keep time priority
+        remaining = quantities - filled.astype(np.int64)
+        tif = np.fromiter((o.tif_id for o in orders), np.int8, len(orders))
+        rest = np.flatnonzero((remaining > 0) & ~is_market & (tif != IOC))
+        rest = rest[np.lexsort((rest, ticks[rest], is_buy[rest], order_symbols[rest]))]
+        resting = [orders[row] for row in rest.tolist()]
+        engine.order_book.add_orders(resting)
+        engine.clock = max([engine.clock] + [order.timestamp for order in orders])
+        if engine.market_data is not None:
+            for order in resting:
+                engine.market_data.on_add(order)
+        self.orders = {order_id: order for order_id, order in self.orders.items() if order.symbol_id not in symbol_ids}
+        self.symbols -= symbol_ids
+
+        results = {}
+        for symbol_id, ticks_at, executed in zip(traded.tolist(), prices.tolist(), volumes.tolist()):
+            engine.last_ticks[symbol_id] = ticks_at
+            engine.trigger_stops(symbol_id)
+            results[SYMBOLS.names[symbol_id]] = (auction_price[symbol_id], executed)
+        return results
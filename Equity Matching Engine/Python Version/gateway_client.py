@@ -0,0 +1,150 @@
+"""Load generator for order_gateway.py.
+
+Opens several connections, keeps a window of orders in flight on each, and
+reports throughput and order round-trip latency (send -> ACK). With
+``--local`` the gateway runs in the same event loop, so nothing needs to be
+started beforehand.
+
+    python gateway_client.py --local --connections 8 --orders 20000
+    python gateway_client.py --port 9000 --connections 8 --orders 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from typing import List
+
+from order_gateway import OrderGateway, serve
+
+async def run_client(host: str, port: int, client_id: int, orders: int, window: int, cancel_ratio: float,
+                     symbols: List[str], latencies: List[int], seed: int):
+    """Send ``orders`` messages and wait for a response to each; returns the open connection and response counts."""
+    rng = random.Random(seed + client_id)
+    reader, writer = await asyncio.open_connection(host, port)
+    sent_at = {}
+    live = []
+    in_flight = asyncio.Semaphore(window)
+    responses = Counter()
+
+    async def receive():
+        answered = 0
+        while answered < orders:
+            line = await reader.readline()
+            if not line:
+                break
+            parts = line.decode().rstrip('\n').split(',')
+            responses[_kind(parts)] += 1
+            if parts[0] == 'FILL':
+                continue
+            started = sent_at.pop(parts[1], None)
+            if started is not None:
+                latencies.append(time.perf_counter_ns() - started)
+            if parts[0] == 'ACK':
+                live.append(parts[2])
+            answered += 1
+            in_flight.release()
+
+    receiver = asyncio.create_task(receive())
+    for i in range(orders):
+        await in_flight.acquire()
+        request = f"{client_id}-{i}"
+        if live and rng.random() < cancel_ratio:
+            index = rng.randrange(len(live))
+            live[index], live[-1] = live[-1], live[index]
+            message = f"X,{request},{live.pop()}\n"
+        else:
+            side = rng.choice('BS')
+            price = 100 + rng.randint(-20, 20) / 10
+            message = f"N,{request},{rng.choice(symbols)},L,{side},{price:.2f},{rng.randint(1, 10) * 10},GTC\n"
+        sent_at[request] = time.perf_counter_ns()
+        writer.write(message.encode())
+        if i % 64 == 0:
+            await writer.drain()
+    await writer.drain()
+    await receiver
+    return reader, writer, responses
+
+async def drain(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, responses: Counter, symbol: str):
+    """Count the fills still owed to this connection, then close it.
+
+    Run once every client has had all its responses, so no more fills can
+    happen. The gateway answers in order, so every fill for this connection
+    arrives before the reply to a final book query.
+    """
+    writer.write(f"B,drain,{symbol}\n".encode())
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        parts = line.decode().rstrip('\n').split(',')
+        if parts[0] == 'BOOK' and parts[1] == 'drain':
+            break
+        responses[_kind(parts)] += 1
+    writer.close()
+
+def _kind(parts: List[str]) -> str:
+    # CXL and AMD responses are counted by outcome
+    return f"{parts[0]} {parts[3]}" if parts[0] in ('CXL', 'AMD') else parts[0]
+
+async def run_load(host: str, port: int, connections: int, orders: int, window: int, cancel_ratio: float,
+                   symbol_count: int, seed: int, local: bool, gateway: OrderGateway = None) -> dict:
+    """Drive the gateway from ``connections`` clients; with ``local``, serve ``gateway`` (or a new one) on an ephemeral port."""
+    server = None
+    if local:
+        server = await serve(host, 0, gateway)
+        port = server.sockets[0].getsockname()[1]
+
+    symbols = [f"SYM{i}" for i in range(symbol_count)]
+    latencies: List[int] = []
+    start = time.perf_counter()
+    clients = await asyncio.gather(*(run_client(host, port, client, orders, window, cancel_ratio, symbols, latencies, seed)
+                                     for client in range(connections)))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(drain(reader, writer, responses, symbols[0]) for reader, writer, responses in clients))
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+    latencies.sort()
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0
+
+    total = connections * orders
+    responses = sum((responses for _, _, responses in clients), Counter())
+    return {
+        'messages': total,
+        'responses': dict(responses),
+        'fills_reported': responses['FILL'],
+        'seconds': elapsed,
+        'messages_per_sec': total / elapsed,
+        'p50_us': percentile(0.50) / 1000,
+        'p99_us': percentile(0.99) / 1000,
+        'p999_us': percentile(0.999) / 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure order gateway throughput and round-trip latency on localhost.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--local', action='store_true', help="run the gateway in this process on an ephemeral port")
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--orders', type=int, default=10000, help="messages per connection")
+    parser.add_argument('--window', type=int, default=256, help="messages in flight per connection")
+    parser.add_argument('--cancel-ratio', type=float, default=0.2)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    stats = asyncio.run(run_load(args.host, args.port, args.connections, args.orders, args.window,
+                                 args.cancel_ratio, args.symbols, args.seed, args.local))
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            print(f"{key}: {', '.join(f'{kind} {count:,}' for kind, count in sorted(value.items()))}")
+        else:
+            print(f"{key}: {value:,.2f}" if isinstance(value, float) else f"{key}: {value:,}")
+
+if __name__ == "__main__":
+    main()
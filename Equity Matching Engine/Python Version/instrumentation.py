@@ -0,0 +1,253 @@
+"""Sampled latency histograms and counters for MatchingEngine hot paths.
+
+``Instrumentation.attach(engine)`` shadows the engine's entry points
+(``add_order``, ``cancel_order``, ``amend_order``) with instance attributes
+that count calls and time one call in every ``sample_every``. Detaching
+deletes them again, and an engine that is not attached runs exactly the code
+it always did.
+
+A sampled call also times the inner stages (``process_limit_order``,
+``process_market_order``, ``match_orders`` and the book's ``remove_order``).
+It runs on shadow copies of the engine and book whose classes wrap those
+stages. Before each sample the shadows take the real objects' current
+attributes, so the call changes the same book, order index and trade tape,
+and afterwards the real objects take back anything the call reassigned, such
+as the engine's ``clock``.
+Neither the live objects nor their classes are patched: patching a class
+discards the interpreter's specialized code on every sample, and reading an
+instance's ``__dict__`` leaves its attribute lookups slower for good.
+
+Fills and price levels touched are counted from the engine's trade tape, and
+book depth is read from the book, when a snapshot is taken rather than on the
+hot path.
+
+Stage timings are nanoseconds in power-of-two buckets. A stage's time
+includes the stages it calls, along with their timer overhead.
+"""
+import json
+import time
+from typing import Dict
+
+ENTRY_POINTS = ('add_order', 'cancel_order', 'amend_order')
+ENGINE_STAGES = ('process_limit_order', 'process_market_order', 'match_orders')
+BOOK_STAGES = ('remove_order',)
+STAGES = ENTRY_POINTS + ENGINE_STAGES + BOOK_STAGES
+
+class LatencyHistogram:
+    """Nanosecond latencies in fixed log-scale buckets: bucket ``b`` holds [2**(b-1), 2**b)."""
+    BUCKETS = 40  # the last bucket also takes anything from ~275 seconds up
+    __slots__ = ('counts', 'total')
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+
+    def record(self, nanoseconds: int):
+        self.counts[min(nanoseconds.bit_length(), self.BUCKETS - 1)] += 1
+        self.total += nanoseconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound of the bucket holding the ``fraction`` quantile, or 0 when empty."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return 1 << bucket
+        return 0
+
+def _timed(function, histogram: LatencyHistogram):
+    clock, record = time.perf_counter_ns, histogram.record
+    def timed(*args):
+        start = clock()
+        result = function(*args)
+        record(clock() - start)
+        return result
+    return timed
+
+def _shadow(instance, stages, histograms):
+    """An instance of a subclass of ``type(instance)`` with timed ``stages``, and its attribute names."""
+    cls = type(instance)
+    methods = {name: _timed(getattr(cls, name), histograms[name]) for name in stages}
+    # A throwaway instance gives the attribute names, since reading vars() of the shadow would slow it down too
+    probe = cls.__new__(cls)
+    cls.__init__(probe)
+    return object.__new__(type(cls.__name__, (cls,), {'__module__': cls.__module__, **methods})), tuple(vars(probe))
+
+class Instrumentation:
+    def __init__(self, sample_every: int = 128):
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        self.sample_every = sample_every
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+        self.call_counts = {}
+        self.engine = None
+        self.shadows = []
+        self.sampling = False
+        self.fills = 0
+        self.levels_touched = 0
+        self.scanned = 0
+        self.last_fill = None
+
+    def attach(self, engine):
+        if self.engine is not None:
+            raise RuntimeError("Instrumentation is already attached to an engine")
+        self.engine = engine
+        self.scanned = engine.trade_tape.total
+        shadow_engine, names = _shadow(engine, ENGINE_STAGES, self.histograms)
+        shadow_book, book_names = _shadow(engine.order_book, BOOK_STAGES, self.histograms)
+        # The entry points are shared too, so an amend's inner add_order is counted whether or not it is sampled
+        self.shadows = [(engine, shadow_engine, names + ENTRY_POINTS), (engine.order_book, shadow_book, book_names)]
+        for name in ENTRY_POINTS:
+            setattr(engine, name, self._entry_point(engine, name))
+        return self
+
+    def detach(self):
+        if self.engine is None:
+            return
+        self._scan_tape()
+        for name in ENTRY_POINTS:
+            delattr(self.engine, name)
+        self.engine = None
+        self.shadows = []
+
+    def _sample(self, name: str, args: tuple):
+        """Run one entry-point call on the shadows, timing it and the stages it reaches."""
+        for instance, shadow, names in self.shadows:
+            for attribute in names:
+                setattr(shadow, attribute, getattr(instance, attribute))
+        (_, shadow_engine, _), (_, shadow_book, _) = self.shadows
+        shadow_engine.order_book = shadow_book
+        self.sampling = True
+        try:
+            start = time.perf_counter_ns()
+            result = getattr(type(self.engine), name)(shadow_engine, *args)
+            self.histograms[name].record(time.perf_counter_ns() - start)
+            return result
+        finally:
+            self.sampling = False
+            shadow_engine.order_book = self.engine.order_book
+            for instance, shadow, names in self.shadows:
+                for attribute in names:
+                    setattr(instance, attribute, getattr(shadow, attribute))
+
+    def _entry_point(self, engine, name: str):
+        method = getattr(engine, name)
+        every = self.sample_every
+        remaining = every
+        samples = 0
+
+        def sampled(*args):
+            nonlocal remaining, samples
+            remaining = every
+            samples += 1
+            if self.sampling:  # the add_order inside an amend that is already being sampled
+                return method(*args)
+            return self._sample(name, args)
+
+        # Signatures are spelled out because packing *args costs more than the countdown itself
+        if name == 'amend_order':
+            def entry(order_id, price, quantity, timestamp=None):
+                nonlocal remaining
+                remaining -= 1
+                if remaining:
+                    return method(order_id, price, quantity, timestamp)
+                return sampled(order_id, price, quantity, timestamp)
+        else:
+            def entry(argument):
+                nonlocal remaining
+                remaining -= 1
+                if remaining:
+                    return method(argument)
+                return sampled(argument)
+
+        self.call_counts[name] = lambda: samples * every + every - remaining
+        return entry
+
+    def calls(self, name: str) -> int:
+        count = self.call_counts.get(name)
+        return count() if count is not None else 0
+
+    def _scan_tape(self):
+        # A fill touches a new level when its aggressor or price differs from the previous fill's
+        tape = self.engine.trade_tape
+        first = max(self.scanned, tape.total - len(tape))
+        aggressors, prices = tape.columns['aggressor_id'], tape.columns['price']
+        size = tape.capacity or tape.allocated
+        last = self.last_fill
+        levels = 0
+        for sequence in range(first, tape.total):
+            row = sequence % size
+            fill = (aggressors[row], prices[row])
+            if fill != last:
+                levels += 1
+                last = fill
+        self.fills += tape.total - self.scanned
+        self.levels_touched += levels
+        self.scanned = tape.total
+        self.last_fill = last
+
+    def _book_depth(self):
+        book = self.engine.order_book
+        if hasattr(book, '_sides'):
+            levels = sum(len(side.ticks) for sides in book._sides for side in sides.values())
+        else:
+            levels = len({(o.symbol_id, o.side_id, o.ticks) for o in book.iter_orders()})
+        return len(book.orders), levels
+
+    def snapshot(self) -> dict:
+        """Counters, book depth gauges and per-stage latency summaries."""
+        counters = {name: self.calls(name) for name in ENTRY_POINTS}
+        resting_orders = price_levels = None
+        if self.engine is not None:
+            self._scan_tape()
+            resting_orders, price_levels = self._book_depth()
+        counters.update({'fills': self.fills, 'levels_touched': self.levels_touched})
+        return {
+            'sample_every': self.sample_every,
+            'counters': counters,
+            'gauges': {'resting_orders': resting_orders, 'price_levels': price_levels},
+            'stages': {
+                stage: {
+                    'samples': histogram.count,
+                    'mean_ns': histogram.total / histogram.count if histogram.count else 0,
+                    'p50_ns': histogram.percentile(0.5),
+                    'p99_ns': histogram.percentile(0.99),
+                    'p999_ns': histogram.percentile(0.999),
+                    'buckets': {1 << bucket: count for bucket, count in enumerate(histogram.counts) if count},
+                } for stage, histogram in self.histograms.items()
+            },
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'matching_engine') -> str:
+        """Prometheus text exposition: stage latencies as histograms in seconds, plus counters and gauges."""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {prefix}_stage_seconds Sampled latency of matching engine stages.",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        for stage, histogram in self.histograms.items():
+            cumulative = 0
+            for bucket, count in enumerate(histogram.counts[:-1]):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{(1 << bucket) / 1e9:.9g}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total / 1e9:.9g}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        lines += [f"# HELP {prefix}_commands_total Commands received, by entry point.",
+                  f"# TYPE {prefix}_commands_total counter"]
+        lines += [f'{prefix}_commands_total{{command="{name}"}} {snapshot["counters"][name]}' for name in ENTRY_POINTS]
+        for name, help_text in (('fills', "Fills executed."), ('levels_touched', "Price levels matched against by aggressive orders.")):
+            lines += [f"# HELP {prefix}_{name}_total {help_text}", f"# TYPE {prefix}_{name}_total counter",
+                      f"{prefix}_{name}_total {snapshot['counters'][name]}"]
+        for name, help_text in (('resting_orders', "Orders resting in the book."), ('price_levels', "Non-empty price levels in the book.")):
+            value = snapshot['gauges'][name]
+            if value is not None:
+                lines += [f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        return '\n'.join(lines) + '\n'
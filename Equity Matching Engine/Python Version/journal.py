@@ -0,0 +1,351 @@
+"""Write-ahead journal and binary book snapshots for MatchingEngine.
+
+``JournaledEngine`` records every accepted command in an append-only binary
+journal before it returns, and can take snapshots of the resting orders and
+stops. After
+a crash, ``recover`` loads the latest snapshot and replays only the journal
+records written after it.
+
+Journal records (little-endian, first byte is the record type):
+
+    Y  symbol   symbol_id:u32 tick_size:f64 name:16s
+    N  new      order_id:i64 timestamp:i64 symbol_id:u32 type:u8 side:u8 tif:u8 price:f64 quantity:i64 stop_price:f64
+    A  amend    order_id:i64 price:f64 quantity:i64 timestamp:i64
+    X  cancel   order_id:i64
+
+Symbol ids are only meaningful inside one journal or snapshot, which is why
+each file defines its symbols with ``Y`` records before using them. The stop
+price of an order that is not a stop is NaN.
+
+Records are buffered and written with a single ``write`` + ``fsync`` per
+group: once ``group_size`` records are pending, once ``group_interval``
+seconds have passed since the last commit, or on ``sync()``. A background
+thread commits a group that is still pending when its ``group_interval`` runs
+out, so the last commands of a burst do not wait for more traffic. A command
+is durable once the group holding it has been committed.
+
+A snapshot file holds a header with the journal offset it is consistent with
+and the engine clock, the symbol definitions, every resting order in priority
+order, every resting stop in arrival order, and each symbol's last trade price,
+which later stops trigger on. It is
+written by a forked child from a copy-on-write image of the process, so
+matching only pauses for the fork itself; where ``fork`` is unavailable the
+snapshot is written in-process.
+"""
+import argparse
+import math
+import os
+import struct
+import threading
+import time
+from typing import Dict, Tuple
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink, SYMBOLS, set_tick_size, ORDER_TYPES, SIDES, TIME_IN_FORCE, STOP
+
+JOURNAL_FILE = 'journal.bin'
+SNAPSHOT_FILE = 'snapshot.bin'
+
+SYMBOL_RECORD = struct.Struct('<BId16s')
+NEW_RECORD = struct.Struct('<BqqIBBBdqd')
+AMEND_RECORD = struct.Struct('<Bqdqq')
+CANCEL_RECORD = struct.Struct('<Bq')
+RECORDS = {record_type: layout for record_type, layout in zip(b'YNAX', (SYMBOL_RECORD, NEW_RECORD, AMEND_RECORD, CANCEL_RECORD))}
+_Y, _N, _A, _X = b'YNAX'
+
+SNAPSHOT_MAGIC = b'MESNAP02'
+# magic, journal offset, engine clock, symbol count, order count, stop count, last trade count
+SNAPSHOT_HEADER = struct.Struct('<8sqqIIII')
+SNAPSHOT_ORDER = struct.Struct('<qqIBBdq')  # order_id, timestamp, symbol_id, side, tif, price, quantity
+SNAPSHOT_STOP = struct.Struct('<qqIBBBdqd')  # order_id, timestamp, symbol_id, type, side, tif, price, quantity, stop_price
+SNAPSHOT_LAST_TRADE = struct.Struct('<Iq')  # symbol_id, ticks
+
+def _symbol_record(symbol_id: int) -> bytes:
+    return SYMBOL_RECORD.pack(_Y, symbol_id, SYMBOLS.tick_sizes[symbol_id], SYMBOLS.names[symbol_id].encode()[:16])
+
+class Journal:
+    """Append-only command journal with group-commit fsync."""
+    def __init__(self, path: str, group_size: int = 256, group_interval: float = 0.002):
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.file = open(path, 'ab')
+        self.offset = self.file.tell()
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.last_commit = time.monotonic()
+        self.defined = set()
+        self.commits = 0
+        # Held around the buffer, since the committer thread commits it too
+        self.lock = threading.Lock()
+        # Set while a group is pending, so the committer only wakes when there is something to commit
+        self.pending = threading.Event()
+        self.closed = False
+        self.committer = None
+        if group_interval > 0:
+            self.committer = threading.Thread(target=self._commit_pending, name='journal-commit', daemon=True)
+            self.committer.start()
+
+    def append(self, record: bytes):
+        with self.lock:
+            self.buffer += record
+            self.buffered += 1
+            if self.buffered >= self.group_size or time.monotonic() - self.last_commit >= self.group_interval:
+                self._commit()
+            elif self.buffered == 1:
+                self.pending.set()
+
+    def define_symbol(self, symbol_id: int):
+        with self.lock:
+            self.defined.add(symbol_id)
+            self.buffer += _symbol_record(symbol_id)
+
+    def write(self):
+        """Hand buffered records to the OS without waiting for the disk."""
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.offset += len(self.buffer)
+            self.buffer.clear()
+
+    def sync(self):
+        """Commit every buffered record to disk."""
+        with self.lock:
+            self._commit()
+
+    def _commit(self):
+        if self.buffered or self.buffer:
+            self._write()
+            os.fsync(self.file.fileno())
+            self.commits += 1
+        self.buffered = 0
+        self.last_commit = time.monotonic()
+        self.pending.clear()
+
+    def _commit_pending(self):
+        """Commit a pending group once ``group_interval`` has passed since the last commit."""
+        while True:
+            self.pending.wait()
+            if self.closed:
+                return
+            with self.lock:
+                delay = self.last_commit + self.group_interval - time.monotonic()
+                if delay <= 0:
+                    self._commit()
+            if delay > 0:
+                time.sleep(delay)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self._commit()
+            self.pending.set()
+        if self.committer is not None:
+            self.committer.join()
+        self.file.close()
+
+class JournaledEngine:
+    """A MatchingEngine whose accepted commands are journaled in ``directory``.
+
+    New orders are journaled before they are matched; amends and cancels once the
+    engine has accepted them. Call ``snapshot()`` periodically to bound recovery time.
+    """
+    def __init__(self, directory: str, engine: MatchingEngine = None, group_size: int = 256, group_interval: float = 0.002):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.engine = engine if engine is not None else MatchingEngine(fill_sink=NullFillSink())
+        self.journal = Journal(os.path.join(directory, JOURNAL_FILE), group_size, group_interval)
+        self.snapshot_pid = None
+
+    def add_order(self, order: Order):
+        journal = self.journal
+        if order.symbol_id not in journal.defined:
+            journal.define_symbol(order.symbol_id)
+        stop_price = order.stop_price if order.type_id >= STOP else math.nan
+        journal.append(NEW_RECORD.pack(_N, order.order_id, order.timestamp, order.symbol_id, order.type_id,
+                                       order.side_id, order.tif_id, order.price, order.quantity, stop_price))
+        self.engine.add_order(order)
+
+    def cancel_order(self, order_id: int) -> bool:
+        if not self.engine.cancel_order(order_id):
+            return False
+        self.journal.append(CANCEL_RECORD.pack(_X, order_id))
+        return True
+
+    def amend_order(self, order_id: int, price: float, quantity: int, timestamp: int = None) -> bool:
+        order = self.engine.order_book.get_order(order_id)
+        if not self.engine.amend_order(order_id, price, quantity, timestamp):
+            return False
+        # Journal the timestamp the engine actually used so replay requeues the order identically
+        self.journal.append(AMEND_RECORD.pack(_A, order_id, price, quantity, order.timestamp))
+        return True
+
+    def sync(self):
+        self.journal.sync()
+
+    def snapshot(self) -> bool:
+        """Start writing a snapshot; returns False if the previous one is still being written."""
+        if self.snapshot_pid is not None:
+            pid, _ = os.waitpid(self.snapshot_pid, os.WNOHANG)
+            if pid == 0:
+                return False
+            self.snapshot_pid = None
+
+        # The snapshot must not be ahead of the journal, so everything applied so far goes to the OS first
+        self.journal.write()
+        offset = self.journal.offset
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not hasattr(os, 'fork'):
+            write_snapshot(path, self.engine, offset, self.journal.defined)
+            return True
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                write_snapshot(path, self.engine, offset, self.journal.defined)
+                status = 0
+            finally:
+                os._exit(status)
+        self.snapshot_pid = pid
+        return True
+
+    def wait_for_snapshot(self):
+        if self.snapshot_pid is not None:
+            os.waitpid(self.snapshot_pid, 0)
+            self.snapshot_pid = None
+
+    def close(self):
+        self.wait_for_snapshot()
+        self.journal.close()
+
+def write_snapshot(path: str, engine: MatchingEngine, journal_offset: int, symbols=()):
+    """Atomically replace ``path`` with every resting order and stop in ``engine``."""
+    orders = list(engine.order_book.iter_orders())
+    # The stop book's index keeps stops in arrival order, which is how they break ties
+    stops = [entry[2] for entry in engine.stop_book.orders.values()]
+    last_ticks = engine.last_ticks
+    symbol_ids = sorted(set(symbols) | {order.symbol_id for order in orders} | {order.symbol_id for order in stops}
+                        | set(last_ticks))
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, journal_offset, engine.clock, len(symbol_ids), len(orders), len(stops),
+                                  len(last_ticks))]
+    parts.extend(_symbol_record(symbol_id) for symbol_id in symbol_ids)
+    parts.extend(SNAPSHOT_ORDER.pack(o.order_id, o.timestamp, o.symbol_id, o.side_id, o.tif_id, o.price, o.quantity)
+                 for o in orders)
+    parts.extend(SNAPSHOT_STOP.pack(o.order_id, o.timestamp, o.symbol_id, o.type_id, o.side_id, o.tif_id, o.price,
+                                    o.quantity, o.stop_price) for o in stops)
+    parts.extend(SNAPSHOT_LAST_TRADE.pack(symbol_id, ticks) for symbol_id, ticks in last_ticks.items())
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(b''.join(parts))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def _define_symbol(symbols: Dict[int, str], record: tuple):
+    _, symbol_id, tick_size, name = record
+    name = name.rstrip(b'\0').decode()
+    set_tick_size(name, tick_size)
+    symbols[symbol_id] = name
+
+def load_snapshot(path: str, engine: MatchingEngine) -> Tuple[int, Dict[int, str], int, int]:
+    """Rest every order and stop in the snapshot on ``engine``; returns (journal offset, symbols, orders, stops)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, journal_offset, clock, symbol_count, order_count, stop_count, last_trade_count = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a matching engine snapshot")
+    offset = SNAPSHOT_HEADER.size
+    symbols: Dict[int, str] = {}
+    for _ in range(symbol_count):
+        _define_symbol(symbols, SYMBOL_RECORD.unpack_from(data, offset))
+        offset += SYMBOL_RECORD.size
+
+    # Orders were resting, so they go straight onto the book without matching
+    add_order = engine.order_book.add_order
+    for order_id, timestamp, symbol_id, side_id, tif_id, price, quantity in SNAPSHOT_ORDER.iter_unpack(
+            data[offset:offset + order_count * SNAPSHOT_ORDER.size]):
+        add_order(Order(order_id, timestamp, symbols[symbol_id], 'L', SIDES[side_id], price, quantity, TIME_IN_FORCE[tif_id]))
+    offset += order_count * SNAPSHOT_ORDER.size
+
+    # Stops and last trades are restored as they were, so nothing triggers while loading
+    for order_id, timestamp, symbol_id, type_id, side_id, tif_id, price, quantity, stop_price in SNAPSHOT_STOP.iter_unpack(
+            data[offset:offset + stop_count * SNAPSHOT_STOP.size]):
+        engine.stop_book.add_order(Order(order_id, timestamp, symbols[symbol_id], ORDER_TYPES[type_id], SIDES[side_id],
+                                         price, quantity, TIME_IN_FORCE[tif_id], stop_price))
+    offset += stop_count * SNAPSHOT_STOP.size
+    for symbol_id, ticks in SNAPSHOT_LAST_TRADE.iter_unpack(data[offset:offset + last_trade_count * SNAPSHOT_LAST_TRADE.size]):
+        engine.last_ticks[SYMBOLS.intern(symbols[symbol_id])] = ticks
+    engine.clock = max(engine.clock, clock)
+    return journal_offset, symbols, order_count, stop_count
+
+def recover(directory: str, engine: MatchingEngine = None) -> Tuple[MatchingEngine, dict]:
+    """Rebuild engine state from the latest snapshot plus the journal tail.
+
+    A record cut short by the crash is dropped and the journal truncated to the
+    last whole record, so new records can be appended safely.
+    """
+    engine = engine if engine is not None else MatchingEngine(fill_sink=NullFillSink())
+    start = time.perf_counter()
+    snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+    journal_offset, symbols, snapshot_orders, snapshot_stops = 0, {}, 0, 0
+    if os.path.exists(snapshot_path):
+        journal_offset, symbols, snapshot_orders, snapshot_stops = load_snapshot(snapshot_path, engine)
+
+    journal_path = os.path.join(directory, JOURNAL_FILE)
+    data = b''
+    if os.path.exists(journal_path):
+        with open(journal_path, 'rb') as f:
+            f.seek(journal_offset)
+            data = f.read()
+
+    replayed = 0
+    offset = 0
+    while offset < len(data):
+        layout = RECORDS.get(data[offset])
+        if layout is None or offset + layout.size > len(data):
+            break
+        record = layout.unpack_from(data, offset)
+        offset += layout.size
+        kind = record[0]
+        if kind == _N:
+            _, order_id, timestamp, symbol_id, type_id, side_id, tif_id, price, quantity, stop_price = record
+            engine.add_order(Order(order_id, timestamp, symbols[symbol_id], ORDER_TYPES[type_id], SIDES[side_id],
+                                   price, quantity, TIME_IN_FORCE[tif_id], None if math.isnan(stop_price) else stop_price))
+        elif kind == _A:
+            engine.amend_order(record[1], record[2], record[3], record[4])
+        elif kind == _X:
+            engine.cancel_order(record[1])
+        else:
+            _define_symbol(symbols, record)
+            continue
+        replayed += 1
+
+    if offset < len(data):
+        with open(journal_path, 'r+b') as f:
+            f.truncate(journal_offset + offset)
+
+    return engine, {
+        'snapshot_orders': snapshot_orders,
+        'snapshot_stops': snapshot_stops,
+        'journal_records': replayed,
+        'truncated_bytes': len(data) - offset,
+        'seconds': time.perf_counter() - start,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recover matching engine state from a journal directory.")
+    parser.add_argument('directory')
+    args = parser.parse_args()
+
+    engine, stats = recover(args.directory)
+    for key, value in stats.items():
+        print(f"{key}: {value:,.4f}" if isinstance(value, float) else f"{key}: {value:,}")
+    print(f"resting orders: {len(engine.order_book.orders):,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Sequenced L3/L2 market-data feed for MatchingEngine.
+
+Every book change is published as a numbered event: order add, reduce, delete
+and trade (L3), each followed by the price-level update it causes (L2). Events
+are packed with ``struct`` as they happen and batched into frames::
+
+    frame   = <uint32 message count> message*
+    message = <uint8 type> fields...
+
+All integers are little-endian and prices are integer ticks (see the ``Y``
+message for each symbol's tick size). Message layouts:
+
+    Y  symbol          symbol_id:u32 tick_size:f64 name:16s
+    A  add             seq:u64 symbol_id:u32 order_id:i64 side:u8 ticks:i64 quantity:i64
+    R  reduce          seq:u64 symbol_id:u32 order_id:i64 remaining:i64
+    D  delete          seq:u64 symbol_id:u32 order_id:i64
+    T  trade           seq:u64 symbol_id:u32 aggressor_id:i64 resting_id:i64 quantity:i64 ticks:i64
+    L  level           seq:u64 symbol_id:u32 side:u8 ticks:i64 quantity:i64 orders:u32
+    S  snapshot        seq:u64 symbol_id:u32 order_count:u32
+    O  snapshot order  order_id:i64 side:u8 ticks:i64 quantity:i64
+
+A snapshot is one ``S`` header per symbol followed by its resting orders in
+priority order, stamped with the sequence number of the last event it includes.
+Subscribers get one on joining and then every ``snapshot_interval`` events, so a
+consumer that fell behind can drop everything up to the next ``S`` and resync.
+
+Periodic snapshots are built on the publisher's own thread, from an L3 mirror
+of the book that the publisher keeps up to date from the engine callbacks. When
+one is due, the matching thread hands the mirror over and records later changes
+in an overlay, which costs O(1). The mirror is handed back and the overlay
+merged into it once the snapshot is done. Frames published in the meantime are
+held back so that every subscriber still sees the snapshot in sequence order.
+
+The publisher only hooks into the engine while it has subscribers; with none,
+the engine's cost is a single ``is None`` check per book change. Frames go into
+a bounded queue per subscriber and a slow consumer loses its oldest frames
+(and is flagged with ``gap``), so publishing never waits on a reader.
+"""
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mini_matching_engine import MatchingEngine, Order, SYMBOLS, BUY
+
+FRAME_HEADER = struct.Struct('<I')
+SYMBOL_MESSAGE = struct.Struct('<BId16s')
+ADD_MESSAGE = struct.Struct('<BQIqBqq')
+REDUCE_MESSAGE = struct.Struct('<BQIqq')
+DELETE_MESSAGE = struct.Struct('<BQIq')
+TRADE_MESSAGE = struct.Struct('<BQIqqqq')
+LEVEL_MESSAGE = struct.Struct('<BQIBqqI')
+SNAPSHOT_MESSAGE = struct.Struct('<BQII')
+SNAPSHOT_ORDER_MESSAGE = struct.Struct('<BqBqq')
+# An L3 event and the level update it causes are always packed together
+ADD_LEVEL = struct.Struct('<' + ADD_MESSAGE.format[1:] + LEVEL_MESSAGE.format[1:])
+REDUCE_LEVEL = struct.Struct('<' + REDUCE_MESSAGE.format[1:] + LEVEL_MESSAGE.format[1:])
+DELETE_LEVEL = struct.Struct('<' + DELETE_MESSAGE.format[1:] + LEVEL_MESSAGE.format[1:])
+_A, _R, _D, _T, _L = b'ARDTL'
+MESSAGES = {
+    ord('Y'): SYMBOL_MESSAGE,
+    ord('A'): ADD_MESSAGE,
+    ord('R'): REDUCE_MESSAGE,
+    ord('D'): DELETE_MESSAGE,
+    ord('T'): TRADE_MESSAGE,
+    ord('L'): LEVEL_MESSAGE,
+    ord('S'): SNAPSHOT_MESSAGE,
+    ord('O'): SNAPSHOT_ORDER_MESSAGE,
+}
+
+def decode_frame(frame: bytes) -> Iterator[Tuple]:
+    """Yield each message in ``frame`` as a tuple whose first item is its type letter."""
+    count, = FRAME_HEADER.unpack_from(frame)
+    offset = FRAME_HEADER.size
+    for _ in range(count):
+        layout = MESSAGES[frame[offset]]
+        fields = layout.unpack_from(frame, offset)
+        offset += layout.size
+        if fields[0] == ord('Y'):
+            fields = fields[:3] + (fields[3].rstrip(b'\0').decode(),)
+        yield (chr(fields[0]),) + fields[1:]
+
+class Subscriber:
+    """Bounded queue of frames for one consumer."""
+    def __init__(self, max_frames: int = 1024):
+        self.frames = deque()
+        self.max_frames = max_frames
+        self.dropped = 0
+        # Set when frames were dropped; the consumer should skip to the next snapshot and clear it
+        self.gap = False
+
+    def deliver(self, frame: bytes):
+        if len(self.frames) >= self.max_frames:
+            self.frames.popleft()
+            self.dropped += 1
+            self.gap = True
+        self.frames.append(frame)
+
+    def poll(self) -> List[bytes]:
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+class MarketDataPublisher:
+    """Turns a MatchingEngine's book changes into a sequenced feed of binary frames.
+
+    Events are buffered and sent as one frame once ``max_batch`` events are
+    pending or when ``flush()`` is called, e.g. once per gateway tick. A
+    periodic snapshot goes out with the first flush after it has been built.
+    """
+    def __init__(self, engine: MatchingEngine, snapshot_interval: int = 10000, max_batch: int = 256):
+        self.engine = engine
+        self.snapshot_interval = snapshot_interval
+        self.max_batch = max_batch
+        self.subscribers: List[Subscriber] = []
+        self.sequence = 0
+        self.last_snapshot = 0
+        self.pending: List[bytes] = []
+        self.pending_messages = 0
+        self.announced = set()
+        # (symbol_id, side_id) -> ticks -> [quantity, orders], rebuilt from the book when the first subscriber joins
+        self.levels: Dict[Tuple[int, int], Dict[int, List[int]]] = {}
+        # order_id -> (symbol_id, side_id, ticks, quantity) in arrival order, rebuilt along with the levels
+        self.resting: Dict[int, Tuple[int, int, int, int]] = {}
+        # While a snapshot is being built from ``resting``: changes since, with None for a delete
+        self.overlay: Optional[Dict[int, Optional[Tuple[int, int, int, int]]]] = None
+        self.readded = set()
+        self.snapshot: Optional[Future] = None
+        self.held: List[bytes] = []
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def subscribe(self, max_frames: int = 1024) -> Subscriber:
+        if not self.subscribers:
+            self._attach()
+        else:
+            self.flush(wait=True)
+        subscriber = Subscriber(max_frames)
+        subscriber.deliver(self.snapshot_frame())
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.flush(wait=True)
+        self.subscribers.remove(subscriber)
+        if not self.subscribers:
+            self.engine.market_data = None
+            self.levels.clear()
+            self.resting.clear()
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def _attach(self):
+        self.levels.clear()
+        self.resting.clear()
+        self.announced.clear()
+        for order in self.engine.order_book.iter_orders():
+            level = self.levels.setdefault((order.symbol_id, order.side_id), {}).setdefault(order.ticks, [0, 0])
+            level[0] += order.quantity
+            level[1] += 1
+            self.resting[order.order_id] = (order.symbol_id, order.side_id, order.ticks, order.quantity)
+        self.engine.market_data = self
+
+    def _announce(self, symbol_id: int, messages: List[bytes]):
+        self.announced.add(symbol_id)
+        if messages is self.pending:
+            self.pending_messages += 1
+        messages.append(SYMBOL_MESSAGE.pack(ord('Y'), symbol_id, SYMBOLS.tick_sizes[symbol_id],
+                                            SYMBOLS.names[symbol_id].encode()[:16]))
+
+    def _level(self, symbol_id: int, side_id: int, ticks: int, quantity: int, orders: int) -> Tuple[int, int]:
+        """Apply a change to one level and return its new (quantity, orders)."""
+        key = (symbol_id, side_id)
+        levels = self.levels.get(key)
+        if levels is None:
+            levels = self.levels[key] = {}
+        level = levels.get(ticks)
+        if level is None:
+            levels[ticks] = [quantity, orders]
+            return quantity, orders
+        quantity = level[0] = level[0] + quantity
+        orders = level[1] = level[1] + orders
+        if orders == 0:
+            del levels[ticks]
+        return quantity, orders
+
+    # Engine callbacks, called only while attached
+
+    def on_add(self, order: Order):
+        symbol_id, side_id, ticks = order.symbol_id, order.side_id, order.ticks
+        if symbol_id not in self.announced:
+            self._announce(symbol_id, self.pending)
+        entry = (symbol_id, side_id, ticks, order.quantity)
+        overlay = self.overlay
+        if overlay is None:
+            self.resting[order.order_id] = entry
+        else:
+            # Re-inserted so the merge puts it behind the orders already resting
+            overlay.pop(order.order_id, None)
+            overlay[order.order_id] = entry
+            self.readded.add(order.order_id)
+        quantity, orders = self._level(symbol_id, side_id, ticks, order.quantity, 1)
+        sequence = self.sequence
+        self.sequence = sequence + 2
+        self.pending_messages += 2
+        self.pending.append(ADD_LEVEL.pack(_A, sequence + 1, symbol_id, order.order_id, side_id, ticks, order.quantity,
+                                           _L, sequence + 2, symbol_id, side_id, ticks, quantity, orders))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+
+    def on_reduce(self, order: Order, quantity: int):
+        """``order`` rests with ``quantity`` fewer shares; a reduction to zero is reported as a delete."""
+        symbol_id, side_id, ticks = order.symbol_id, order.side_id, order.ticks
+        overlay = self.overlay
+        if overlay is not None:
+            overlay[order.order_id] = (symbol_id, side_id, ticks, order.quantity) if order.quantity else None
+        elif order.quantity:
+            self.resting[order.order_id] = (symbol_id, side_id, ticks, order.quantity)
+        else:
+            del self.resting[order.order_id]
+        sequence = self.sequence
+        self.sequence = sequence + 2
+        self.pending_messages += 2
+        if order.quantity == 0:
+            level_quantity, orders = self._level(symbol_id, side_id, ticks, -quantity, -1)
+            self.pending.append(DELETE_LEVEL.pack(_D, sequence + 1, symbol_id, order.order_id,
+                                                  _L, sequence + 2, symbol_id, side_id, ticks, level_quantity, orders))
+        else:
+            level_quantity, orders = self._level(symbol_id, side_id, ticks, -quantity, 0)
+            self.pending.append(REDUCE_LEVEL.pack(_R, sequence + 1, symbol_id, order.order_id, order.quantity,
+                                                  _L, sequence + 2, symbol_id, side_id, ticks, level_quantity, orders))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+
+    def on_delete(self, order: Order):
+        symbol_id, side_id, ticks = order.symbol_id, order.side_id, order.ticks
+        if self.overlay is None:
+            del self.resting[order.order_id]
+        else:
+            self.overlay[order.order_id] = None
+        level_quantity, orders = self._level(symbol_id, side_id, ticks, -order.quantity, -1)
+        sequence = self.sequence
+        self.sequence = sequence + 2
+        self.pending_messages += 2
+        self.pending.append(DELETE_LEVEL.pack(_D, sequence + 1, symbol_id, order.order_id,
+                                              _L, sequence + 2, symbol_id, side_id, ticks, level_quantity, orders))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+
+    def on_trade(self, aggressor: Order, resting: Order, quantity: int):
+        self.sequence += 1
+        self.pending_messages += 1
+        self.pending.append(TRADE_MESSAGE.pack(_T, self.sequence, resting.symbol_id, aggressor.order_id,
+                                               resting.order_id, quantity, resting.ticks))
+        self.on_reduce(resting, quantity)
+
+    def flush(self, wait: bool = False):
+        """Send pending events as one frame, and any snapshot that has been built.
+
+        Starts building a snapshot if one is due. With ``wait``, first waits
+        for a snapshot that is still being built, so nothing is held back.
+        """
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self._broadcast(FRAME_HEADER.pack(self.pending_messages) + b''.join(pending))
+            self.pending_messages = 0
+        if self.snapshot is not None and (wait or self.snapshot.done()):
+            self._finish_snapshot()
+        if self.subscribers and self.snapshot is None and self.sequence - self.last_snapshot >= self.snapshot_interval:
+            self._start_snapshot()
+            if wait:
+                self._finish_snapshot()
+
+    def _broadcast(self, frame: bytes):
+        if self.snapshot is not None:
+            self.held.append(frame)
+            return
+        for subscriber in self.subscribers:
+            subscriber.deliver(frame)
+
+    def _start_snapshot(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='market-data')
+        self.last_snapshot = self.sequence
+        self.overlay = {}
+        self.snapshot = self.executor.submit(_snapshot_frame, self.resting, self.sequence, list(self.announced))
+
+    def _finish_snapshot(self):
+        frame = self.snapshot.result()
+        self.snapshot = None
+        self._broadcast(frame)
+        held, self.held = self.held, []
+        for frame in held:
+            self._broadcast(frame)
+        # Fold the changes made while the snapshot was built back into the mirror
+        resting, readded = self.resting, self.readded
+        for order_id, entry in self.overlay.items():
+            if entry is None:
+                resting.pop(order_id, None)
+            else:
+                if order_id in readded:
+                    resting.pop(order_id, None)
+                resting[order_id] = entry
+        self.overlay = None
+        readded.clear()
+
+    def snapshot_frame(self) -> bytes:
+        """Every symbol definition and resting order, as of the current sequence number."""
+        if self.snapshot is not None:
+            self._finish_snapshot()
+        self.last_snapshot = self.sequence
+        frame = _snapshot_frame(self.resting, self.sequence, list(self.announced))
+        self.announced.update(entry[0] for entry in self.resting.values())
+        return frame
+
+def _snapshot_frame(resting: Dict[int, Tuple[int, int, int, int]], sequence: int, announced: Iterable[int]) -> bytes:
+    """Build a snapshot frame from an L3 mirror that nothing else touches meanwhile."""
+    by_symbol: Dict[int, List[Tuple[int, int, int, int]]] = {}
+    for order_id, (symbol_id, side_id, ticks, quantity) in resting.items():
+        by_symbol.setdefault(symbol_id, []).append((order_id, side_id, ticks, quantity))
+    messages: List[bytes] = []
+    for symbol_id in sorted(set(announced) | by_symbol.keys()):
+        messages.append(SYMBOL_MESSAGE.pack(ord('Y'), symbol_id, SYMBOLS.tick_sizes[symbol_id],
+                                            SYMBOLS.names[symbol_id].encode()[:16]))
+        orders = by_symbol.get(symbol_id, [])
+        # Bids from the highest price and offers from the lowest; the sort is stable, so arrival order within a level
+        orders.sort(key=lambda o: (o[1], -o[2] if o[1] == BUY else o[2]))
+        messages.append(SNAPSHOT_MESSAGE.pack(ord('S'), sequence, symbol_id, len(orders)))
+        messages.extend(SNAPSHOT_ORDER_MESSAGE.pack(ord('O'), *order) for order in orders)
+    return FRAME_HEADER.pack(len(messages)) + b''.join(messages)
@@ -1,120 +1,990 @@
 from typing import List, Tuple, Dict
 from datetime import datetime
+from collections import deque
+import gc
 import heapq
+from bisect import bisect_left, insort
+from trade_tape import TradeTape
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for get_depth and add_orders
+    np = None
+
+# Enums are interned to small ints once, when an Order is built, so matching compares ints, not strings
+BUY, SELL = 0, 1
+SIDES = ('B', 'S')
+SIDE_IDS = {'B': BUY, 'S': SELL}
+MARKET, LIMIT, STOP, STOP_LIMIT = 0, 1, 2, 3
+ORDER_TYPES = ('M', 'L', 'S', 'SL')
+ORDER_TYPE_IDS = {'M': MARKET, 'L': LIMIT, 'S': STOP, 'SL': STOP_LIMIT}
+GTC, IOC = 0, 1
+TIME_IN_FORCE = ('GTC', 'IOC')
+TIME_IN_FORCE_IDS = {'GTC': GTC, 'IOC': IOC}
+
+DEFAULT_TICK_SIZE = 0.01
+
+# One row per price level, best first, as returned by get_depth
+DEPTH_DTYPE = [('price', 'f8'), ('quantity', 'i8'), ('orders', 'i4')]
+
+# add_orders results: one acknowledgement per input row, and one row per fill
+ACK_DTYPE = [('order_id', 'i8'), ('status', 'u1'), ('filled', 'i8'), ('resting', 'i8')]
+FILL_DTYPE = [('row', 'i8'), ('aggressor_id', 'i8'), ('resting_id', 'i8'), ('quantity', 'i8'), ('price', 'f8')]
+ACCEPTED, INVALID_SIDE, INVALID_TYPE, INVALID_TIME_IN_FORCE, INVALID_QUANTITY, INVALID_PRICE, DUPLICATE_ORDER_ID = range(7)
+BATCH_STATUSES = ('accepted', 'invalid side', 'invalid order type', 'invalid time in force', 'invalid quantity',
+                  'invalid price', 'duplicate order id')
+
+def _depth_array(rows: List[Tuple[float, int, int]]):
+    if np is None:
+        raise ImportError("numpy is required for get_depth")
+    depth = np.array(rows, dtype=DEPTH_DTYPE)
+    # Snapshots are cached and shared between callers
+    depth.flags.writeable = False
+    return depth
+
+class SymbolTable:
+    """Interns symbols to small ints and holds each symbol's tick size."""
+    def __init__(self):
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.tick_sizes: List[float] = []
+
+    def intern(self, symbol: str) -> int:
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.ids[symbol] = len(self.names)
+            self.names.append(symbol)
+            self.tick_sizes.append(DEFAULT_TICK_SIZE)
+        return symbol_id
+
+    def set_tick_size(self, symbol: str, tick_size: float):
+        """Must be called before orders for ``symbol`` are created; existing orders keep their ticks."""
+        self.tick_sizes[self.intern(symbol)] = tick_size
+
+    def to_ticks(self, symbol_id: int, price: float) -> int:
+        return round(price / self.tick_sizes[symbol_id])
+
+SYMBOLS = SymbolTable()
+
+def set_tick_size(symbol: str, tick_size: float):
+    SYMBOLS.set_tick_size(symbol, tick_size)
 
 class Order:
-    def __init__(self, order_id: int, timestamp: int, symbol: str, order_type: str, side: str, price: float, quantity: int, time_in_force: str = 'GTC'):
+    """An order as seen by the engine.
+
+    The constructor takes the user-facing strings and float price and interns
+    them: the book only looks at ``symbol_id``, ``side_id``, ``type_id`` and the
+    integer ``ticks``. ``price`` keeps the float that was given, for reporting.
+
+    Stop ('S') and stop-limit ('SL') orders also take a ``stop_price``. When the
+    last trade reaches it they become a market or a limit order at ``price``.
+
+    ``account`` is not used by matching; a risk_gate.RiskGate keys its limits on it.
+    """
+    __slots__ = ('order_id', 'timestamp', 'symbol_id', 'type_id', 'side_id', 'tif_id', '_price', 'ticks', 'quantity',
+                 'stop_price', 'stop_ticks', 'account')
+
+    def __init__(self, order_id: int, timestamp: int, symbol: str, order_type: str, side: str, price: float, quantity: int,
+                 time_in_force: str = 'GTC', stop_price: float = None, account=None):
         self.order_id = order_id
+        self.account = account
         self.timestamp = timestamp
-        self.symbol = symbol
-        self.order_type = order_type
-        self.side = side
+        self.symbol_id = SYMBOLS.intern(symbol)
+        self.type_id = ORDER_TYPE_IDS[order_type]
+        self.side_id = SIDE_IDS[side]
+        self.tif_id = TIME_IN_FORCE_IDS[time_in_force]
         self.price = price
         self.quantity = quantity
-        self.time_in_force = time_in_force
+        self.stop_price = stop_price
+        self.stop_ticks = None
+        if self.type_id >= STOP:
+            if stop_price is None:
+                raise ValueError(f"{order_type} orders need a stop_price")
+            self.stop_ticks = SYMBOLS.to_ticks(self.symbol_id, stop_price)
+
+    @property
+    def price(self) -> float:
+        return self._price
+
+    @price.setter
+    def price(self, price: float):
+        self._price = price
+        self.ticks = SYMBOLS.to_ticks(self.symbol_id, price)
+
+    @property
+    def symbol(self) -> str:
+        return SYMBOLS.names[self.symbol_id]
+
+    @property
+    def order_type(self) -> str:
+        return ORDER_TYPES[self.type_id]
+
+    @property
+    def side(self) -> str:
+        return SIDES[self.side_id]
+
+    @property
+    def time_in_force(self) -> str:
+        return TIME_IN_FORCE[self.tif_id]
 
     def __repr__(self):
         return f"Order({self.order_id}, {self.symbol}, {self.side}, {self.price}, {self.quantity}, {self.time_in_force})"
 
     def __lt__(self, other):
-        if self.price == other.price:
+        if self.ticks == other.ticks:
             return self.timestamp < other.timestamp
-        return self.price < other.price if self.side == 'S' else self.price > other.price
+        return self.ticks < other.ticks if self.side_id == SELL else self.ticks > other.ticks
 
 class OrderBook:
     def __init__(self):
         self.buy_orders = {}
         self.sell_orders = {}
+        self._sides = (self.buy_orders, self.sell_orders)
+        # order_id -> live heap entry; entries no longer indexed here are stale and dropped lazily
+        self.orders = {}
+        # Orders added so far; breaks timestamp ties by arrival, as a price level's queue does
+        self.arrivals = 0
 
     def add_order(self, order: Order):
-        if order.side == 'B':
-            heapq.heappush(self.buy_orders.setdefault(order.symbol, []), (-order.price, order.timestamp, order))
+        self.arrivals += 1
+        if order.side_id == BUY:
+            entry = (-order.ticks, order.timestamp, self.arrivals, order)
+            heapq.heappush(self.buy_orders.setdefault(order.symbol_id, []), entry)
+        else:
+            entry = (order.ticks, order.timestamp, self.arrivals, order)
+            heapq.heappush(self.sell_orders.setdefault(order.symbol_id, []), entry)
+        self.orders[order.order_id] = entry
+
+    def add_orders(self, orders):
+        for order in orders:
+            self.add_order(order)
+
+    def remove_order(self, order: Order):
+        entry = self.orders.pop(order.order_id, None)
+        if entry is None:
+            return
+        heap = self._sides[order.side_id].get(order.symbol_id)
+        if heap and heap[0] is entry:
+            heapq.heappop(heap)
+
+    def reduce_order(self, order: Order, quantity: int):
+        order.quantity -= quantity
+        if order.quantity == 0:
+            self.remove_order(order)
+
+    def get_order(self, order_id: int):
+        entry = self.orders.get(order_id)
+        return entry[3] if entry is not None else None
+
+    def _live_top(self, heap):
+        while heap and self.orders.get(heap[0][3].order_id) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def peek_best(self, symbol_id: int, side_id: int):
+        top = self._live_top(self._sides[side_id].get(symbol_id))
+        return top[3] if top is not None else None
+
+    def quantity_before(self, symbol_id: int, side_id: int, ticks: int, limit: int) -> int:
+        """Quantity resting on ``side_id`` at prices better than ``ticks``, counted until it reaches ``limit``.
+
+        The heap book has no per-level state, so this visits every live order on
+        the side; ``PriceLevelOrderBook`` reads only the levels it needs.
+        """
+        total = 0
+        for key, _, _, order in self._live_entries(self._sides[side_id].get(symbol_id)):
+            if order.ticks > ticks if side_id == BUY else order.ticks < ticks:
+                total += order.quantity
+        return total
+
+    def get_best_buy(self, symbol: str):
+        top = self._live_top(self.buy_orders.get(SYMBOLS.ids.get(symbol)))
+        return top[3].price if top is not None else None
+
+    def get_best_sell(self, symbol: str):
+        top = self._live_top(self.sell_orders.get(SYMBOLS.ids.get(symbol)))
+        return top[3].price if top is not None else None
+
+    def _live_entries(self, heap):
+        orders = self.orders
+        return [entry for entry in heap or () if orders.get(entry[3].order_id) is entry]
+
+    def iter_orders(self):
+        """Every resting order, grouped by symbol and side, in matching priority order."""
+        for sides in self._sides:
+            for heap in sides.values():
+                for entry in sorted(self._live_entries(heap)):
+                    yield entry[3]
+
+    def get_depth(self, symbol: str, n: int = 5):
+        """Top ``n`` price levels per side as ``DEPTH_DTYPE`` arrays, best first: ``(bids, asks)``.
+
+        The heap book has no per-level state, so this aggregates every live order on
+        each call; ``PriceLevelOrderBook`` answers the same query from a cache.
+        """
+        symbol_id = SYMBOLS.ids.get(symbol)
+        result = []
+        for heap in (self.buy_orders.get(symbol_id), self.sell_orders.get(symbol_id)):
+            levels = {}
+            for key, _, _, order in self._live_entries(heap):
+                level = levels.get(key)
+                if level is None:
+                    levels[key] = [order.price, order.quantity, 1]
+                else:
+                    level[1] += order.quantity
+                    level[2] += 1
+            result.append(_depth_array([tuple(levels[key]) for key in heapq.nsmallest(n, levels)]))
+        return tuple(result)
+
+    def get_order_book_str(self, symbol: str):
+        symbol_id = SYMBOLS.ids.get(symbol)
+        # Entries order by (price, time) from the best, so only the shown orders need ranking
+        buy_orders = [(o[3].price, o[3].quantity) for o in heapq.nsmallest(5, self._live_entries(self.buy_orders.get(symbol_id)))]
+        sell_orders = [(o[3].price, o[3].quantity) for o in heapq.nsmallest(5, self._live_entries(self.sell_orders.get(symbol_id)))]
+
+        book_str = f"Order Book for {symbol}:\n"
+        book_str += "Buy Orders:\n"
+        for price, quantity in buy_orders:  # Show top 5 orders
+            book_str += f"  {price}: {quantity}\n"
+        book_str += "Sell Orders:\n"
+        for price, quantity in sell_orders:  # Show top 5 orders
+            book_str += f"  {price}: {quantity}\n"
+        return book_str
+
+class OrderNode:
+    """Link in a price level's FIFO queue; indexed by order_id for O(1) unlinking."""
+    __slots__ = ('order', 'level', 'prev', 'next')
+
+    def __init__(self, order: Order, level: 'PriceLevel'):
+        self.order = order
+        self.level = level
+        self.prev = None
+        self.next = None
+
+class PriceLevel:
+    """All resting orders at one price, oldest first."""
+    __slots__ = ('ticks', 'head', 'tail', 'quantity', 'count')
+
+    def __init__(self, ticks: int):
+        self.ticks = ticks
+        self.head = None
+        self.tail = None
+        self.quantity = 0
+        self.count = 0
+
+    def append(self, node: OrderNode):
+        node.prev = self.tail
+        if self.tail is None:
+            self.head = node
+        else:
+            self.tail.next = node
+        self.tail = node
+        self.quantity += node.order.quantity
+        self.count += 1
+
+    def unlink(self, node: OrderNode):
+        if node.prev is None:
+            self.head = node.next
         else:
-            heapq.heappush(self.sell_orders.setdefault(order.symbol, []), (order.price, order.timestamp, order))
+            node.prev.next = node.next
+        if node.next is None:
+            self.tail = node.prev
+        else:
+            node.next.prev = node.prev
+        node.prev = node.next = None
+        self.quantity -= node.order.quantity
+        self.count -= 1
+
+class BookSide:
+    """Price levels for one side of one symbol, with tick prices kept sorted ascending.
+
+    ``depth`` caches the last top-N snapshot. ``depth_limit`` is the tick price of
+    its worst level, or None when the snapshot holds every level; changes beyond
+    that price leave the snapshot valid.
+    """
+    __slots__ = ('is_buy', 'ticks', 'levels', 'depth', 'depth_limit')
+
+    def __init__(self, is_buy: bool):
+        self.is_buy = is_buy
+        self.ticks: List[int] = []
+        self.levels: Dict[int, PriceLevel] = {}
+        self.depth = None
+        self.depth_limit = None
+
+    def touch(self, ticks: int):
+        """Drop the cached depth snapshot if a change at ``ticks`` falls inside it."""
+        limit = self.depth_limit
+        if limit is None or (ticks >= limit if self.is_buy else ticks <= limit):
+            self.depth = None
+
+    def get_depth(self, n: int):
+        depth = self.depth
+        if depth is None or (len(depth) < n and self.depth_limit is not None):
+            rows = []
+            ticks = None
+            for level in self.iter_levels():
+                if len(rows) == n:
+                    break
+                rows.append((level.head.order.price, level.quantity, level.count))
+                ticks = level.ticks
+            depth = self.depth = _depth_array(rows)
+            self.depth_limit = ticks if len(rows) < len(self.ticks) else None
+        return depth[:n]
+
+    def best_level(self):
+        if not self.ticks:
+            return None
+        return self.levels[self.ticks[-1] if self.is_buy else self.ticks[0]]
+
+    def get_level(self, ticks: int) -> PriceLevel:
+        level = self.levels.get(ticks)
+        if level is None:
+            level = self.levels[ticks] = PriceLevel(ticks)
+            insort(self.ticks, ticks)
+        return level
+
+    def drop_level(self, level: PriceLevel):
+        del self.levels[level.ticks]
+        if self.is_buy and self.ticks[-1] == level.ticks:
+            self.ticks.pop()
+        elif not self.is_buy and self.ticks[0] == level.ticks:
+            del self.ticks[0]
+        else:
+            del self.ticks[bisect_left(self.ticks, level.ticks)]
+
+    def iter_levels(self):
+        ticks = reversed(self.ticks) if self.is_buy else self.ticks
+        for price in ticks:
+            yield self.levels[price]
+
+class PriceLevelOrderBook:
+    """Order book keyed by price level with FIFO queues and an order_id index.
+
+    Best bid/ask lookups are O(1), fills and cancels unlink a node in O(1) and
+    only touch the sorted price index when a level is created or emptied.
+    """
+    def __init__(self):
+        self.buy_orders: Dict[int, BookSide] = {}
+        self.sell_orders: Dict[int, BookSide] = {}
+        self._sides = (self.buy_orders, self.sell_orders)
+        self.orders: Dict[int, OrderNode] = {}
+
+    def _side(self, symbol_id: int, side_id: int, create: bool = False):
+        sides = self._sides[side_id]
+        book_side = sides.get(symbol_id)
+        if book_side is None and create:
+            book_side = sides[symbol_id] = BookSide(side_id == BUY)
+        return book_side
+
+    def add_order(self, order: Order):
+        book_side = self._side(order.symbol_id, order.side_id, create=True)
+        level = book_side.get_level(order.ticks)
+        node = OrderNode(order, level)
+        level.append(node)
+        self.orders[order.order_id] = node
+        if book_side.depth is not None:
+            book_side.touch(order.ticks)
+
+    def add_orders(self, orders):
+        """Rest ``orders`` in the given sequence; the side and level are looked up once per run at the same price."""
+        index = self.orders
+        symbol_id = side_id = ticks = level = None
+        for order in orders:
+            if order.ticks != ticks or order.symbol_id != symbol_id or order.side_id != side_id:
+                symbol_id, side_id, ticks = order.symbol_id, order.side_id, order.ticks
+                book_side = self._side(symbol_id, side_id, create=True)
+                level = book_side.get_level(ticks)
+                if book_side.depth is not None:
+                    book_side.touch(ticks)
+            node = OrderNode(order, level)
+            level.append(node)
+            index[order.order_id] = node
 
     def remove_order(self, order: Order):
-        if order.side == 'B':
-            self.buy_orders[order.symbol] = [o for o in self.buy_orders[order.symbol] if o[2].order_id != order.order_id]
-            heapq.heapify(self.buy_orders[order.symbol])
+        node = self.orders.pop(order.order_id, None)
+        if node is None:
+            return
+        level = node.level
+        level.unlink(node)
+        book_side = self._sides[order.side_id][order.symbol_id]
+        if level.count == 0:
+            book_side.drop_level(level)
+        if book_side.depth is not None:
+            book_side.touch(level.ticks)
+
+    def reduce_order(self, order: Order, quantity: int):
+        order.quantity -= quantity
+        node = self.orders.get(order.order_id)
+        if node is None:
+            return
+        node.level.quantity -= quantity
+        if order.quantity == 0:
+            # Already subtracted from the level, so unlink sees a zero quantity.
+            self.remove_order(order)
         else:
-            self.sell_orders[order.symbol] = [o for o in self.sell_orders[order.symbol] if o[2].order_id != order.order_id]
-            heapq.heapify(self.sell_orders[order.symbol])
+            book_side = self._sides[order.side_id][order.symbol_id]
+            if book_side.depth is not None:
+                book_side.touch(order.ticks)
+
+    def get_order(self, order_id: int):
+        node = self.orders.get(order_id)
+        return node.order if node is not None else None
+
+    def peek_best(self, symbol_id: int, side_id: int):
+        book_side = self._sides[side_id].get(symbol_id)
+        if book_side is None or not book_side.ticks:
+            return None
+        ticks = book_side.ticks
+        return book_side.levels[ticks[-1] if book_side.is_buy else ticks[0]].head.order
+
+    def quantity_before(self, symbol_id: int, side_id: int, ticks: int, limit: int) -> int:
+        """Quantity resting on ``side_id`` at prices better than ``ticks``, counted until it reaches ``limit``.
+
+        Walks levels from the best, so it reads only the levels an order of ``limit``
+        shares would trade through.
+        """
+        book_side = self._sides[side_id].get(symbol_id)
+        total = 0
+        if book_side is not None:
+            for level in book_side.iter_levels():
+                if total >= limit or (level.ticks <= ticks if book_side.is_buy else level.ticks >= ticks):
+                    break
+                total += level.quantity
+        return total
 
     def get_best_buy(self, symbol: str):
-        return -self.buy_orders[symbol][0][0] if symbol in self.buy_orders and self.buy_orders[symbol] else None
+        best = self.peek_best(SYMBOLS.ids.get(symbol), BUY)
+        return best.price if best is not None else None
 
     def get_best_sell(self, symbol: str):
-        return self.sell_orders[symbol][0][0] if symbol in self.sell_orders and self.sell_orders[symbol] else None
+        best = self.peek_best(SYMBOLS.ids.get(symbol), SELL)
+        return best.price if best is not None else None
+
+    def _top_orders(self, book_side, count: int):
+        rows = []
+        if book_side is None:
+            return rows
+        for level in book_side.iter_levels():
+            node = level.head
+            while node is not None and len(rows) < count:
+                rows.append((node.order.price, node.order.quantity))
+                node = node.next
+            if len(rows) == count:
+                break
+        return rows
+
+    def iter_orders(self):
+        """Every resting order, grouped by symbol and side, in matching priority order."""
+        for sides in self._sides:
+            for book_side in sides.values():
+                for level in book_side.iter_levels():
+                    node = level.head
+                    while node is not None:
+                        yield node.order
+                        node = node.next
+
+    def get_depth(self, symbol: str, n: int = 5):
+        """Top ``n`` price levels per side as ``DEPTH_DTYPE`` arrays, best first: ``(bids, asks)``.
+
+        Level quantities and order counts are kept up to date as orders come and go,
+        and each side caches its last snapshot until one of the levels in it changes,
+        so repeated polls cost O(n) at most. The arrays are read-only.
+        """
+        symbol_id = SYMBOLS.ids.get(symbol)
+        result = []
+        for sides in self._sides:
+            book_side = sides.get(symbol_id)
+            result.append(book_side.get_depth(n) if book_side is not None else _depth_array([]))
+        return tuple(result)
 
     def get_order_book_str(self, symbol: str):
-        buy_orders = sorted([(o[2].price, o[2].quantity) for o in self.buy_orders.get(symbol, [])], reverse=True)
-        sell_orders = sorted([(o[2].price, o[2].quantity) for o in self.sell_orders.get(symbol, [])])
-        
+        symbol_id = SYMBOLS.ids.get(symbol)
+        buy_orders = self._top_orders(self.buy_orders.get(symbol_id), 5)
+        sell_orders = self._top_orders(self.sell_orders.get(symbol_id), 5)
+
         book_str = f"Order Book for {symbol}:\n"
         book_str += "Buy Orders:\n"
-        for price, quantity in buy_orders[:5]:  # Show top 5 levels
+        for price, quantity in buy_orders:
             book_str += f"  {price}: {quantity}\n"
         book_str += "Sell Orders:\n"
-        for price, quantity in sell_orders[:5]:  # Show top 5 levels
+        for price, quantity in sell_orders:
             book_str += f"  {price}: {quantity}\n"
         return book_str
 
-class MatchingEngine:
+class StopBook:
+    """Resting stop orders, sorted by stop price per symbol and side.
+
+    Each side is a list of ``(key, -arrival, order)`` entries kept ascending, with
+    the stops a price move reaches first at the end. Buy stops trigger when the
+    last price rises to their stop, so they are keyed by ``-stop_ticks``. Sell
+    stops trigger when it falls to theirs and are keyed by ``stop_ticks``.
+    Releasing the k stops a price has crossed is one bisect and one slice off
+    the tail: O(log n + k).
+    """
     def __init__(self):
-        self.order_book = OrderBook()
-        self.matchbook: Dict[str, List[Tuple[Order, Order]]] = {}
+        self._sides = ({}, {})
+        # order_id -> entry, so a cancel can find the entry by bisecting on its key
+        self.orders: Dict[int, tuple] = {}
+        self.arrivals = 0
+        # Released stops waiting to run, oldest first
+        self.triggered = deque()
 
     def add_order(self, order: Order):
-        if order.order_type == 'M':
+        self.arrivals += 1
+        key = -order.stop_ticks if order.side_id == BUY else order.stop_ticks
+        entry = (key, -self.arrivals, order)
+        insort(self._sides[order.side_id].setdefault(order.symbol_id, []), entry)
+        self.orders[order.order_id] = entry
+
+    def remove_order(self, order_id: int):
+        """Take a resting stop off the book; returns it, or None if there is no such stop."""
+        entry = self.orders.pop(order_id, None)
+        if entry is None:
+            return None
+        order = entry[2]
+        stops = self._sides[order.side_id][order.symbol_id]
+        del stops[bisect_left(stops, entry[:2])]
+        return order
+
+    def get_order(self, order_id: int):
+        entry = self.orders.get(order_id)
+        return entry[2] if entry is not None else None
+
+    def trigger(self, symbol_id: int, last_ticks: int):
+        """Move every stop crossed by ``last_ticks`` to ``triggered``.
+
+        Buy stops are released before sell stops. Within a side, stops come out in
+        the order the price reached them, and then in order of arrival.
+        """
+        for side_id, threshold in ((BUY, -last_ticks), (SELL, last_ticks)):
+            stops = self._sides[side_id].get(symbol_id)
+            if not stops or stops[-1][0] < threshold:
+                continue
+            cut = bisect_left(stops, (threshold,))
+            released = stops[cut:]
+            del stops[cut:]
+            for entry in reversed(released):
+                del self.orders[entry[2].order_id]
+                self.triggered.append(entry[2])
+
+    def __len__(self):
+        return len(self.orders)
+
+class PrintFillSink:
+    """Default sink: reports every fill on the console."""
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        print(f"Matched: {symbol} - {quantity} @ {price}")
+
+class NullFillSink:
+    """Discards fills, for headless replays where only the final book matters."""
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        pass
+
+class MemoryFillSink:
+    """Keeps fills as (symbol, aggressor_id, resting_id, quantity, price) tuples."""
+    def __init__(self):
+        self.fills: List[Tuple[str, int, int, int, float]] = []
+
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        self.fills.append((symbol, aggressor.order_id, resting.order_id, quantity, price))
+
+class FileFillSink:
+    """Writes fills as CSV lines, batching them so the file is written in large chunks."""
+    def __init__(self, path: str, buffer_lines: int = 65536):
+        self.file = open(path, 'w', buffering=1 << 20)
+        self.buffer_lines = buffer_lines
+        self.pending: List[str] = []
+
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        self.pending.append(f"{symbol},{aggressor.order_id},{resting.order_id},{quantity},{price}\n")
+        if len(self.pending) >= self.buffer_lines:
+            self.flush()
+
+    def flush(self):
+        self.file.write(''.join(self.pending))
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class _FillBuffer:
+    """Stands in for the trade tape and fill sink during add_orders, tagging fills with the input row.
+
+    ``fills`` is flat, six items per fill: row, symbol, aggressor, resting order, quantity and price.
+    """
+    __slots__ = ('row', 'fills')
+
+    def __init__(self):
+        self.row = 0
+        self.fills = []
+
+    def append(self, symbol: str, aggressor_id: int, resting_id: int, quantity: int, price: float):
+        pass
+
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        self.fills += (self.row, symbol, aggressor, resting, quantity, price)
+
+def _batch_codes(values, ids: Dict[str, int], count: int):
+    """Map a column of string codes to ids, with -1 for unknown codes."""
+    unique, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    return np.array([ids.get(code, -1) for code in unique.tolist()] or [0], dtype=np.int64)[inverse.reshape(count)]
+
+class MatchingEngine:
+    def __init__(self, order_book=None, fill_sink=None, trade_tape: TradeTape = None):
+        # PriceLevelOrderBook by default; pass OrderBook() for the heap reference implementation.
+        self.order_book = order_book if order_book is not None else PriceLevelOrderBook()
+        self.fill_sink = fill_sink if fill_sink is not None else PrintFillSink()
+        # Pass TradeTape(capacity=...) to keep only the most recent trades in long sessions
+        self.trade_tape = trade_tape if trade_tape is not None else TradeTape()
+        # A market_data.MarketDataPublisher sets itself here while it has subscribers
+        self.market_data = None
+        self.stop_book = StopBook()
+        # symbol_id -> tick price of the symbol's last trade, which stops trigger on
+        self.last_ticks: Dict[int, int] = {}
+        # Latest timestamp of an order taken in; triggered stops join the book at this time
+        self.clock = 0
+
+    def add_order(self, order: Order):
+        if order.timestamp > self.clock:
+            self.clock = order.timestamp
+        if order.type_id == MARKET:
             self.process_market_order(order)
-        elif order.order_type == 'L':
+        elif order.type_id == LIMIT:
             self.process_limit_order(order)
-        
-        if order.quantity > 0 and order.time_in_force != 'IOC':
+        else:
+            # Stops stay off the book, and out of the market data, until they trigger
+            self.stop_book.add_order(order)
+            self.trigger_stops(order.symbol_id)
+            return
+
+        if order.quantity > 0 and order.tif_id != IOC:
             self.order_book.add_order(order)
+            if self.market_data is not None:
+                self.market_data.on_add(order)
+        if self.stop_book.orders:
+            self.trigger_stops(order.symbol_id)
+
+    def trigger_stops(self, symbol_id: int):
+        """Run the stops crossed by the symbol's last trade, and any stops their trades trigger in turn.
+
+        Triggered stops run one at a time, in the order they were released. A
+        stop triggered while another one runs waits its turn, rather than
+        cutting in. A triggered stop-limit that rests is timed at the trigger,
+        so it queues behind orders already resting at its price.
+        """
+        last_ticks = self.last_ticks.get(symbol_id)
+        if last_ticks is None:
+            return
+        triggered = self.stop_book.triggered
+        running = bool(triggered)
+        self.stop_book.trigger(symbol_id, last_ticks)
+        if running:
+            return
+        while triggered:
+            order = triggered[0]
+            if order.type_id == STOP:
+                # A triggered stop is a market order, and like one it never rests
+                order.type_id = MARKET
+                order.tif_id = IOC
+            else:
+                order.type_id = LIMIT
+            # Queue behind what already rests at the price, not from when the stop was placed
+            if order.timestamp < self.clock:
+                order.timestamp = self.clock
+            self.add_order(order)
+            triggered.popleft()
+
+    def add_orders(self, batch):
+        """Add a batch of orders given as columns; returns ``(acks, fills)`` as numpy arrays.
+
+        ``batch`` maps column names to equal-length sequences or arrays, and a
+        structured array works too. The columns are ``order_id``, ``symbol``,
+        ``side``, ``type``, ``price`` and ``quantity``, plus optional
+        ``time_in_force`` (default 'GTC'), ``timestamp`` (default now),
+        ``stop_price`` and ``account``. Codes are the strings ``Order`` takes.
+
+        Every row is validated up front, and rejected rows are skipped with a
+        status from ``BATCH_STATUSES``. Accepted orders are then processed in
+        input order, exactly as ``add_order`` would process them one at a time,
+        but each symbol's book sides are looked up once per batch and matching
+        runs without a method call per fill. The trade tape and fill sink get
+        the batch's fills, in order, once the batch is done.
+
+        ``acks`` has one ``ACK_DTYPE`` row per input row, with each order's filled
+        and resting quantity once the batch is done. ``fills`` has one
+        ``FILL_DTYPE`` row per fill, where ``row`` is the input row whose order
+        caused it; a stop that order triggers fills under the same row.
+        """
+        if np is None:
+            raise ImportError("numpy is required for add_orders")
+        # A batch creates orders, nodes and fills by the thousand and frees none of
+        # them, so automatic collections would only rescan the heap.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self._add_orders(batch)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _add_orders(self, batch):
+        columns = batch.dtype.names if hasattr(batch, 'dtype') else batch
+        order_ids = np.asarray(batch['order_id'], dtype=np.int64).ravel()
+        count = len(order_ids)
+        quantities = np.asarray(batch['quantity']).ravel()
+        prices = np.asarray(batch['price'], dtype=np.float64).ravel()
+        side_ids = _batch_codes(batch['side'], SIDE_IDS, count)
+        type_ids = _batch_codes(batch['type'], ORDER_TYPE_IDS, count)
+        tif_ids = (_batch_codes(batch['time_in_force'], TIME_IN_FORCE_IDS, count) if 'time_in_force' in columns
+                   else np.full(count, GTC, dtype=np.int64))
+        stop_prices = (np.asarray(batch['stop_price'], dtype=np.float64).ravel() if 'stop_price' in columns
+                       else np.full(count, np.nan))
+        names, inverse = np.unique(np.asarray(batch['symbol']).astype(str), return_inverse=True)
+        symbol_ids = np.array([SYMBOLS.intern(name) for name in names.tolist()] or [0], dtype=np.int64)[inverse.reshape(count)]
+
+        # Duplicates of an earlier row, or of an order already on the book or the stop book
+        duplicate = np.ones(count, dtype=bool)
+        duplicate[np.unique(order_ids, return_index=True)[1]] = False
+        book_index, stop_index = self.order_book.orders, self.stop_book.orders
+        if book_index or stop_index:
+            duplicate |= np.fromiter((order_id in book_index or order_id in stop_index for order_id in order_ids.tolist()),
+                                     dtype=bool, count=count)
+        stops = type_ids >= STOP
+        priced = (type_ids == LIMIT) | (type_ids == STOP_LIMIT)
+        bad_quantity = ~(quantities > 0)
+        if quantities.dtype.kind == 'f':
+            bad_quantity |= quantities != np.floor(quantities)
+        bad_price = (~np.isfinite(prices) | (priced & ~(prices > 0))
+                     | (stops & ~(np.isfinite(stop_prices) & (stop_prices > 0))))
+        # The first check a row fails is the one reported
+        status = np.select([side_ids < 0, type_ids < 0, tif_ids < 0, bad_quantity, bad_price, duplicate],
+                           [INVALID_SIDE, INVALID_TYPE, INVALID_TIME_IN_FORCE, INVALID_QUANTITY, INVALID_PRICE,
+                            DUPLICATE_ORDER_ID], ACCEPTED).astype(np.uint8)
+        accepted = np.flatnonzero(status == ACCEPTED)
+        requested = quantities[accepted].astype(np.int64)
+
+        # Ticks as SymbolTable.to_ticks rounds them, for every row at once
+        tick_sizes = np.asarray(SYMBOLS.tick_sizes)[symbol_ids[accepted]]
+        ticks = np.rint(prices[accepted] / tick_sizes).astype(np.int64)
+        timestamps = (np.asarray(batch['timestamp']).ravel()[accepted].tolist() if 'timestamp' in columns
+                      else [int(datetime.now().timestamp())] * len(accepted))
+        accounts = (np.asarray(batch['account']).ravel()[accepted].tolist() if 'account' in columns
+                    else [None] * len(accepted))
+        orders = []
+        new, append = Order.__new__, orders.append
+        for order_id, timestamp, symbol_id, type_id, side_id, tif_id, price, tick, quantity, account in zip(
+                order_ids[accepted].tolist(), timestamps, symbol_ids[accepted].tolist(), type_ids[accepted].tolist(),
+                side_ids[accepted].tolist(), tif_ids[accepted].tolist(), prices[accepted].tolist(), ticks.tolist(),
+                requested.tolist(), accounts):
+            order = new(Order)
+            order.order_id = order_id
+            order.timestamp = timestamp
+            order.symbol_id = symbol_id
+            order.type_id = type_id
+            order.side_id = side_id
+            order.tif_id = tif_id
+            order._price = price
+            order.ticks = tick
+            order.quantity = quantity
+            order.stop_price = order.stop_ticks = None
+            order.account = account
+            append(order)
+        stop_rows = np.flatnonzero(stops[accepted])
+        stop_ticks = np.rint(stop_prices[accepted][stop_rows] / tick_sizes[stop_rows]).astype(np.int64)
+        for i, stop_price, stop_tick in zip(stop_rows.tolist(), stop_prices[accepted][stop_rows].tolist(), stop_ticks.tolist()):
+            orders[i].stop_price = stop_price
+            orders[i].stop_ticks = stop_tick
+
+        buffer = _FillBuffer()
+        trade_tape, fill_sink = self.trade_tape, self.fill_sink
+        # Fills made through match_orders, by stops or the generic path, land in the same buffer
+        self.trade_tape = self.fill_sink = buffer
+        try:
+            if self.market_data is None and type(self.order_book) is PriceLevelOrderBook:
+                self._add_batch(buffer, orders, accepted.tolist())
+            else:
+                for row, order in zip(accepted.tolist(), orders):
+                    buffer.row = row
+                    self.add_order(order)
+        finally:
+            self.trade_tape, self.fill_sink = trade_tape, fill_sink
+
+        recorded = buffer.fills
+        fills = np.empty(len(recorded) // 6, dtype=FILL_DTYPE)
+        if recorded:
+            symbols, aggressors, resting, filled, fill_prices = (recorded[i::6] for i in range(1, 6))
+            fills['row'], fills['quantity'], fills['price'] = recorded[0::6], filled, fill_prices
+            fills['aggressor_id'] = [order.order_id for order in aggressors]
+            fills['resting_id'] = [order.order_id for order in resting]
+            trade_tape.extend(symbols, fills['aggressor_id'], fills['resting_id'], fills['quantity'], fills['price'])
+            on_fill = fill_sink.on_fill
+            for fill in zip(symbols, aggressors, resting, filled, fill_prices):
+                on_fill(*fill)
+
+        acks = np.zeros(count, dtype=ACK_DTYPE)
+        acks['order_id'], acks['status'] = order_ids, status
+        remaining = np.fromiter((order.quantity for order in orders), dtype=np.int64, count=len(orders))
+        acks['filled'][accepted] = requested - remaining
+        # Whatever is left of an order either rests, on the book or as a stop, or was cancelled as IOC
+        left = np.flatnonzero(remaining)
+        acks['resting'][accepted[left]] = [
+            quantity if order_id in book_index or order_id in stop_index else 0
+            for order_id, quantity in zip(order_ids[accepted[left]].tolist(), remaining[left].tolist())]
+        return acks, fills
+
+    def _add_batch(self, buffer: _FillBuffer, orders: List[Order], rows: List[int]):
+        """add_order for each of ``orders`` on a PriceLevelOrderBook, with match_orders inlined."""
+        book = self.order_book
+        index = book.orders
+        stop_book, last_ticks, names = self.stop_book, self.last_ticks, SYMBOLS.names
+        record = buffer.fills.extend
+        sides = {}  # symbol_id -> [bids, asks], fetched once per symbol
+        for row, order in zip(rows, orders):
+            buffer.row = row
+            type_id, symbol_id = order.type_id, order.symbol_id
+            if type_id >= STOP:
+                self.add_order(order)
+                continue
+            if order.timestamp > self.clock:
+                self.clock = order.timestamp
+            pair = sides.get(symbol_id)
+            if pair is None:
+                pair = sides[symbol_id] = [book.buy_orders.get(symbol_id), book.sell_orders.get(symbol_id)]
+            is_buy = order.side_id == BUY
+            opposite_id = SELL if is_buy else BUY
+            opposite = pair[opposite_id]
+            if opposite is None:  # a triggered stop may have created it since
+                opposite = pair[opposite_id] = book._sides[opposite_id].get(symbol_id)
+            if opposite is not None and opposite.ticks:
+                ticks, levels = opposite.ticks, opposite.levels
+                symbol = names[symbol_id]
+                last = None
+                while ticks and order.quantity > 0:
+                    level = levels[ticks[0] if is_buy else ticks[-1]]
+                    node = level.head
+                    best = node.order
+                    if type_id == LIMIT and (order.ticks < best.ticks if is_buy else order.ticks > best.ticks):
+                        break
+                    quantity = min(order.quantity, best.quantity)
+                    order.quantity -= quantity
+                    best.quantity -= quantity
+                    level.quantity -= quantity
+                    last = best.ticks
+                    record((row, symbol, order, best, quantity, best._price))
+                    if best.quantity == 0:
+                        # Unlink the filled head, as remove_order would
+                        del index[best.order_id]
+                        head = level.head = node.next
+                        node.next = None
+                        level.count -= 1
+                        if head is None:
+                            level.tail = None
+                            opposite.drop_level(level)
+                        else:
+                            head.prev = None
+                    if opposite.depth is not None:
+                        opposite.touch(last)
+                if last is not None:
+                    last_ticks[symbol_id] = last
+
+            if order.quantity > 0 and order.tif_id != IOC:
+                own = pair[order.side_id]
+                if own is None:
+                    own = pair[order.side_id] = book._side(symbol_id, order.side_id, create=True)
+                level = own.levels.get(order.ticks) or own.get_level(order.ticks)
+                node = OrderNode(order, level)
+                level.append(node)
+                index[order.order_id] = node
+                if own.depth is not None:
+                    own.touch(order.ticks)
+            if stop_book.orders:
+                self.trigger_stops(symbol_id)
+
+    def cancel_order(self, order_id: int) -> bool:
+        order = self.order_book.get_order(order_id)
+        if order is None:
+            return self.stop_book.remove_order(order_id) is not None
+        self.order_book.remove_order(order)
+        if self.market_data is not None:
+            self.market_data.on_delete(order)
+        return True
+
+    def amend_order(self, order_id: int, price: float, quantity: int, timestamp: int = None) -> bool:
+        order = self.order_book.get_order(order_id)
+        if order is None or quantity <= 0:
+            return False
+        same_price = SYMBOLS.to_ticks(order.symbol_id, price) == order.ticks
+        if same_price and quantity == order.quantity:
+            return False
+
+        if same_price and quantity < order.quantity:
+            # Quantity down keeps the order's place in the queue
+            reduction = order.quantity - quantity
+            self.order_book.reduce_order(order, reduction)
+            if self.market_data is not None:
+                self.market_data.on_reduce(order, reduction)
+            return True
+
+        # Price change or quantity up loses priority and may cross the book
+        self.order_book.remove_order(order)
+        if self.market_data is not None:
+            self.market_data.on_delete(order)
+        order.price = price
+        order.quantity = quantity
+        order.timestamp = timestamp if timestamp is not None else int(datetime.now().timestamp())
+        self.add_order(order)
+        return True
 
     def process_market_order(self, order: Order):
-        opposite_side = 'S' if order.side == 'B' else 'B'
-        opposite_orders = self.order_book.sell_orders.get(order.symbol, []) if order.side == 'B' else self.order_book.buy_orders.get(order.symbol, [])
-        
-        while order.quantity > 0 and opposite_orders:
-            best_order = heapq.heappop(opposite_orders)[2]
+        opposite_side = SELL if order.side_id == BUY else BUY
+
+        while order.quantity > 0:
+            best_order = self.order_book.peek_best(order.symbol_id, opposite_side)
+            if best_order is None:
+                break
             matched_quantity = min(order.quantity, best_order.quantity)
             self.match_orders(order, best_order, matched_quantity)
-            
-            if best_order.quantity > 0:
-                heapq.heappush(opposite_orders, (best_order.price, best_order.timestamp, best_order))
 
     def process_limit_order(self, order: Order):
-        opposite_side = 'S' if order.side == 'B' else 'B'
-        opposite_orders = self.order_book.sell_orders.get(order.symbol, []) if order.side == 'B' else self.order_book.buy_orders.get(order.symbol, [])
-        
-        while order.quantity > 0 and opposite_orders:
-            best_order = opposite_orders[0][2]
-            if (order.side == 'B' and order.price >= best_order.price) or (order.side == 'S' and order.price <= best_order.price):
-                heapq.heappop(opposite_orders)
+        is_buy = order.side_id == BUY
+        opposite_side = SELL if is_buy else BUY
+
+        while order.quantity > 0:
+            best_order = self.order_book.peek_best(order.symbol_id, opposite_side)
+            if best_order is None:
+                break
+            if (is_buy and order.ticks >= best_order.ticks) or (not is_buy and order.ticks <= best_order.ticks):
                 matched_quantity = min(order.quantity, best_order.quantity)
                 self.match_orders(order, best_order, matched_quantity)
-                
-                if best_order.quantity > 0:
-                    heapq.heappush(opposite_orders, (best_order.price, best_order.timestamp, best_order))
             else:
                 break
 
     def match_orders(self, order1: Order, order2: Order, quantity: int):
         price = order2.price  # Use the price of the resting order
         order1.quantity -= quantity
-        order2.quantity -= quantity
-        
-        if order2.quantity == 0:
-            self.order_book.remove_order(order2)
-        
-        self.matchbook.setdefault(order1.symbol, []).append((order1, order2, quantity, price))
-        print(f"Matched: {order1.symbol} - {quantity} @ {price}")
+        self.last_ticks[order1.symbol_id] = order2.ticks
+        # The book owns the resting order and drops it once it is fully filled
+        self.order_book.reduce_order(order2, quantity)
+        if self.market_data is not None:
+            self.market_data.on_trade(order1, order2, quantity)
+
+        symbol = SYMBOLS.names[order1.symbol_id]
+        self.trade_tape.append(symbol, order1.order_id, order2.order_id, quantity, price)
+        self.fill_sink.on_fill(symbol, order1, order2, quantity, price)
 
     def get_order_book(self, symbol: str):
         return self.order_book.get_order_book_str(symbol)
 
+    def get_depth(self, symbol: str, n: int = 5):
+        return self.order_book.get_depth(symbol, n)
+
 def main():
     engine = MatchingEngine()
     order_id = 1
@@ -135,17 +1005,23 @@ def main():
         order_id += 1
 
     while True:
-        command = input("Enter command (e.g., 'ADD,AAPL,L,B,150.5,10,GTC' or 'BOOK,AAPL' or 'EXIT'): ")
+        command = input("Enter command (e.g., 'ADD,AAPL,L,B,150.5,10,GTC', 'ADD,AAPL,SL,S,149,10,GTC,149.5', 'AMEND,7,150.5,5', 'CANCEL,7', 'BOOK,AAPL' or 'EXIT'): ")
         if command.upper() == 'EXIT':
             break
 
         parts = command.split(',')
         if parts[0].upper() == 'ADD':
             if len(parts) < 7:
-                print("Invalid ADD command. Format: ADD,SYMBOL,TYPE,SIDE,PRICE,QUANTITY,TIME_IN_FORCE")
+                print("Invalid ADD command. Format: ADD,SYMBOL,TYPE,SIDE,PRICE,QUANTITY,TIME_IN_FORCE[,STOP_PRICE]")
                 continue
             symbol, order_type, side, price, quantity, time_in_force = parts[1:7]
-            order = Order(order_id, int(datetime.now().timestamp()), symbol, order_type, side, float(price), int(quantity), time_in_force)
+            stop_price = float(parts[7]) if len(parts) > 7 else None
+            try:
+                order = Order(order_id, int(datetime.now().timestamp()), symbol, order_type, side, float(price), int(quantity),
+                              time_in_force, stop_price)
+            except ValueError as error:
+                print(f"Invalid ADD command: {error}")
+                continue
             engine.add_order(order)
             order_id += 1
             print(f"Added order: {order}")
@@ -155,8 +1031,24 @@ def main():
                 continue
             symbol = parts[1]
             print(engine.get_order_book(symbol))
+        elif parts[0].upper() == 'CANCEL':
+            if len(parts) < 2:
+                print("Invalid CANCEL command. Format: CANCEL,ORDER_ID")
+                continue
+            if engine.cancel_order(int(parts[1])):
+                print(f"Cancelled order: {parts[1]}")
+            else:
+                print(f"Cancel rejected: order {parts[1]} does not exist")
+        elif parts[0].upper() == 'AMEND':
+            if len(parts) < 4:
+                print("Invalid AMEND command. Format: AMEND,ORDER_ID,PRICE,QUANTITY")
+                continue
+            if engine.amend_order(int(parts[1]), float(parts[2]), int(parts[3])):
+                print(f"Amended order: {parts[1]}")
+            else:
+                print(f"Amend rejected: invalid amendment for order {parts[1]}")
         else:
-            print("Invalid command. Use ADD, BOOK, or EXIT.")
+            print("Invalid command. Use ADD, AMEND, CANCEL, BOOK, or EXIT.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,22 @@
-from mini_matching_engine import MatchingEngine, Order
+from mini_matching_engine import (MatchingEngine, Order, OrderBook, PriceLevelOrderBook, MemoryFillSink, NullFillSink,
+                                  ACCEPTED, BATCH_STATUSES, SYMBOLS, BUY, SELL)
+from order_replay import replay
+from trade_tape import TradeTape
+from market_data import MarketDataPublisher, decode_frame
+from journal import Journal, JournaledEngine, recover, JOURNAL_FILE, CANCEL_RECORD
+from sharded_engine import format_fill, match_sharded, match_single_process
+from gateway_client import run_load
+from order_gateway import OrderGateway, serve
+from instrumentation import Instrumentation
+from auction import CallAuction
+from risk_gate import RiskGate, RiskLimits, REASONS, SELF_TRADE, ACCEPTED as RISK_ACCEPTED
 from datetime import datetime
+from collections import Counter
+import asyncio
+import os
+import random
+import tempfile
+import time
 
 def print_separator():
     print("\n" + "="*50 + "\n")
@@ -76,6 +93,655 @@ def main():
         print(engine.get_order_book(symbol))
 
     print_separator()
+
+    # Test 7: Heap reference book and price-level book produce the same fills
+    print("Test 7: Comparing the heap and price-level order books")
+    flow = [
+        ('AAPL', 'L', 'S', 151.0, 30), ('AAPL', 'L', 'S', 150.5, 20), ('AAPL', 'L', 'S', 151.0, 40),
+        ('AAPL', 'L', 'B', 149.0, 25), ('AAPL', 'L', 'B', 151.0, 70), ('AAPL', 'M', 'S', 0, 30),
+        ('AAPL', 'L', 'B', 152.0, 50), ('AAPL', 'L', 'S', 148.0, 80),
+    ]
+    fills = {}
+    for name, book in [('heap', OrderBook()), ('level', PriceLevelOrderBook())]:
+        reference = MatchingEngine(book)
+        for i, (symbol, order_type, side, price, quantity) in enumerate(flow, start=1):
+            reference.add_order(Order(i, i, symbol, order_type, side, price, quantity, 'GTC' if order_type == 'L' else 'IOC'))
+        fills[name] = [trade[1:5] for trade in reference.trade_tape.trades('AAPL')]
+        print(reference.get_order_book('AAPL'))
+    assert fills['heap'] == fills['level'], "Heap and price-level books diverged"
+    print(f"Both books produced {len(fills['level'])} identical fills")
+
+    print_separator()
+
+    # Test 8: Cancel and amend resting orders
+    print("Test 8: Cancelling and amending resting orders")
+    for book in [OrderBook(), PriceLevelOrderBook()]:
+        amend_engine = MatchingEngine(book)
+        for i, (side, price, quantity) in enumerate([('S', 101.0, 10), ('S', 101.0, 20), ('S', 102.0, 30), ('B', 99.0, 40)], start=1):
+            amend_engine.add_order(Order(i, i, 'MSFT', 'L', side, price, quantity))
+        assert amend_engine.cancel_order(3)
+        assert not amend_engine.cancel_order(3), "Cancelling twice should be rejected"
+        assert amend_engine.amend_order(1, 101.0, 5, timestamp=5)  # quantity down keeps priority
+        assert not amend_engine.amend_order(1, 101.0, 5, timestamp=6)  # no change
+        assert amend_engine.amend_order(4, 101.0, 10, timestamp=7)  # price change crosses the book
+        matched = [(resting_id, qty) for _, _, resting_id, qty, _, _ in amend_engine.trade_tape.trades('MSFT')]
+        assert matched == [(1, 5), (2, 5)], f"Unexpected fills after amend: {matched}"
+        print(amend_engine.get_order_book('MSFT'))
+
+    print_separator()
+
+    # Test 9: Headless replay of both file formats into an in-memory fill sink
+    print("Test 9: Replaying an order file")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'orders.csv')
+        with open(path, 'w') as f:
+            f.write("ADD,AAPL,L,S,151.0,100,GTC\n"
+                    "N,10,0000002,AAPL,L,B,150.00,40\n"
+                    "A,10,0000003,AAPL,L,B,151.00,40\n"
+                    "N,11,0000004,AAPL,I,B,152.00,80\n"
+                    "X,11,0000005\n"
+                    "M,0000006\n")
+        sink = MemoryFillSink()
+        stats = replay(path, fill_sink=sink)
+    print(f"Replay stats: {stats['orders']} orders, {stats['amends']} amends, {stats['cancels']} cancels")
+    print(f"Fills: {sink.fills}")
+    assert sink.fills == [('AAPL', 10, 1, 40, 151.0), ('AAPL', 11, 1, 60, 151.0)]
+
+    # Stop lines keep their type and stop price, and an unknown type is an error rather than a limit
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'orders.csv')
+        with open(path, 'w') as f:
+            f.write("ADD,RPL,L,S,10.0,5,GTC\n"
+                    "ADD,RPL,L,S,10.5,5,GTC\n"
+                    "ADD,RPL,SL,B,10.5,3,GTC,10.0\n"
+                    "ADD,RPL,S,B,0,2,IOC,10.5\n"
+                    "ADD,RPL,L,B,10.0,1,GTC\n"
+                    "ADD,RPL,L,B,10.5,2,GTC\n")
+        engine = MatchingEngine(fill_sink=MemoryFillSink())
+        replay(path, engine)
+        assert [fill[1:4] for fill in engine.fill_sink.fills] == [(5, 1, 1), (3, 1, 3), (6, 1, 1), (6, 2, 1), (4, 2, 2)]
+        with open(path, 'a') as f:
+            f.write("ADD,RPL,X,B,10.0,1,GTC\n")
+        try:
+            replay(path)
+            assert False, "An unknown order type should not replay as a limit order"
+        except ValueError as error:
+            assert ':7:' in str(error)
+
+    print_separator()
+
+    # Test 10: Bounded trade tape keeps only the most recent fills
+    print("Test 10: Ring-buffer trade tape")
+    tape_engine = MatchingEngine(fill_sink=MemoryFillSink(), trade_tape=TradeTape(capacity=3))
+    tape_engine.add_order(Order(1, 1, 'GOOGL', 'L', 'S', 2505.0, 50))
+    for i in range(2, 7):
+        tape_engine.add_order(Order(i, i, 'GOOGL', 'L', 'B', 2505.0, 5))
+    print(f"Retained trades: {list(tape_engine.trade_tape)}")
+    assert len(tape_engine.trade_tape) == 3
+    assert [trade[1] for trade in tape_engine.trade_tape.trades('GOOGL')] == [4, 5, 6]
+
+    print_separator()
+
+    # Test 11: Symbol-sharded matching reproduces the single-process fill stream
+    print("Test 11: Sharded matching across worker processes")
+    records = []
+    for i in range(1, 2001):
+        symbol = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'NVDA'][i % 5]
+        price = 100.0 + (i * 37 % 21 - 10) / 10
+        records.append(('N', i, i, symbol, 'L', 'B' if i * 7 % 3 else 'S', price, i % 50 + 1, 'GTC'))
+        if i % 10 == 0:
+            records.append(('X', i - 5))
+    expected = ''.join(map(format_fill, match_single_process(records)))
+    for shards in (2, 3):
+        sharded = ''.join(map(format_fill, match_sharded(records, shards=shards, batch_size=64)))
+        assert sharded == expected, f"Sharded output differs with {shards} shards"
+    print(f"{expected.count(chr(10))} fills identical across 1, 2 and 3 shards")
+
+    print_separator()
+
+    # Test 12: TCP gateway round trip with the bundled load generator
+    print("Test 12: Driving the engine through the asyncio order gateway")
+
+    class RecordingGateway(OrderGateway):
+        """Keeps every line in the order the gateway handled it."""
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+
+        def _handle(self, connection, line):
+            self.lines.append(line.decode())
+            super()._handle(connection, line)
+
+    async def send_batch(gateway, lines, replies):
+        server = await serve('127.0.0.1', 0, gateway)
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+        writer.write(''.join(line + '\n' for line in lines).encode())
+        responses = [(await reader.readline()).decode().rstrip('\n') for _ in range(replies)]
+        writer.close()
+        await writer.wait_closed()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    batch_gateway = OrderGateway(MatchingEngine(fill_sink=MemoryFillSink()))
+    responses = asyncio.run(send_batch(batch_gateway, [
+        "N,a,AAPL,L,S,100.0,10,GTC", "N,b,AAPL,L,B,inf,10,GTC", "N,c,AAPL,L,B,nan,10,GTC", "N,d,AAPL,L,B,100.0,0,GTC",
+        "N,e,AAPL,L,B,100.0,-5,GTC", "N,f,AAPL,L,B,1e308,10,GTC", "N,g,AAPL,L,B,100.0,4,GTC", "A,h,1,inf,5", "B,i,AAPL",
+    ], replies=11))
+    print(responses)
+    assert batch_gateway.stats['batches'] == 1, "The lines should have been handled as one batch"
+    assert [response.split(',')[:2] for response in responses] == [
+        ['ACK', 'a'], ['REJ', 'b'], ['REJ', 'c'], ['REJ', 'd'], ['REJ', 'e'], ['REJ', 'f'],
+        ['ACK', 'g'], ['FILL', '2'], ['FILL', '1'], ['REJ', 'h'], ['BOOK', 'i']]
+    assert responses[-1] == "BOOK,i,AAPL,,100.0"
+    assert [(o.order_id, o.quantity) for o in batch_gateway.engine.order_book.iter_orders()] == [(1, 6)]
+
+    gateway = RecordingGateway()
+    load = asyncio.run(run_load('127.0.0.1', 0, connections=3, orders=300, window=32, cancel_ratio=0.2,
+                                symbol_count=3, seed=7, local=True, gateway=gateway))
+    print(f"{load['messages']} messages, responses {load['responses']}, p50 round trip {load['p50_us']:.0f}us")
+
+    # The same messages, in the order the gateway handled them, sent straight to an engine
+    direct = MatchingEngine(fill_sink=MemoryFillSink())
+    expected = Counter()
+    order_id = 0
+    for line in gateway.lines:
+        parts = line.split(',')
+        if parts[0] == 'N':
+            order_id += 1
+            symbol, order_type, side, price, quantity, time_in_force = parts[2:8]
+            direct.add_order(Order(order_id, order_id, symbol, order_type, side, float(price), int(quantity), time_in_force))
+            expected['ACK'] += 1
+        elif parts[0] == 'X':
+            expected['CXL OK' if direct.cancel_order(int(parts[2])) else 'CXL REJECT'] += 1
+    # Both sides of every fill are told
+    expected['FILL'] = 2 * len(direct.fill_sink.fills)
+    assert load['responses'] == dict(expected), f"Gateway responses {load['responses']} != direct run {dict(expected)}"
+    def resting(engine):
+        return sorted((o.order_id, o.symbol, o.side, o.price, o.quantity) for o in engine.order_book.iter_orders())
+    assert resting(gateway.engine) == resting(direct), "Gateway book differs from the direct run"
+    assert expected['CXL OK'] and expected['FILL'], "The flow should exercise cancels and fills"
+
+    print_separator()
+
+    # Test 13: Aggregated L2 depth, and the cached snapshot staying in step with the book
+    print("Test 13: Price-level depth snapshots")
+    for book in [OrderBook(), PriceLevelOrderBook()]:
+        depth_engine = MatchingEngine(book, fill_sink=MemoryFillSink())
+        for i, (side, price, quantity) in enumerate([('B', 99.0, 10), ('B', 99.0, 15), ('B', 98.5, 20), ('B', 97.0, 5),
+                                                     ('S', 101.0, 30), ('S', 100.5, 10)], start=1):
+            depth_engine.add_order(Order(i, i, 'NVDA', 'L', side, price, quantity))
+        bids, asks = depth_engine.get_depth('NVDA', 2)
+        print(f"Bids: {bids.tolist()}  Asks: {asks.tolist()}")
+        assert bids.tolist() == [(99.0, 25, 2), (98.5, 20, 1)]
+        assert asks.tolist() == [(100.5, 10, 1), (101.0, 30, 1)]
+
+        depth_engine.add_order(Order(7, 7, 'NVDA', 'L', 'B', 96.0, 50))  # below the top two: snapshot unchanged
+        assert depth_engine.get_depth('NVDA', 2)[0].tolist() == [(99.0, 25, 2), (98.5, 20, 1)]
+        depth_engine.add_order(Order(8, 8, 'NVDA', 'L', 'S', 99.0, 12))  # partially fills the best bid level
+        assert depth_engine.get_depth('NVDA', 2)[0].tolist() == [(99.0, 13, 1), (98.5, 20, 1)]
+        depth_engine.cancel_order(3)
+        assert depth_engine.get_depth('NVDA', 5)[0].tolist() == [(99.0, 13, 1), (97.0, 5, 1), (96.0, 50, 1)]
+        assert len(depth_engine.get_depth('MISSING')[1]) == 0
+
+    print_separator()
+
+    # Test 14: Rebuilding L2 depth from the market-data feed
+    print("Test 14: Sequenced market-data feed")
+    feed_engine = MatchingEngine(fill_sink=MemoryFillSink())
+    feed_engine.add_order(Order(1, 1, 'AMD', 'L', 'B', 120.0, 10))  # rests before anyone subscribes
+    publisher = MarketDataPublisher(feed_engine, snapshot_interval=50, max_batch=16)
+    subscriber = publisher.subscribe()
+    building = 0
+    for i in range(2, 200):
+        side = 'B' if i % 2 else 'S'
+        price = 120.0 + (i * 7 % 11 - 5) / 10
+        feed_engine.add_order(Order(i, i, 'AMD', 'L', side, price, i % 9 + 1))
+        if i % 15 == 0:
+            feed_engine.cancel_order(i - 3)
+        if i % 40 == 0:
+            feed_engine.amend_order(i - 1, 119.0, 20, timestamp=i)
+        # A due snapshot is built off the matching path and sent by a later flush
+        building += publisher.snapshot is not None
+    publisher.flush(wait=True)
+    assert building, "Periodic snapshots should be built on the publisher's thread"
+
+    levels, sequence, snapshots = {}, None, 0
+    for frame in subscriber.poll():
+        snapshot_levels = None
+        for message in decode_frame(frame):
+            if message[0] == 'S':
+                snapshots += 1
+                snapshot_levels = {}
+                # Each snapshot includes exactly the events sent before it
+                assert sequence is None or message[1] == sequence, "Snapshot out of sequence"
+                sequence = message[1]
+            elif message[0] == 'O':
+                _, _, side_id, ticks, quantity = message
+                level = snapshot_levels.setdefault((side_id, ticks), [0, 0])
+                level[0] += quantity
+                level[1] += 1
+            elif message[0] in 'ARDTL':
+                assert message[1] == sequence + 1, "Feed sequence numbers must be contiguous"
+                sequence = message[1]
+                if message[0] == 'L':
+                    _, _, _, side_id, ticks, quantity, orders = message
+                    levels[(side_id, ticks)] = [quantity, orders]
+        if snapshot_levels is not None:
+            if snapshots > 1:
+                assert snapshot_levels == {key: level for key, level in levels.items() if level[1]}, \
+                    "Snapshot disagrees with the events before it"
+            levels = snapshot_levels
+    assert snapshots > 2
+    for side_id, depth in enumerate(feed_engine.get_depth('AMD', 20)):
+        mirrored = sorted(((ticks, quantity, orders) for (s, ticks), (quantity, orders) in levels.items() if s == side_id and orders),
+                          reverse=side_id == 0)
+        assert [(quantity, orders) for _, quantity, orders in mirrored] == [(int(q), int(n)) for q, n in zip(depth['quantity'], depth['orders'])]
+    print(f"{sequence} events and {snapshots} snapshots; mirrored depth matches the book")
+
+    slow = publisher.subscribe(max_frames=2)
+    for i in range(200, 300):
+        feed_engine.add_order(Order(i, i, 'AMD', 'L', 'B', 110.0, 1))
+    publisher.flush()
+    assert slow.gap and slow.dropped > 0, "A slow subscriber should drop frames rather than block"
+    publisher.unsubscribe(slow)
+    publisher.unsubscribe(subscriber)
+    assert feed_engine.market_data is None
+
+    print_separator()
+
+    # Test 15: Recovering the book from a snapshot plus the journal tail
+    print("Test 15: Journal and snapshot recovery")
+
+    def book_state(engine):
+        return [(o.order_id, o.symbol, o.side, o.price, o.quantity, o.timestamp) for o in engine.order_book.iter_orders()]
+
+    def stop_state(engine):
+        stops = [(o.order_id, o.type_id, o.side, o.price, o.quantity, o.stop_price)
+                 for o in (entry[2] for entry in engine.stop_book.orders.values())]
+        return stops, {SYMBOLS.names[symbol_id]: ticks for symbol_id, ticks in engine.last_ticks.items()}, engine.clock
+
+    with tempfile.TemporaryDirectory() as tmp:
+        journaled = JournaledEngine(tmp, MatchingEngine(fill_sink=MemoryFillSink()), group_size=8)
+        for i in range(1, 401):
+            symbol = ['AAPL', 'MSFT', 'IBM'][i % 3]
+            journaled.add_order(Order(i, i, symbol, 'L', 'B' if i % 2 else 'S', 100.0 + (i * 13 % 9 - 4) / 4, i % 20 + 1))
+            if i % 5 == 0:
+                # Stops on both sides of the market, some resting across the snapshot and some triggering after it
+                stop_price = 100.0 + (i * 7 % 9 - 4) / 4
+                if i % 10:
+                    journaled.add_order(Order(1000 + i, i, symbol, 'S', 'S' if i % 3 else 'B', 0, 3, 'IOC', stop_price))
+                else:
+                    journaled.add_order(Order(1000 + i, i, symbol, 'SL', 'B' if i % 3 else 'S', stop_price, 4,
+                                              stop_price=stop_price))
+            if i % 35 == 0:
+                journaled.cancel_order(1000 + i - 15)
+            if i % 7 == 0:
+                journaled.cancel_order(i - 4)
+            if i % 11 == 0:
+                journaled.amend_order(i - 2, 100.0 + (i % 5) / 4, i % 30 + 1, timestamp=i)
+            if i == 250:
+                journaled.snapshot()
+        journaled.sync()
+        journaled.wait_for_snapshot()
+
+        recovered, stats = recover(tmp)
+        print(f"Recovered {stats['snapshot_orders']} snapshot orders + {stats['journal_records']} journal records in {stats['seconds'] * 1000:.1f}ms")
+        assert book_state(recovered) == book_state(journaled.engine), "Recovered book differs from the live book"
+        assert stop_state(recovered) == stop_state(journaled.engine), "Recovered stops differ from the live ones"
+        assert stats['snapshot_stops'] > 0 and len(journaled.engine.stop_book) > 0
+        assert stats['journal_records'] < 400, "Recovery should only replay the journal tail"
+
+        # A record torn by a crash mid-write is discarded
+        journaled.add_order(Order(999, 999, 'AAPL', 'L', 'B', 90.0, 5))
+        journaled.close()
+        with open(os.path.join(tmp, JOURNAL_FILE), 'r+b') as f:
+            f.truncate(os.path.getsize(f.name) - 3)
+        recovered, stats = recover(tmp)
+        assert stats['truncated_bytes'] > 0 and recovered.order_book.get_order(999) is None
+        assert book_state(recovered) == [row for row in book_state(journaled.engine) if row[0] != 999]
+        assert stop_state(recovered)[0] == stop_state(journaled.engine)[0]
+
+    # The last group of a burst is committed once its interval runs out, without waiting for more records
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = Journal(os.path.join(tmp, JOURNAL_FILE), group_size=1000, group_interval=0.2)
+        journal.append(CANCEL_RECORD.pack(ord('X'), 1))
+        journal.append(CANCEL_RECORD.pack(ord('X'), 2))
+        assert journal.commits == 0 and os.path.getsize(journal.path) == 0
+        deadline = time.monotonic() + 5
+        while journal.commits == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert journal.commits == 1 and os.path.getsize(journal.path) == 2 * CANCEL_RECORD.size
+        journal.close()
+        assert not journal.committer.is_alive()
+
+    # Stops after a snapshot trigger on the last trade and take the clock from before it
+    with tempfile.TemporaryDirectory() as tmp:
+        journaled = JournaledEngine(tmp, MatchingEngine(fill_sink=MemoryFillSink()))
+        journaled.add_order(Order(1, 10, 'JRN', 'L', 'S', 100.0, 10))
+        journaled.add_order(Order(2, 20, 'JRN', 'L', 'B', 100.0, 1))
+        journaled.snapshot()
+        journaled.wait_for_snapshot()
+        journaled.add_order(Order(3, 5, 'JRN', 'SL', 'B', 100.0, 2, stop_price=100.0))
+        journaled.add_order(Order(4, 6, 'JRN', 'SL', 'S', 101.0, 3, stop_price=100.0))
+        journaled.close()
+        recovered, stats = recover(tmp)
+        assert stats['snapshot_orders'] == 1 and stats['journal_records'] == 2
+        assert book_state(recovered) == book_state(journaled.engine) == [(1, 'JRN', 'S', 100.0, 7, 10), (4, 'JRN', 'S', 101.0, 3, 20)]
+
+    print_separator()
+
+    # Test 16: Sampled instrumentation leaves matching unchanged
+    print("Test 16: Instrumentation")
+
+    def run_flow(engine):
+        for i in range(1, 301):
+            engine.add_order(Order(i, i, 'AAPL', 'L', 'B' if i % 2 else 'S', 100.0 + (i * 7 % 5 - 2) / 4, i % 9 + 1))
+            if i % 10 == 0:
+                engine.cancel_order(i - 3)
+            if i % 15 == 0:
+                engine.amend_order(i - 1, 100.5, 4, timestamp=i)
+        engine.add_order(Order(301, 301, 'AAPL', 'M', 'B', 0, 50, 'IOC'))
+        return [(o.order_id, o.price, o.quantity) for o in engine.order_book.iter_orders()]
+
+    plain = MatchingEngine(fill_sink=MemoryFillSink())
+    instrumented = MatchingEngine(fill_sink=MemoryFillSink())
+    instrumentation = Instrumentation(sample_every=4).attach(instrumented)
+    assert run_flow(plain) == run_flow(instrumented), "Instrumentation changed the book"
+    assert plain.fill_sink.fills == instrumented.fill_sink.fills, "Instrumentation changed the fills"
+
+    snapshot = instrumentation.snapshot()
+    stages = snapshot['stages']
+    print(f"Counters {snapshot['counters']}, gauges {snapshot['gauges']}")
+    # Amends that re-add an order count as adds too
+    assert snapshot['counters']['add_order'] > 301 and snapshot['counters']['cancel_order'] == 30
+    assert snapshot['counters']['fills'] == len(instrumented.trade_tape)
+    assert snapshot['gauges']['resting_orders'] == len(instrumented.order_book.orders)
+    assert 0 < stages['add_order']['samples'] <= instrumentation.calls('add_order') // 4
+    assert stages['match_orders']['samples'] > 0 and stages['remove_order']['samples'] > 0
+    assert 'matching_engine_commands_total{command="amend_order"} 20' in instrumentation.to_prometheus()
+
+    instrumentation.detach()
+    assert 'add_order' not in vars(instrumented), "Detaching should restore the engine's own methods"
+
+    # Sampled calls run on shadows, so anything they reassign must reach the real engine
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    instrumentation = Instrumentation(sample_every=2).attach(engine)
+    engine.add_order(Order(1, 50, 'AAPL', 'SL', 'B', 100.0, 10, stop_price=100.0))
+    engine.add_order(Order(2, 300, 'AAPL', 'L', 'S', 100.0, 5))  # sampled
+    assert engine.clock == 300, "Sampled calls must advance the engine clock"
+    engine.add_order(Order(3, 120, 'AAPL', 'L', 'B', 100.0, 1))  # not sampled, and triggers the stop
+    assert engine.order_book.get_order(1).timestamp == 300, "A triggered stop-limit rests at the engine clock"
+    assert engine.order_book is not instrumentation.shadows[1][1], "The engine must keep its own book"
+    instrumentation.detach()
+    print_separator()
+
+    # Test 17: Stop and stop-limit orders
+    print("Test 17: Stop orders")
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    for i, (side, price) in enumerate([('S', 101.0), ('S', 102.0), ('S', 103.0), ('B', 99.0), ('B', 98.0)], start=1):
+        engine.add_order(Order(i, i, 'STP', 'L', side, price, 10))
+    # Buy stops triggered by the same trade run lowest stop first, then by arrival
+    engine.add_order(Order(10, 10, 'STP', 'S', 'B', 0, 5, 'IOC', stop_price=101.0))
+    engine.add_order(Order(11, 11, 'STP', 'S', 'B', 0, 5, 'IOC', stop_price=100.5))
+    engine.add_order(Order(12, 12, 'STP', 'SL', 'B', 101.0, 5, stop_price=101.0))
+    engine.add_order(Order(13, 13, 'STP', 'S', 'B', 0, 20, 'IOC', stop_price=102.0))  # triggered by the stops' own trades
+    engine.add_order(Order(14, 14, 'STP', 'S', 'S', 0, 5, 'IOC', stop_price=98.5))
+    assert len(engine.stop_book) == 5 and engine.order_book.get_order(10) is None, "Stops must stay off the book"
+    assert engine.cancel_order(14) and len(engine.stop_book) == 4
+
+    engine.fill_sink.fills.clear()
+    engine.add_order(Order(20, 20, 'STP', 'M', 'B', 0, 1, 'IOC'))
+    aggressors = [fill[1] for fill in engine.fill_sink.fills]
+    print(f"Fill aggressors: {aggressors}")
+    assert aggressors == [20, 11, 10, 10, 13, 13], "Stops must run in trigger order, cascades after them"
+    # Stop 10 reached 102, which released stop 13; stop-limit 12 found nothing left at 101 and rests
+    assert len(engine.stop_book) == 0 and engine.order_book.get_best_buy('STP') == 101.0
+
+    # A stop whose price has already traded triggers on arrival
+    engine.add_order(Order(21, 21, 'STP', 'SL', 'S', 97.0, 5, stop_price=104.0))
+    assert engine.order_book.get_order(21) is None and len(engine.stop_book) == 0
+
+    # A triggered stop-limit queues behind the orders already resting at its price, in both books
+    for book in (OrderBook(), PriceLevelOrderBook()):
+        engine = MatchingEngine(book, MemoryFillSink())
+        engine.add_order(Order(2, 2, 'STQ', 'SL', 'S', 100.0, 21, stop_price=103.0))
+        engine.add_order(Order(22, 22, 'STQ', 'L', 'S', 100.0, 24))
+        engine.add_order(Order(51, 51, 'STQ', 'L', 'B', 100.0, 6))
+        engine.add_order(Order(64, 64, 'STQ', 'L', 'B', 103.0, 11))
+        assert [fill[1:4] for fill in engine.fill_sink.fills] == [(51, 22, 6), (64, 22, 11)], type(book).__name__
+        assert engine.order_book.get_order(2).timestamp == 51
+        # Stamped at the trigger, it can tie with the order it triggered on, which arrived first
+        engine = MatchingEngine(type(book)(), MemoryFillSink())
+        for order in [Order(80, 1, 'STR', 'S', 'S', 0, 84, 'IOC', stop_price=183.80),
+                      Order(81, 2, 'STR', 'SL', 'B', 183.79, 26, stop_price=183.81),
+                      Order(82, 3, 'STR', 'L', 'S', 183.81, 96), Order(83, 4, 'STR', 'M', 'B', 0, 55, 'IOC'),
+                      Order(84, 5, 'STR', 'SL', 'S', 183.78, 99, stop_price=183.78),
+                      Order(85, 6, 'STR', 'L', 'B', 183.77, 63), Order(86, 7, 'STR', 'L', 'S', 183.78, 90),
+                      Order(87, 8, 'STR', 'L', 'S', 183.77, 19), Order(88, 9, 'STR', 'L', 'B', 183.81, 20)]:
+            engine.add_order(order)
+        assert engine.order_book.get_order(84).timestamp == engine.order_book.get_order(86).timestamp == 7
+        assert [fill[1:4] for fill in engine.fill_sink.fills[-2:]] == [(88, 87, 19), (88, 86, 1)], type(book).__name__
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    engine.add_orders({'order_id': [2, 22, 51, 64], 'symbol': ['STQ'] * 4, 'type': ['SL', 'L', 'L', 'L'],
+                       'side': ['S', 'S', 'B', 'B'], 'price': [100.0] * 3 + [103.0], 'quantity': [21, 24, 6, 11],
+                       'stop_price': [103.0, 0, 0, 0], 'timestamp': [2, 22, 51, 64]})
+    assert engine.order_book.get_order(22).quantity == 7 and engine.order_book.get_order(2).quantity == 21
+
+    # Tens of thousands of resting stops: a trade releases only the ones it crosses
+    engine = MatchingEngine(fill_sink=NullFillSink())
+    for i in range(1, 20001):
+        engine.add_order(Order(i, i, 'STPX', 'S', 'B', 0, 1, 'IOC', stop_price=100.0 + i / 100))
+    engine.add_order(Order(30001, 30001, 'STPX', 'L', 'S', 100.05, 1000))
+    engine.add_order(Order(30002, 30002, 'STPX', 'L', 'B', 100.05, 1))
+    assert len(engine.stop_book) == 20000 - 5 and engine.order_book.get_order(30001).quantity == 1000 - 6
+    print_separator()
+
+    # Test 18: Call auction
+    print("Test 18: Call auction")
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    engine.add_order(Order(1, 1, 'AUC', 'L', 'B', 10.0, 100))
+    auction = CallAuction(engine)
+    auction.start(['AUC'])
+    assert engine.order_book.get_order(1) is None, "Resting orders move into the auction"
+    for i, (order_type, side, price, quantity) in enumerate([('L', 'B', 10.2, 50), ('L', 'B', 10.1, 70), ('L', 'S', 9.9, 60),
+                                                             ('L', 'S', 10.1, 80), ('M', 'S', 0, 30), ('L', 'B', 10.3, 20),
+                                                             ('L', 'S', 10.5, 10)], start=2):
+        auction.add_order(Order(i, i, 'AUC', order_type, side, price, quantity, 'IOC' if order_type == 'M' else 'GTC'))
+    assert not engine.fill_sink.fills, "Nothing matches during the auction"
+    assert auction.indicative() == {'AUC': (10.1, 140)}
+    assert auction.uncross() == {'AUC': (10.1, 140)}
+    print(f"Auction fills: {engine.fill_sink.fills}")
+    # Market sell first, then by price; the best bids fill first
+    assert [fill[1:4] for fill in engine.fill_sink.fills] == [(7, 6, 20), (2, 6, 10), (2, 4, 40), (3, 4, 20), (3, 5, 50)]
+    assert engine.order_book.get_best_buy('AUC') == 10.0 and engine.order_book.get_order(5).quantity == 30
+
+    # Against a brute-force search over every price, on many random books opened at once
+    rng = random.Random(7)
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    auction = CallAuction(engine)
+    books = {f"AU{n}": [] for n in range(40)}
+    auction.start(books)
+    order_id = 1000
+    for symbol, book in books.items():
+        for _ in range(rng.randrange(1, 30)):
+            order_type = 'M' if rng.random() < 0.1 else 'L'
+            order = Order(order_id, order_id, symbol, order_type, rng.choice('BS'), 50 + rng.randrange(-5, 6) / 4, rng.randrange(1, 50),
+                          'IOC' if order_type == 'M' else 'GTC')
+            book.append((order.side, order.type_id, order.ticks, order.quantity))
+            auction.add_order(order)
+            order_id += 1
+    opened = auction.uncross()
+
+    for symbol, book in books.items():
+        best = None
+        for price in sorted({ticks for side, type_id, ticks, _ in book if type_id == 1}):
+            bids = sum(q for side, type_id, ticks, q in book if side == 'B' and (type_id == 0 or ticks >= price))
+            asks = sum(q for side, type_id, ticks, q in book if side == 'S' and (type_id == 0 or ticks <= price))
+            key = (-min(bids, asks), abs(bids - asks), price)
+            best = key if best is None or key < best else best
+        expected = -best[0] if best else 0
+        assert opened.get(symbol, (None, 0))[1] == expected, f"{symbol}: wrong auction volume"
+        fills = [fill for fill in engine.fill_sink.fills if fill[0] == symbol]
+        assert sum(fill[3] for fill in fills) == expected
+        if expected:
+            assert {fill[4] for fill in fills} == {opened[symbol][0]} and round(opened[symbol][0] * 100) == best[2]
+        bid, ask = engine.order_book.get_best_buy(symbol), engine.order_book.get_best_sell(symbol)
+        assert bid is None or ask is None or bid < ask, f"{symbol}: book left crossed"
+    print(f"Opened {len(opened)} of {len(books)} symbols in one uncross")
+    print_separator()
+
+    # Test 19: Bulk add_orders matches adding the same orders one at a time
+    print("Test 19: Bulk add_orders")
+    rng = random.Random(19)
+    rows = []
+    for order_id in range(5000, 7000):
+        order_type = rng.choice(['L'] * 8 + ['M', 'S', 'SL'])
+        rows.append({'order_id': order_id, 'timestamp': order_id, 'symbol': f"BK{rng.randrange(4)}", 'side': rng.choice('BS'),
+                     'type': order_type, 'price': 0.0 if order_type in ('M', 'S') else 20 + rng.randrange(-8, 9) / 100,
+                     'quantity': rng.randrange(1, 60), 'time_in_force': rng.choice(['GTC', 'GTC', 'IOC']),
+                     'stop_price': 20 + rng.randrange(-8, 9) / 100 if order_type in ('S', 'SL') else float('nan')})
+    single = MatchingEngine(fill_sink=MemoryFillSink())
+    for row in rows:
+        single.add_order(Order(row['order_id'], row['timestamp'], row['symbol'], row['type'], row['side'], row['price'],
+                               row['quantity'], row['time_in_force'], None if row['type'] in ('M', 'L') else row['stop_price']))
+    bulk = MatchingEngine(fill_sink=MemoryFillSink())
+    columns = {name: [row[name] for row in rows] for name in rows[0]}
+    results = [bulk.add_orders({name: values[start:start + 500] for name, values in columns.items()})
+               for start in range(0, len(rows), 500)]
+    assert all((acks['status'] == ACCEPTED).all() for acks, _ in results)
+    assert bulk.fill_sink.fills == single.fill_sink.fills, "Fills differ from one-at-a-time processing"
+    assert list(bulk.trade_tape) == list(single.trade_tape)
+    assert (sorted((o.order_id, o.quantity, o.ticks) for o in bulk.order_book.iter_orders())
+            == sorted((o.order_id, o.quantity, o.ticks) for o in single.order_book.iter_orders()))
+    assert sorted(bulk.stop_book.orders) == sorted(single.stop_book.orders)
+    fills = [fill for _, batch_fills in results for fill in batch_fills.tolist()]
+    assert [fill[1:] for fill in fills] == [fill[1:5] for fill in single.fill_sink.fills]
+    print(f"{len(fills)} fills from {len(rows)} orders in {len(results)} batches")
+
+    resting_id = next(bulk.order_book.iter_orders()).order_id
+    acks, fills = bulk.add_orders({'order_id': [resting_id, 9000, 9000, 9001, 9002, 9003, 9004, 9005],
+                                   'symbol': ['BK0'] * 8, 'side': ['B', 'B', 'S', 'X', 'S', 'B', 'S', 'B'],
+                                   'type': ['L', 'L', 'L', 'L', 'L', 'L', 'SL', 'L'],
+                                   'price': [20, 1, 1, 20, 20, 20, 20, -20], 'quantity': [1, 5, 5, 5, 0, 1.5, 5, 5]})
+    assert [BATCH_STATUSES[status] for status in acks['status']] == [
+        'duplicate order id', 'accepted', 'duplicate order id', 'invalid side', 'invalid quantity', 'invalid quantity',
+        'invalid price', 'invalid price']
+    assert acks[1].tolist() == (9000, ACCEPTED, 0, 5) and len(fills) == 0
+    print_separator()
+
+    # Test 20: Pre-trade risk gate
+    print("Test 20: Pre-trade risk gate")
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    gate = RiskGate(engine, RiskLimits(max_order_quantity=100, price_collar=0.1, max_open_notional=1300, max_position=125))
+    def outcome(accepted):
+        assert accepted == (gate.reason == RISK_ACCEPTED), "True exactly when the command went through"
+        return REASONS[gate.reason]
+    def gated(order_id, account, side, price, quantity, order_type='L'):
+        return outcome(gate.add_order(Order(order_id, order_id, 'RSK', order_type, side, price, quantity, account=account)))
+    assert gated(1, 'A', 'B', 10.0, 101) == 'order quantity'
+    assert gated(2, 'A', 'B', 10.0, 100) == 'accepted', "no reference price yet, so no collar"
+    assert gated(3, 'B', 'S', 12.0, 10) == 'price collar', "collared around the best bid before any trade"
+    assert gated(4, 'B', 'S', 10.8, 30) == 'accepted'
+    assert gated(5, 'A', 'S', 10.0, 10) == 'self trade'
+    assert gated(6, 'A', 'S', 0.0, 10, 'M') == 'self trade'
+    assert gated(7, 'A', 'B', 10.0, 40) == 'open notional'
+    assert gated(8, 'A', 'B', 10.0, 20) == 'accepted'
+    assert gated(9, 'A', 'B', 10.0, 6) == 'position', "120 resting buys plus 6 could take the position past 125"
+    assert outcome(gate.add_order(Order(10, 10, 'RSK', 'S', 'S', 0.0, 10, stop_price=9.0, account='A'))) == 'order type'
+    assert gate.rejections[RISK_ACCEPTED] == 0 and sum(gate.rejections) == 7
+    assert gated(11, 'B', 'S', 10.0, 30) == 'accepted'
+    assert gate.position('A', 'RSK') == 30 and gate.position('B', 'RSK') == -30
+    assert gate.open_notional('A') == 900 and gate.open_notional('B') == 30 * 10.8
+    assert gate.cancel_order(4) and gate.open_notional('B') == 0
+    assert outcome(gate.cancel_order(4)) == 'unknown order'
+    assert gated(12, 'A', 'S', 11.0, 10) == 'accepted', "collared around the last trade, and above A's own bids"
+    assert outcome(gate.amend_order(2, 10.0, 76)) == 'position'
+    assert outcome(gate.amend_order(2, 11.0, 50)) == 'self trade'
+    assert outcome(gate.amend_order(2, 10.0, 50)) == 'accepted' and gate.open_notional('A') == 810
+    assert outcome(gate.amend_order(2, 10.0, 50)) == 'engine rejected', "an amend that changes nothing"
+    assert gate.open_notional('A') == 810 and gate.amend_order(2, 10.0, 45) and gate.open_notional('A') == 760
+    assert outcome(gate.amend_order(99, 10.0, 5)) == 'unknown order'
+    assert [fill[3] for fill in engine.fill_sink.fills] == [30]
+
+    # Self-trade prevention lets an order through when outside liquidity covers it before the account's own price
+    for book in (OrderBook(), PriceLevelOrderBook()):
+        engine = MatchingEngine(book, MemoryFillSink())
+        gate = RiskGate(engine)
+        for order_id, account, price, quantity in ((1, 'A', 20.0, 10), (2, 'B', 10.0, 5), (3, 'C', 10.5, 5)):
+            assert gated(order_id, account, 'S', price, quantity) == 'accepted'
+        assert gated(4, 'A', 'B', 0.0, 10, 'M') == 'accepted', "B and C fill all of it, well ahead of A's offer"
+        assert gated(5, 'C', 'S', 11.0, 4) == 'accepted'
+        assert gated(6, 'A', 'B', 0.0, 5, 'M') == 'self trade', "only 4 shares rest ahead of A's offer"
+        assert gated(7, 'A', 'B', 19.0, 5) == 'accepted', "a limit that cannot reach A's offer"
+        assert [fill[1:4] for fill in engine.fill_sink.fills] == [(4, 2, 5), (4, 3, 5), (7, 5, 4)]
+        assert gate.position('A', 'RSK') == 14 and gate.open_notional('A') == 10 * 20.0 + 19.0
+
+    # Accounts without limits go straight to the engine and keep no state
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    gate = RiskGate(engine, RiskLimits(self_trade_prevention=False))
+    assert gated(1, 'A', 'S', 10.0, 5) == gated(2, 'A', 'B', 0.0, 5, 'M') == 'accepted'
+    assert gate.position('A', 'RSK') is None and gate.open_notional('A') is None
+    gate.set_limits('A', RiskLimits(max_position=50))
+    assert gated(3, 'A', 'S', 10.0, 5) == 'accepted' and gate.open_notional('A') == 50 and gate.position('A', 'RSK') == 0
+
+    # Tracked state follows the book: fills match an ungated engine, and a plain gate's, at every step
+    rng = random.Random(20)
+    plain, tracked_engine, untracked_engine = (MatchingEngine(fill_sink=MemoryFillSink()) for _ in range(3))
+    gate = RiskGate(tracked_engine, RiskLimits(max_position=10**9, self_trade_prevention=False))
+    untracked = RiskGate(untracked_engine, RiskLimits(self_trade_prevention=False))
+    gate.set_limits(4, RiskLimits(self_trade_prevention=False))  # trades against tracked orders between catch-ups
+    owners, positions = {}, {}
+    for order_id in range(1, 3001):
+        if order_id % 5 == 0:
+            target = order_id - rng.randrange(1, 40)
+            assert plain.cancel_order(target) == gate.cancel_order(target) == untracked.cancel_order(target)
+        elif order_id % 7 == 0:
+            target, price, quantity = order_id - rng.randrange(1, 40), 30 + rng.randrange(-10, 11) / 100, rng.randrange(1, 50)
+            if target in plain.order_book.orders:
+                amended = plain.amend_order(target, price, quantity, order_id)
+                assert gate.amend_order(target, price, quantity, order_id) == amended
+                assert untracked.amend_order(target, price, quantity, order_id) == amended
+        order_type = 'M' if rng.random() < 0.1 else 'L'
+        args = (order_id, order_id, f"RG{rng.randrange(3)}", order_type, rng.choice('BS'),
+                0.0 if order_type == 'M' else 30 + rng.randrange(-10, 11) / 100, rng.randrange(1, 50),
+                'IOC' if order_type == 'M' else 'GTC')
+        plain.add_order(Order(*args))
+        owners[order_id] = (rng.randrange(5), args[4])
+        assert gate.add_order(Order(*args, account=owners[order_id][0])) is True
+        assert untracked.add_order(Order(*args, account=owners[order_id][0])) is True
+        if order_id % 250 == 0:
+            positions = {}
+            for symbol, aggressor_id, resting_id, quantity, _ in tracked_engine.fill_sink.fills:
+                for account, side in (owners[aggressor_id], owners[resting_id]):
+                    positions[account, symbol] = positions.get((account, symbol), 0) + (quantity if side == 'B' else -quantity)
+            for account in range(4):
+                resting = [order for order in tracked_engine.order_book.iter_orders() if order.account == account]
+                assert abs(gate.open_notional(account) - sum(order.quantity * order.price for order in resting)) < 1e-6
+                for symbol in ('RG0', 'RG1', 'RG2'):
+                    assert gate.position(account, symbol) == positions.get((account, symbol), 0)
+                    exposure = gate.accounts[account].symbols.get(SYMBOLS.ids[symbol])
+                    for side_id in (BUY, SELL):
+                        ticks = sorted({order.ticks for order in resting if order.symbol == symbol and order.side_id == side_id})
+                        assert (exposure.ticks[side_id] if exposure is not None else []) == ticks
+    assert tracked_engine.fill_sink.fills == plain.fill_sink.fills == untracked_engine.fill_sink.fills, \
+        "the gate changed how orders matched"
+
+    # With self-trade prevention on, no fill ever has the same account on both sides
+    engine = MatchingEngine(fill_sink=MemoryFillSink())
+    gate = RiskGate(engine)
+    rejected = 0
+    for order_id in range(1, 3001):
+        order_type = 'M' if rng.random() < 0.2 else 'L'
+        order = Order(order_id, order_id, 'STPR', order_type, rng.choice('BS'),
+                      0.0 if order_type == 'M' else 30 + rng.randrange(-10, 11) / 100, rng.randrange(1, 50),
+                      'IOC' if order_type == 'M' else 'GTC', account=rng.randrange(5))
+        owners[order_id] = order.account
+        rejected += not gate.add_order(order)
+    assert all(owners[aggressor_id] != owners[resting_id] for _, aggressor_id, resting_id, _, _ in engine.fill_sink.fills)
+    assert gate.rejections[SELF_TRADE] == rejected and 0 < rejected < 3000
+    print(f"{len(plain.fill_sink.fills)} fills, identical with and without the gate; {rejected} self trades stopped")
+    print_separator()
     print("Test run completed.")
 
 if __name__ == "__main__":
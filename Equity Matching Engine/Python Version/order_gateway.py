@@ -0,0 +1,178 @@
+"""asyncio TCP gateway in front of MatchingEngine.
+
+Line protocol, one ASCII message per line. ``req`` is any token chosen by the
+client and echoed back so responses can be matched to requests.
+
+Client -> gateway:
+    N,<req>,<SYMBOL>,<TYPE>,<SIDE>,<PRICE>,<QTY>,<TIF>   new order
+    A,<req>,<ORDER_ID>,<PRICE>,<QTY>                     amend
+    X,<req>,<ORDER_ID>                                   cancel
+    B,<req>,<SYMBOL>                                     best bid/ask query
+
+Gateway -> client:
+    ACK,<req>,<ORDER_ID>                 order accepted (fills, if any, follow)
+    AMD,<req>,<ORDER_ID>,OK|REJECT
+    CXL,<req>,<ORDER_ID>,OK|REJECT
+    BOOK,<req>,<SYMBOL>,<BID>,<ASK>      empty field when a side is empty
+    FILL,<ORDER_ID>,<QTY>,<PRICE>        sent to the owner of each order that trades
+    REJ,<req>,<reason>                   malformed message, or a price that is not finite or a quantity below 1
+"""
+import argparse
+import asyncio
+import math
+from typing import Dict, List
+
+from mini_matching_engine import MatchingEngine, Order, SIDE_IDS, ORDER_TYPE_IDS, TIME_IN_FORCE_IDS
+from trade_tape import TradeTape
+
+class Connection:
+    __slots__ = ('writer', 'outgoing')
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.outgoing: List[str] = []
+
+class OrderGateway:
+    """Accepts many client connections and feeds their messages to one engine.
+
+    Messages that arrive during one event-loop tick are queued and processed
+    together in a single callback, and each connection's responses from that
+    batch go out in one write.
+    """
+    def __init__(self, engine: MatchingEngine = None):
+        self.engine = engine if engine is not None else MatchingEngine(trade_tape=TradeTape(capacity=1 << 16))
+        self.engine.fill_sink = self
+        self.pending = []
+        self.flush_scheduled = False
+        self.owners: Dict[int, Connection] = {}
+        self.next_order_id = 1
+        self.sequence = 0
+        self.dirty: List[Connection] = []
+        self.stats = {'messages': 0, 'batches': 0, 'fills': 0}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = Connection(writer)
+        loop = asyncio.get_running_loop()
+        buffered = b''
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                lines = (buffered + data).split(b'\n')
+                buffered = lines.pop()
+                self.pending.extend((connection, line) for line in lines if line)
+                if not self.flush_scheduled:
+                    self.flush_scheduled = True
+                    loop.call_soon(self.flush)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        self.stats['fills'] += 1
+        for order in (aggressor, resting):
+            owner = self.owners.get(order.order_id)
+            if owner is not None:
+                self._send(owner, f"FILL,{order.order_id},{quantity},{price}")
+        if resting.quantity == 0:
+            self.owners.pop(resting.order_id, None)
+
+    def _send(self, connection: Connection, message: str):
+        if not connection.outgoing:
+            self.dirty.append(connection)
+        connection.outgoing.append(message)
+
+    def flush(self):
+        """Process every message queued this tick, then write each connection's responses once."""
+        self.flush_scheduled = False
+        pending, self.pending = self.pending, []
+        self.stats['messages'] += len(pending)
+        self.stats['batches'] += 1
+        for connection, line in pending:
+            self._handle(connection, line)
+
+        for connection in self.dirty:
+            if not connection.writer.is_closing():
+                connection.writer.write(('\n'.join(connection.outgoing) + '\n').encode())
+            connection.outgoing.clear()
+        self.dirty.clear()
+
+    def _handle(self, connection: Connection, line: bytes):
+        parts = line.decode().strip().split(',')
+        kind = parts[0]
+        request = parts[1] if len(parts) > 1 else ''
+        try:
+            if kind == 'N':
+                symbol, order_type, side, price, quantity, time_in_force = parts[2:8]
+                if order_type not in ORDER_TYPE_IDS or side not in SIDE_IDS or time_in_force not in TIME_IN_FORCE_IDS:
+                    raise ValueError("invalid order details")
+                price, quantity = _price_and_quantity(price, quantity)
+                order_id = self.next_order_id
+                order = Order(order_id, self.sequence + 1, symbol, order_type, side, price, quantity, time_in_force)
+                self.next_order_id += 1
+                self.sequence += 1
+                self.owners[order_id] = connection
+                self._send(connection, f"ACK,{request},{order_id}")
+                self.engine.add_order(order)
+                if order.quantity == 0 or self.engine.order_book.get_order(order_id) is None:
+                    self.owners.pop(order_id, None)
+            elif kind == 'A':
+                order_id = int(parts[2])
+                price, quantity = _price_and_quantity(parts[3], parts[4])
+                self.sequence += 1
+                accepted = self.owners.get(order_id) is connection and \
+                    self.engine.amend_order(order_id, price, quantity, self.sequence)
+                self._send(connection, f"AMD,{request},{order_id},{'OK' if accepted else 'REJECT'}")
+                if accepted and self.engine.order_book.get_order(order_id) is None:
+                    self.owners.pop(order_id, None)
+            elif kind == 'X':
+                order_id = int(parts[2])
+                accepted = self.owners.get(order_id) is connection and self.engine.cancel_order(order_id)
+                if accepted:
+                    del self.owners[order_id]
+                self._send(connection, f"CXL,{request},{order_id},{'OK' if accepted else 'REJECT'}")
+            elif kind == 'B':
+                symbol = parts[2]
+                bid = self.engine.order_book.get_best_buy(symbol)
+                ask = self.engine.order_book.get_best_sell(symbol)
+                self._send(connection, f"BOOK,{request},{symbol},{'' if bid is None else bid},{'' if ask is None else ask}")
+            else:
+                raise ValueError("unknown message type")
+        except (ValueError, IndexError, ArithmeticError) as error:
+            # ArithmeticError covers prices too large to convert to ticks
+            self._send(connection, f"REJ,{request},{error}")
+
+def _price_and_quantity(price: str, quantity: str):
+    price, quantity = float(price), int(quantity)
+    if not math.isfinite(price):
+        raise ValueError("invalid price")
+    if quantity <= 0:
+        raise ValueError("invalid quantity")
+    return price, quantity
+
+async def serve(host: str = '127.0.0.1', port: int = 9000, gateway: OrderGateway = None) -> asyncio.AbstractServer:
+    gateway = gateway if gateway is not None else OrderGateway()
+    return await asyncio.start_server(gateway.handle_connection, host, port)
+
+async def _main(host: str, port: int):
+    gateway = OrderGateway()
+    server = await serve(host, port, gateway)
+    print(f"Order gateway listening on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve MatchingEngine over TCP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import time
+from typing import Iterator, Tuple
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink, MemoryFillSink, FileFillSink
+
+# Single-byte fields are mapped straight to the engine's strings so the hot loop never decodes them
+_SIDES = {b'B': 'B', b'S': 'S'}
+_TIME_IN_FORCE = {b'GTC': 'GTC', b'IOC': 'IOC'}
+_ORDER_TYPES = {b'M': 'M', b'L': 'L', b'S': 'S', b'SL': 'SL'}
+# C++ 'I' is an IOC limit; market orders never rest, so they are IOC as well
+_CPP_ORDER_TYPES = {b'L': ('L', 'GTC'), b'I': ('L', 'IOC'), b'M': ('M', 'IOC')}
+
+def iter_records(path: str) -> Iterator[Tuple]:
+    """Lazily parse an order file into plain command tuples.
+
+    Accepts the interactive format (``ADD,SYMBOL,TYPE,SIDE,PRICE,QTY,TIF[,STOP_PRICE]``) and the
+    C++ command format (``N``/``A``/``X``/``M`` lines, see ``CPP-Version/problem_statement.md``),
+    mixed freely. Lines are tokenized as bytes and each symbol is decoded once.
+
+    Yields ``('N', order_id, timestamp, symbol, order_type, side, price, quantity, time_in_force, stop_price)``,
+    ``('A', order_id, price, quantity, timestamp)`` or ``('X', order_id)``. ``M`` lines are
+    skipped because the engine matches continuously. An order type the format does not
+    define raises ``ValueError``.
+    """
+    symbols = {}
+    next_id = 1
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            parts = line.rstrip(b'\r\n').split(b',')
+            action = parts[0]
+            if action == b'ADD':
+                symbol = symbols.get(parts[1])
+                if symbol is None:
+                    symbol = symbols[parts[1]] = parts[1].decode()
+                order_type = _ORDER_TYPES.get(parts[2])
+                if order_type is None:
+                    raise ValueError(f"{path}:{line_number}: unknown order type {parts[2].decode()!r}")
+                time_in_force = _TIME_IN_FORCE[parts[6]] if len(parts) > 6 else 'GTC'
+                stop_price = float(parts[7]) if len(parts) > 7 and parts[7] else None
+                yield ('N', next_id, line_number, symbol, order_type, _SIDES[parts[3]], float(parts[4]), int(parts[5]),
+                       time_in_force, stop_price)
+                next_id += 1
+            elif action == b'N':
+                order_id = int(parts[1])
+                symbol = symbols.get(parts[3])
+                if symbol is None:
+                    symbol = symbols[parts[3]] = parts[3].decode()
+                types = _CPP_ORDER_TYPES.get(parts[4])
+                if types is None:
+                    raise ValueError(f"{path}:{line_number}: unknown order type {parts[4].decode()!r}")
+                order_type, time_in_force = types
+                yield ('N', order_id, int(parts[2]), symbol, order_type, _SIDES[parts[5]],
+                       float(parts[6]), int(parts[7]), time_in_force, None)
+                next_id = max(next_id, order_id + 1)
+            elif action == b'A':
+                yield ('A', int(parts[1]), float(parts[6]), int(parts[7]), int(parts[2]))
+            elif action == b'X':
+                yield ('X', int(parts[1]))
+
+def iter_commands(path: str) -> Iterator[Tuple]:
+    """Like ``iter_records`` but new orders are yielded as ``('N', Order)``."""
+    for record in iter_records(path):
+        if record[0] == 'N':
+            yield ('N', Order(*record[1:]))
+        else:
+            yield record
+
+def replay(path: str, engine: MatchingEngine = None, fill_sink=None) -> dict:
+    """Stream every command in ``path`` through ``engine`` and return replay statistics."""
+    if engine is None:
+        engine = MatchingEngine(fill_sink=fill_sink if fill_sink is not None else NullFillSink())
+    elif fill_sink is not None:
+        engine.fill_sink = fill_sink
+
+    add_order = engine.add_order
+    counts = {'N': 0, 'A': 0, 'X': 0}
+    start = time.perf_counter()
+    for command in iter_commands(path):
+        kind = command[0]
+        if kind == 'N':
+            add_order(command[1])
+        elif kind == 'A':
+            engine.amend_order(command[1], command[2], command[3], command[4])
+        else:
+            engine.cancel_order(command[1])
+        counts[kind] += 1
+    elapsed = time.perf_counter() - start
+
+    total = sum(counts.values())
+    return {
+        'commands': total,
+        'orders': counts['N'],
+        'amends': counts['A'],
+        'cancels': counts['X'],
+        'seconds': elapsed,
+        'commands_per_sec': total / elapsed if elapsed > 0 else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an order file through the matching engine without console I/O.")
+    parser.add_argument('path', help="order file in ADD,... or N/A/X/M format")
+    parser.add_argument('--sink', choices=['null', 'memory', 'file'], default='null', help="where fills are sent")
+    parser.add_argument('--output', default='fills.csv', help="fill file for --sink file")
+    args = parser.parse_args()
+
+    if args.sink == 'file':
+        fill_sink = FileFillSink(args.output)
+    elif args.sink == 'memory':
+        fill_sink = MemoryFillSink()
+    else:
+        fill_sink = NullFillSink()
+
+    stats = replay(args.path, fill_sink=fill_sink)
+    if args.sink == 'file':
+        fill_sink.close()
+    elif args.sink == 'memory':
+        stats['fills'] = len(fill_sink.fills)
+
+    for key, value in stats.items():
+        print(f"{key}: {value:,.2f}" if isinstance(value, float) else f"{key}: {value:,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Pre-trade risk checks per account in front of MatchingEngine.
+
+``RiskGate(engine)`` takes the engine's ``add_order``, ``cancel_order`` and
+``amend_order`` and checks each new order against its account's
+``RiskLimits`` before the engine sees it:
+
+- maximum order quantity
+- price collar: a limit price at most ``price_collar`` (a fraction) away from
+  the symbol's last trade, or from the best opposite price before any trade
+- maximum open notional: price times quantity of the account's resting
+  orders, across symbols, including the new order
+- maximum position per symbol, assuming every resting order on the new
+  order's side and the new order itself fill
+- self-trade prevention: an order that would trade with one of the account's
+  own resting orders is rejected. It is let through when the liquidity ahead
+  of the account's own best price covers its whole quantity.
+
+The gate keeps state only for accounts whose limits read it: open notional,
+position or self-trade prevention. Their orders and fills are tracked; the
+orders of every other account go straight to the engine after their checks,
+so an account with no limits costs one dict lookup per command. Tracked state
+is brought up to date lazily, when a tracked account's command or a query
+needs it. Fills are read from the engine's trade tape, which must be
+unbounded, rather than through the fill sink, so matching runs exactly as
+without the gate. Each check is then a few dict lookups, whatever the size of
+the book, except that self-trade prevention reads the opposite side's levels
+until the order's quantity is covered.
+
+Like the engine's, the gate's commands return True when the command went
+through and False otherwise. The reason code, from ``REASONS``, is left in
+``reason``, and rejections are counted in ``rejections``. Tracked accounts
+cannot place stop orders, since the gate cannot see them rest once they
+trigger. Commands for gated accounts must all go through the gate, one order
+at a time: the gate has no ``add_orders``, since each order's checks depend on
+the ones before it.
+"""
+import math
+from bisect import bisect_left, insort
+from typing import Dict
+
+from mini_matching_engine import MatchingEngine, Order, SYMBOLS, BUY, SELL, LIMIT, STOP, IOC
+
+REASONS = ('accepted', 'order quantity', 'price collar', 'open notional', 'position', 'self trade', 'order type',
+           'unknown order', 'engine rejected')
+(ACCEPTED, ORDER_QUANTITY, PRICE_COLLAR, OPEN_NOTIONAL, POSITION, SELF_TRADE, ORDER_TYPE, UNKNOWN_ORDER,
+ ENGINE_REJECTED) = range(9)
+
+class RiskLimits:
+    """One account's limits; the defaults check nothing but self-trades."""
+    __slots__ = ('max_order_quantity', 'price_collar', 'max_open_notional', 'max_position', 'self_trade_prevention')
+
+    def __init__(self, max_order_quantity: int = math.inf, price_collar: float = math.inf,
+                 max_open_notional: float = math.inf, max_position: int = math.inf, self_trade_prevention: bool = True):
+        self.max_order_quantity = max_order_quantity
+        self.price_collar = price_collar
+        self.max_open_notional = max_open_notional
+        self.max_position = max_position
+        self.self_trade_prevention = self_trade_prevention
+
+class _Account:
+    """``checks`` is set when any limit applies, ``tracked`` when one reads the account's state."""
+    __slots__ = ('limits', 'checks', 'tracked', 'open_notional', 'symbols')
+
+    def __init__(self, limits: RiskLimits):
+        self.open_notional = 0.0
+        self.symbols: Dict[int, '_Exposure'] = {}
+        self.set_limits(limits)
+
+    def set_limits(self, limits: RiskLimits):
+        self.limits = limits
+        self.tracked = (limits.max_open_notional != math.inf or limits.max_position != math.inf
+                        or limits.self_trade_prevention)
+        self.checks = self.tracked or limits.max_order_quantity != math.inf or limits.price_collar != math.inf
+
+    def exposure(self, symbol_id: int) -> '_Exposure':
+        exposure = self.symbols.get(symbol_id)
+        if exposure is None:
+            exposure = self.symbols[symbol_id] = _Exposure(self)
+        return exposure
+
+class _Exposure:
+    """One account's state in one symbol.
+
+    ``open`` is the resting quantity per side. ``prices`` counts resting orders
+    per tick price and ``ticks`` keeps those prices sorted ascending, as
+    ``StopBook`` does, so the best price is read off one end. A price enters or
+    leaves the list with a bisect, only when its first order rests or its last
+    one goes.
+    """
+    __slots__ = ('account', 'position', 'open', 'prices', 'ticks')
+
+    def __init__(self, account: _Account):
+        self.account = account
+        self.position = 0
+        self.open = [0, 0]
+        self.prices = ({}, {})
+        self.ticks = ([], [])
+
+    def rest(self, order: Order):
+        side_id, ticks, quantity = order.side_id, order.ticks, order.quantity
+        self.open[side_id] += quantity
+        self.account.open_notional += quantity * order.price
+        prices = self.prices[side_id]
+        count = prices.get(ticks)
+        if count:
+            prices[ticks] = count + 1
+        else:
+            prices[ticks] = 1
+            insort(self.ticks[side_id], ticks)
+
+    def unrest(self, order: Order):
+        """Stop counting a resting order, at the quantity it has left."""
+        side_id = order.side_id
+        self.open[side_id] -= order.quantity
+        self.account.open_notional -= order.quantity * order.price
+        self.drop(side_id, order.ticks)
+
+    def drop(self, side_id: int, ticks: int):
+        prices = self.prices[side_id]
+        count = prices[ticks] - 1
+        if count:
+            prices[ticks] = count
+        else:
+            del prices[ticks]
+            levels = self.ticks[side_id]
+            del levels[bisect_left(levels, ticks)]
+
+    def best_price(self, side_id: int):
+        """Best tick price the account rests at on ``side_id``, or None."""
+        levels = self.ticks[side_id]
+        if not levels:
+            return None
+        return levels[-1] if side_id == BUY else levels[0]
+
+class RiskGate:
+    def __init__(self, engine: MatchingEngine, default_limits: RiskLimits = None):
+        if engine.trade_tape.capacity is not None:
+            raise ValueError("RiskGate reads fills from the trade tape, which must be unbounded")
+        self.engine = engine
+        self.default_limits = default_limits if default_limits is not None else RiskLimits()
+        # Shared by every account on the default limits while they need no state of their own
+        self.default = _Account(self.default_limits)
+        self.accounts: Dict[object, _Account] = {}
+        # order_id -> (order, exposure) for each tracked resting order, and the tape rows already counted
+        self.resting: Dict[int, tuple] = {}
+        self.read = engine.trade_tape.total
+        # Reason code of the last command, ACCEPTED when it went through
+        self.reason = ACCEPTED
+        self.rejections = [0] * len(REASONS)
+
+    def _account(self, account) -> _Account:
+        state = self.default if not self.default.tracked else _Account(self.default_limits)
+        self.accounts[account] = state
+        return state
+
+    def set_limits(self, account, limits: RiskLimits):
+        """Set an account's limits. State starts being kept once they need it, with the orders it has resting."""
+        self._catch_up()
+        state = self.accounts.get(account)
+        if state is None or state is self.default:
+            state = self.accounts[account] = _Account(limits)
+            was_tracked = False
+        else:
+            was_tracked = state.tracked
+            state.set_limits(limits)
+        if state.tracked and not was_tracked:
+            for order in self.engine.order_book.iter_orders():
+                if order.account == account:
+                    entry = (order, state.exposure(order.symbol_id))
+                    entry[1].rest(order)
+                    self.resting[order.order_id] = entry
+        elif was_tracked and not state.tracked:
+            self.resting = {order_id: entry for order_id, entry in self.resting.items() if entry[1].account is not state}
+            state.open_notional = 0.0
+            state.symbols.clear()
+
+    def _catch_up(self, order: Order = None, exposure: _Exposure = None):
+        """Apply the fills on the tape since the last call.
+
+        ``order`` is a tracked order the engine has just taken: its own fills go to
+        its position, and what is left of it is tracked once it rests.
+        """
+        tape = self.engine.trade_tape
+        read, total = self.read, tape.total
+        self.read = total
+        resting = self.resting
+        if read != total and (resting or order is not None):
+            order_id = order.order_id if order is not None else None
+            columns = tape.columns
+            aggressors, restings, quantities = columns['aggressor_id'], columns['resting_id'], columns['quantity']
+            emptied = []
+            for row in range(read, total):
+                quantity = quantities[row]
+                if aggressors[row] == order_id:
+                    exposure.position += quantity if order.side_id == BUY else -quantity
+                resting_id = restings[row]
+                entry = resting.get(resting_id)
+                if entry is not None:
+                    filled, owner = entry
+                    side_id = filled.side_id
+                    owner.position += quantity if side_id == BUY else -quantity
+                    owner.open[side_id] -= quantity
+                    owner.account.open_notional -= quantity * filled.price  # fills are at the resting order's price
+                    if not filled.quantity:
+                        emptied.append(resting_id)
+                elif resting_id == order_id:
+                    # Stops it triggered traded with it once it rested
+                    exposure.position += quantity if order.side_id == BUY else -quantity
+            for resting_id in emptied:
+                entry = resting.pop(resting_id, None)
+                if entry is not None:
+                    entry[1].drop(entry[0].side_id, entry[0].ticks)
+        # Rests exactly when the engine rests it, at the quantity left after the fills counted above
+        if order is not None and order.quantity and order.tif_id != IOC:
+            exposure.rest(order)
+            resting[order.order_id] = (order, exposure)
+
+    def check(self, order: Order, account: _Account, exposure: _Exposure = None, replacing: Order = None) -> int:
+        """The first limit ``order`` breaks, or ACCEPTED.
+
+        ``exposure`` is the account's state in the order's symbol, None when the
+        account is not tracked. ``replacing`` is the resting order an amend replaces.
+        """
+        limits = account.limits
+        quantity = order.quantity
+        type_id = order.type_id
+        if not 0 < quantity <= limits.max_order_quantity:
+            return ORDER_QUANTITY
+        side_id = order.side_id
+        opposite_id = SELL if side_id == BUY else BUY
+        if type_id == LIMIT and limits.price_collar != math.inf:
+            reference = self.engine.last_ticks.get(order.symbol_id)
+            if reference is None:
+                best = self.engine.order_book.peek_best(order.symbol_id, opposite_id)
+                reference = best.ticks if best is not None else None
+            if reference is not None and abs(order.ticks - reference) > reference * limits.price_collar:
+                return PRICE_COLLAR
+        if exposure is None:
+            return ACCEPTED
+        if type_id >= STOP:
+            return ORDER_TYPE
+        if type_id == LIMIT:
+            notional = account.open_notional + quantity * order.price
+            if replacing is not None:
+                notional -= replacing.quantity * replacing.price
+            if notional > limits.max_open_notional:
+                return OPEN_NOTIONAL
+        resting = exposure.open[side_id] + quantity - (replacing.quantity if replacing is not None else 0)
+        if (resting + exposure.position if side_id == BUY else resting - exposure.position) > limits.max_position:
+            return POSITION
+        if limits.self_trade_prevention and exposure.prices[opposite_id]:
+            own = exposure.best_price(opposite_id)
+            if (type_id != LIMIT or (own <= order.ticks if side_id == BUY else own >= order.ticks)) and \
+                    self.engine.order_book.quantity_before(order.symbol_id, opposite_id, own, quantity) < quantity:
+                return SELF_TRADE
+        return ACCEPTED
+
+    def add_order(self, order: Order) -> bool:
+        account = self.accounts.get(order.account) or self._account(order.account)
+        if not account.checks:
+            self.reason = ACCEPTED
+            self.engine.add_order(order)
+            return True
+        exposure = None
+        if account.tracked:
+            if self.engine.trade_tape.total != self.read:
+                self._catch_up()
+            exposure = account.symbols.get(order.symbol_id) or account.exposure(order.symbol_id)
+        reason = self.reason = self.check(order, account, exposure)
+        if reason:
+            self.rejections[reason] += 1
+            return False
+        self.engine.add_order(order)
+        if exposure is not None:
+            if self.engine.trade_tape.total != self.read:
+                self._catch_up(order, exposure)
+            elif order.quantity and order.tif_id != IOC:
+                exposure.rest(order)
+                self.resting[order.order_id] = (order, exposure)
+        return True
+
+    def cancel_order(self, order_id: int) -> bool:
+        if order_id in self.resting:
+            # Fills since the last catch-up are not counted yet, so count them before unresting the rest
+            self._catch_up()
+            entry = self.resting.pop(order_id, None)
+            if entry is not None:
+                entry[1].unrest(entry[0])
+        cancelled = self.engine.cancel_order(order_id)
+        self.reason = ACCEPTED if cancelled else UNKNOWN_ORDER
+        return cancelled
+
+    def amend_order(self, order_id: int, price: float, quantity: int, timestamp: int = None) -> bool:
+        """Check the amended order as a new one replacing the resting one, then amend it."""
+        order = self.engine.order_book.get_order(order_id)
+        if order is None:
+            self.reason = UNKNOWN_ORDER
+            return False
+        account = self.accounts.get(order.account) or self._account(order.account)
+        entry = exposure = None
+        if account.checks:
+            if account.tracked:
+                self._catch_up()
+                entry = self.resting.get(order_id)
+                exposure = entry[1] if entry is not None else account.exposure(order.symbol_id)
+            amended = Order(order_id, order.timestamp, order.symbol, 'L', order.side, price, quantity,
+                            order.time_in_force, account=order.account)
+            reason = self.reason = self.check(amended, account, exposure,
+                                              replacing=order if entry is not None else None)
+            if reason:
+                self.rejections[reason] += 1
+                return False
+        if entry is not None:
+            del self.resting[order_id]
+            exposure.unrest(order)
+        # Tracked again from whatever is left once the amend has traded, or unchanged if the engine refused it
+        amended = self.engine.amend_order(order_id, price, quantity, timestamp)
+        if exposure is not None:
+            self._catch_up(order, exposure)
+        self.reason = ACCEPTED if amended else ENGINE_REJECTED
+        if not amended:
+            self.rejections[ENGINE_REJECTED] += 1
+        return amended
+
+    def _tracked(self, account):
+        state = self.accounts.get(account, self.default)
+        if not state.tracked:
+            return None
+        self._catch_up()
+        return state
+
+    def position(self, account, symbol: str):
+        """The account's position in ``symbol``, or None if its limits keep no state."""
+        state = self._tracked(account)
+        if state is None:
+            return None
+        exposure = state.symbols.get(SYMBOLS.ids.get(symbol))
+        return exposure.position if exposure is not None else 0
+
+    def open_notional(self, account):
+        """Price times quantity of the account's resting orders, or None if its limits keep no state."""
+        state = self._tracked(account)
+        return state.open_notional if state is not None else None
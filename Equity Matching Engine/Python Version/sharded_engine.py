@@ -0,0 +1,168 @@
+import argparse
+import heapq
+import multiprocessing
+import os
+import time
+import zlib
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Tuple
+
+from mini_matching_engine import MatchingEngine, Order, OrderBook, PriceLevelOrderBook
+from order_replay import iter_records
+from trade_tape import TradeTape
+
+# (sequence, symbol, aggressor_id, resting_id, quantity, price); sequence is the command's position in the input
+Fill = Tuple[int, str, int, int, int, float]
+
+def shard_for(symbol: str, shards: int) -> int:
+    """Stable symbol -> shard mapping (``hash()`` is salted per process, crc32 is not)."""
+    return zlib.crc32(symbol.encode()) % shards
+
+def format_fill(fill: Fill) -> str:
+    _, symbol, aggressor_id, resting_id, quantity, price = fill
+    return f"{symbol},{aggressor_id},{resting_id},{quantity},{price}\n"
+
+class SequencedFillSink:
+    """Collects fills tagged with the sequence number of the command that produced them."""
+    def __init__(self):
+        self.sequence = 0
+        self.fills: List[Fill] = []
+
+    def on_fill(self, symbol: str, aggressor: Order, resting: Order, quantity: int, price: float):
+        self.fills.append((self.sequence, symbol, aggressor.order_id, resting.order_id, quantity, price))
+
+def _new_engine(book: str, sink: SequencedFillSink) -> MatchingEngine:
+    # Fills are returned to the caller, so each engine only keeps a small tape
+    return MatchingEngine(OrderBook() if book == 'heap' else PriceLevelOrderBook(), fill_sink=sink,
+                          trade_tape=TradeTape(capacity=1024))
+
+def _apply(engine: MatchingEngine, record: tuple):
+    kind = record[0]
+    if kind == 'N':
+        engine.add_order(Order(*record[1:]))
+    elif kind == 'A':
+        engine.amend_order(record[1], record[2], record[3], record[4])
+    else:
+        engine.cancel_order(record[1])
+
+def match_single_process(records: Iterable[tuple], book: str = 'level') -> List[Fill]:
+    """Reference run of every record through one engine, in input order."""
+    sink = SequencedFillSink()
+    engine = _new_engine(book, sink)
+    for sequence, record in enumerate(records):
+        sink.sequence = sequence
+        _apply(engine, record)
+    return sink.fills
+
+def _shard_worker(shard: int, inbox, outbox, book: str):
+    sink = SequencedFillSink()
+    engine = _new_engine(book, sink)
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        for sequence, record in batch:
+            sink.sequence = sequence
+            _apply(engine, record)
+        outbox.put((shard, sink.fills))
+        sink.fills = []
+    outbox.put((shard, None))
+
+class ShardedMatchingEngine:
+    """Runs one MatchingEngine per worker process, with symbols hash-partitioned across them.
+
+    Records (as produced by ``order_replay.iter_records``) are numbered in input
+    order and sent to their shard in batches. Every fill carries the number of the
+    command that caused it, so merging the per-shard streams by that number gives
+    exactly the fill sequence a single engine would have produced.
+    """
+    def __init__(self, shards: int = None, batch_size: int = 4096, book: str = 'level'):
+        self.shards = shards or os.cpu_count() or 1
+        self.batch_size = batch_size
+        context = multiprocessing.get_context()
+        self.outbox = context.Queue()
+        self.inboxes = [context.Queue() for _ in range(self.shards)]
+        self.workers = [context.Process(target=_shard_worker, args=(shard, self.inboxes[shard], self.outbox, book), daemon=True)
+                        for shard in range(self.shards)]
+        for worker in self.workers:
+            worker.start()
+        self.pending: List[list] = [[] for _ in range(self.shards)]
+        self.results: List[List[List[Fill]]] = [[] for _ in range(self.shards)]
+        # Amends and cancels only carry an order_id, so remember where each order went
+        self.order_shards = {}
+        self.sequence = 0
+
+    def submit(self, record: tuple):
+        kind = record[0]
+        if kind == 'N':
+            shard = shard_for(record[3], self.shards)
+            self.order_shards[record[1]] = shard
+        else:
+            shard = self.order_shards.get(record[1])
+            if shard is None:
+                # Unknown order: no engine would accept it, so it cannot produce fills
+                self.sequence += 1
+                return
+        pending = self.pending[shard]
+        pending.append((self.sequence, record))
+        self.sequence += 1
+        if len(pending) >= self.batch_size:
+            self.inboxes[shard].put(pending)
+            self.pending[shard] = []
+            self._drain(block=False)
+
+    def _drain(self, block: bool) -> int:
+        finished = 0
+        while block or not self.outbox.empty():
+            shard, fills = self.outbox.get()
+            if fills is None:
+                finished += 1
+                if finished == self.shards:
+                    break
+            else:
+                self.results[shard].append(fills)
+        return finished
+
+    def finish(self) -> Iterator[Fill]:
+        """Flush every shard, stop the workers and return the merged, sequence-ordered fills."""
+        for shard, pending in enumerate(self.pending):
+            if pending:
+                self.inboxes[shard].put(pending)
+            self.inboxes[shard].put(None)
+        self.pending = [[] for _ in range(self.shards)]
+        self._drain(block=True)
+        for worker in self.workers:
+            worker.join()
+
+        streams = [(fill for batch in batches for fill in batch) for batches in self.results]
+        return heapq.merge(*streams, key=itemgetter(0))
+
+def match_sharded(records: Iterable[tuple], shards: int = None, batch_size: int = 4096, book: str = 'level') -> Iterator[Fill]:
+    engine = ShardedMatchingEngine(shards, batch_size, book)
+    for record in records:
+        engine.submit(record)
+    return engine.finish()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an order file across a pool of symbol-sharded engine processes.")
+    parser.add_argument('path', help="order file in ADD,... or N/A/X/M format")
+    parser.add_argument('--shards', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--output', default='fills.csv')
+    parser.add_argument('--verify', action='store_true', help="also run single-process and check the outputs match")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with open(args.output, 'w') as f:
+        f.writelines(map(format_fill, match_sharded(iter_records(args.path), args.shards, args.batch_size)))
+    print(f"Sharded replay over {args.shards} processes: {time.perf_counter() - start:.2f}s")
+
+    if args.verify:
+        start = time.perf_counter()
+        expected = ''.join(map(format_fill, match_single_process(iter_records(args.path))))
+        print(f"Single-process replay: {time.perf_counter() - start:.2f}s")
+        with open(args.output) as f:
+            print("Outputs match" if f.read() == expected else "Outputs differ")
+
+if __name__ == "__main__":
+    main()
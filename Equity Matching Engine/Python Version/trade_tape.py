@@ -0,0 +1,180 @@
+from array import array
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the analytics views
+    np = None
+
+class TradeTape:
+    """Columnar, append-only record of fills.
+
+    Each fill is stored as one row across typed ``array`` columns instead of a
+    tuple holding both ``Order`` objects, so memory per trade is fixed and the
+    orders can be freed once they leave the book.
+
+    By default the tape is unbounded and grows in chunks of at least
+    ``chunk_size`` rows. Passing ``capacity`` turns it into a ring buffer that
+    keeps only the most recent ``capacity`` trades.
+    """
+    COLUMNS = (
+        ('symbol_id', 'i'),
+        ('aggressor_id', 'q'),
+        ('resting_id', 'q'),
+        ('quantity', 'q'),
+        ('price', 'd'),
+        ('sequence', 'q'),
+    )
+
+    def __init__(self, capacity: int = None, chunk_size: int = 65536):
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.total = 0  # trades ever appended; also the next sequence number
+        self.symbols: List[str] = []
+        self.symbol_ids: Dict[str, int] = {}
+        # Unbounded mode indexes rows per symbol; ring mode indexes sequence numbers and trims them as rows are overwritten
+        self.symbol_index: Dict[int, object] = {}
+        self.allocated = capacity if capacity is not None else 0
+        self.columns: Dict[str, array] = {
+            name: array(typecode, bytes(self.allocated * array(typecode).itemsize)) for name, typecode in self.COLUMNS
+        }
+
+    def __len__(self):
+        return self.total if self.capacity is None else min(self.total, self.capacity)
+
+    def _grow(self):
+        # Columns are replaced rather than resized so numpy views taken earlier stay valid
+        extra = max(self.chunk_size, self.allocated // 2)
+        for name, typecode in self.COLUMNS:
+            column = array(typecode, bytes((self.allocated + extra) * array(typecode).itemsize))
+            column[:self.allocated] = self.columns[name]
+            self.columns[name] = column
+        self.allocated += extra
+
+    def symbol_id(self, symbol: str) -> int:
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def append(self, symbol: str, aggressor_id: int, resting_id: int, quantity: int, price: float) -> int:
+        sequence = self.total
+        symbol_id = self.symbol_id(symbol)
+        if self.capacity is None:
+            if sequence == self.allocated:
+                self._grow()
+            row = sequence
+            index = self.symbol_index.get(symbol_id)
+            if index is None:
+                index = self.symbol_index[symbol_id] = array('q')
+            index.append(row)
+        else:
+            row = sequence % self.capacity
+            index = self.symbol_index.get(symbol_id)
+            if index is None:
+                index = self.symbol_index[symbol_id] = deque()
+            index.append(sequence)
+            oldest = sequence - self.capacity
+            while index[0] <= oldest:
+                index.popleft()
+
+        columns = self.columns
+        columns['symbol_id'][row] = symbol_id
+        columns['aggressor_id'][row] = aggressor_id
+        columns['resting_id'][row] = resting_id
+        columns['quantity'][row] = quantity
+        columns['price'][row] = price
+        columns['sequence'][row] = sequence
+        self.total = sequence + 1
+        return sequence
+
+    def extend(self, symbols: List[str], aggressor_ids, resting_ids, quantities, prices) -> int:
+        """Append many trades at once and return the first one's sequence number.
+
+        ``symbols`` names each trade's symbol, and the other columns may be lists or
+        numpy arrays of the same length. Unbounded tapes write each column in one
+        numpy assignment; ring buffers append row by row.
+        """
+        first = self.total
+        count = len(symbols)
+        if self.capacity is not None or np is None:
+            for row in zip(symbols, aggressor_ids, resting_ids, quantities, prices):
+                self.append(*row)
+            return first
+        while first + count > self.allocated:
+            self._grow()
+        # In order of first appearance, so the tape numbers new symbols as append would
+        ids = {symbol: self.symbol_id(symbol) for symbol in dict.fromkeys(symbols)}
+        symbol_ids = np.fromiter(map(ids.__getitem__, symbols), np.int32, count)
+        rows = slice(first, first + count)
+        for name, values in (('symbol_id', symbol_ids), ('aggressor_id', aggressor_ids), ('resting_id', resting_ids),
+                             ('quantity', quantities), ('price', prices), ('sequence', np.arange(first, first + count))):
+            np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)[rows] = values
+
+        order = np.argsort(symbol_ids, kind='stable')
+        grouped = symbol_ids[order]
+        starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]]) if count else []
+        for start, end in zip(starts, list(starts[1:]) + [count]):
+            symbol_id = int(grouped[start])
+            index = self.symbol_index.get(symbol_id)
+            if index is None:
+                index = self.symbol_index[symbol_id] = array('q')
+            index.frombytes((order[start:end] + first).astype(np.int64).tobytes())
+        self.total = first + count
+        return first
+
+    def _chronological_rows(self) -> range:
+        if self.capacity is None or self.total <= self.capacity:
+            return range(len(self))
+        start = self.total % self.capacity
+        return range(start, start + self.capacity)
+
+    def __iter__(self) -> Iterator[Tuple[str, int, int, int, float, int]]:
+        columns = self.columns
+        size = self.allocated
+        for i in self._chronological_rows():
+            row = i % size
+            yield (self.symbols[columns['symbol_id'][row]], columns['aggressor_id'][row], columns['resting_id'][row],
+                   columns['quantity'][row], columns['price'][row], columns['sequence'][row])
+
+    def symbol_rows(self, symbol: str) -> List[int]:
+        """Storage rows holding ``symbol``'s retained trades, oldest first."""
+        index = self.symbol_index.get(self.symbol_ids.get(symbol))
+        if index is None:
+            return []
+        if self.capacity is None:
+            return index.tolist()
+        oldest = self.total - self.capacity
+        while index and index[0] < oldest:
+            index.popleft()
+        return [sequence % self.capacity for sequence in index]
+
+    def trades(self, symbol: str) -> List[Tuple[str, int, int, int, float, int]]:
+        columns = self.columns
+        return [(symbol, columns['aggressor_id'][row], columns['resting_id'][row], columns['quantity'][row],
+                 columns['price'][row], columns['sequence'][row]) for row in self.symbol_rows(symbol)]
+
+    def view(self, name: str):
+        """Zero-copy numpy view of one column over the retained rows, in storage order.
+
+        In ring mode storage order wraps around; sort by the ``sequence`` column,
+        or use ``arrays()``, for chronological order. A view is a snapshot: rows
+        appended after the tape grows are not visible through it.
+        """
+        if np is None:
+            raise ImportError("numpy is required for TradeTape views")
+        return np.frombuffer(self.columns[name], dtype=self.columns[name].typecode)[:len(self)]
+
+    def arrays(self, symbol: str = None) -> Dict[str, object]:
+        """Chronological numpy arrays for every column, optionally for one symbol only."""
+        if np is None:
+            raise ImportError("numpy is required for TradeTape views")
+        if symbol is not None:
+            rows = np.asarray(self.symbol_rows(symbol), dtype=np.int64)
+        elif self.capacity is None or self.total <= self.capacity:
+            return {name: self.view(name) for name, _ in self.COLUMNS}
+        else:
+            rows = np.arange(self.total, self.total + self.capacity) % self.capacity
+        return {name: self.view(name)[rows] for name, _ in self.COLUMNS}
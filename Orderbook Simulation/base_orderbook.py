@@ -1,5 +1,6 @@
-from collections import defaultdict, deque
-from bisect import insort_left, insort_right
+from collections import defaultdict
+
+from price_level_book import BidSide, OfferSide
 
 # Function to calculate the exposure
 def getExposure(books: dict) -> int:
@@ -9,12 +10,17 @@ def getExposure(books: dict) -> int:
     return exposure
 
 # Main trading function
-def trade(records: list[str]) -> tuple[int, int, int]:
+# on_record, if given, is called after every record with (share, totals, share_totals), each a
+# (profit, long_exposure, short_exposure) tuple, so intraday risk can be read without rescanning the books
+def trade(records: list[str], on_record=None) -> tuple[int, int, int]:
     profit = 0
     long_exposure, short_exposure = 0, 0
+    share_profit = defaultdict(int)
+    share_long = defaultdict(int)
+    share_short = defaultdict(int)
 
-    offer_books = defaultdict(deque)
-    bid_books = defaultdict(deque)
+    offer_books = defaultdict(OfferSide)
+    bid_books = defaultdict(BidSide)
 
     for record in records:
         record = record.split()
@@ -26,58 +32,48 @@ def trade(records: list[str]) -> tuple[int, int, int]:
             size = int(record[i+1])
             price = int(record[i+2])
             if action == 'BUY':
-                while size > 0 and offer_books[share] and offer_books[share][0][0] <= price:
-                    offer_price, offer_size, isOwn = offer_books[share].popleft()
-                    minSize = min(size, offer_size)
-                    if not isOwn:
-                        profit += minSize * (price - offer_price)
-                    size -= minSize
-                    offer_size -= minSize
-                    if offer_size > 0:
-                        offer_books[share].appendleft((offer_price, offer_size, isOwn))
+                size, own_size, own_value, external_size, external_value = offer_books[share].match(size, price)
+                profit += external_size * price - external_value
+                share_profit[share] += external_size * price - external_value
+                short_exposure -= own_value
+                share_short[share] -= own_value
                 if size > 0:
-                    insort_left(bid_books[share], (price, size, True))
+                    bid_books[share].add(price, size, True)
+                    long_exposure += size * price
+                    share_long[share] += size * price
             elif action == 'SELL':
-                while size > 0 and bid_books[share] and bid_books[share][0][0] >= price:
-                    bid_price, bid_size, isOwn = bid_books[share].pop()
-                    minSize = min(size, bid_size)
-                    if not isOwn:
-                        profit += minSize * (bid_price - price)
-                    size -= minSize
-                    bid_size -= minSize
-                    if bid_size > 0:
-                        bid_books[share].append((bid_price, bid_size, isOwn))
+                size, own_size, own_value, external_size, external_value = bid_books[share].match(size, price)
+                profit += external_value - external_size * price
+                share_profit[share] += external_value - external_size * price
+                long_exposure -= own_value
+                share_long[share] -= own_value
                 if size > 0:
-                    insort_right(offer_books[share], (price, size, True))
+                    offer_books[share].add(price, size, True)
+                    short_exposure += size * price
+                    share_short[share] += size * price
             elif action == 'OFFER':
-                while size > 0 and bid_books[share] and bid_books[share][0][0] >= price:
-                    bid_price, bid_size, isOwn = bid_books[share].pop()
-                    minSize = min(size, bid_size)
-                    if isOwn:
-                        profit += minSize * (bid_price - price)
-                    size -= minSize
-                    bid_size -= minSize
-                    if bid_size > 0:
-                        bid_books[share].append((bid_price, bid_size, isOwn))
+                size, own_size, own_value, external_size, external_value = bid_books[share].match(size, price)
+                profit += own_value - own_size * price
+                share_profit[share] += own_value - own_size * price
+                long_exposure -= own_value
+                share_long[share] -= own_value
                 if size > 0:
-                    insort_right(offer_books[share], (price, size, False))
+                    offer_books[share].add(price, size, False)
             elif action == 'BID':
-                while size > 0 and offer_books[share] and offer_books[share][0][0] <= price:
-                    offer_price, offer_size, isOwn = offer_books[share].popleft()
-                    minSize = min(size, offer_size)
-                    if isOwn:
-                        profit += minSize * (price - offer_price)
-                    size -= minSize
-                    offer_size -= minSize
-                    if offer_size > 0:
-                        offer_books[share].appendleft((offer_price, offer_size, isOwn))
+                size, own_size, own_value, external_size, external_value = offer_books[share].match(size, price)
+                profit += own_size * price - own_value
+                share_profit[share] += own_size * price - own_value
+                short_exposure -= own_value
+                share_short[share] -= own_value
                 if size > 0:
-                    insort_left(bid_books[share], (price, size, False))
+                    bid_books[share].add(price, size, False)
 
             i += 3
 
-    long_exposure = getExposure(bid_books)
-    short_exposure = getExposure(offer_books)
+        if on_record is not None:
+            on_record(share, (profit, long_exposure, short_exposure),
+                      (share_profit[share], share_long[share], share_short[share]))
+
     return (profit, long_exposure, short_exposure)
 
 # Test case function
@@ -113,6 +109,13 @@ def run_test_case():
     print(f"Result: Profit = {result[0]}, Long Exposure = {result[1]}, Short Exposure = {result[2]}")
     
     assert result == (expected_profit, expected_long_exposure, expected_short_exposure), "Test case failed"
+
+    # The running totals reported after each record must agree with a full rescan of the books
+    snapshots = []
+    trade(records, lambda share, totals, share_totals: snapshots.append((share, totals, share_totals)))
+    assert snapshots[-1][1] == result, "Running totals test failed"
+    assert snapshots[-1][2] == (1000, 0, 0), "Per-share totals test failed"
+    assert snapshots[0][1] == (0, 0, 27), "Running totals test failed"
     print("Test case passed!")
 
 if __name__ == "__main__":
@@ -1,12 +1,41 @@
 import unittest
-from collections import defaultdict, deque
-from bisect import insort_left, insort_right
+from collections import defaultdict
+
+from price_level_book import BidSide, OfferSide
 
 class OrderBook:
     def __init__(self):
-        self.offer_books = defaultdict(deque)
-        self.bid_books = defaultdict(deque)
+        self.offer_books = defaultdict(OfferSide)
+        self.bid_books = defaultdict(BidSide)
         self.profit = 0
+        self._reset_risk()
+
+    def _reset_risk(self):
+        # Running totals, updated on every insert and fill so they can be read at any point in O(1)
+        self.long_exposure = 0
+        self.short_exposure = 0
+        self.share_profit = defaultdict(int)
+        self.share_long_exposure = defaultdict(int)
+        self.share_short_exposure = defaultdict(int)
+
+    def _add_profit(self, share, amount):
+        self.profit += amount
+        self.share_profit[share] += amount
+
+    def _add_long(self, share, amount):
+        self.long_exposure += amount
+        self.share_long_exposure[share] += amount
+
+    def _add_short(self, share, amount):
+        self.short_exposure += amount
+        self.share_short_exposure[share] += amount
+
+    def risk_snapshot(self, share=None):
+        """(profit, long exposure, short exposure) so far, for one share or all of them."""
+        if share is None:
+            return (self.profit, self.long_exposure, self.short_exposure)
+        return (self.share_profit.get(share, 0), self.share_long_exposure.get(share, 0),
+                self.share_short_exposure.get(share, 0))
 
     def getExposure(self, books):
         exposure = 0
@@ -18,83 +47,63 @@ class OrderBook:
         self.profit = 0
         self.offer_books.clear()
         self.bid_books.clear()
+        self._reset_risk()
 
         for record in records:
-            record = record.split()
-            share = record[0]
-
-            i = 1
-            while i < len(record):
-                action = record[i]
-                size = int(record[i+1])
-                price = int(record[i+2])
-                
-                if action == 'BUY':
-                    self._process_buy(share, size, price)
-                elif action == 'SELL':
-                    self._process_sell(share, size, price)
-                elif action == 'OFFER':
-                    self._process_offer(share, size, price)
-                elif action == 'BID':
-                    self._process_bid(share, size, price)
-
-                i += 3
-
-        long_exposure = self.getExposure(self.bid_books)
-        short_exposure = self.getExposure(self.offer_books)
-        return (self.profit, long_exposure, short_exposure)
+            self.process_record(record)
+
+        return (self.profit, self.long_exposure, self.short_exposure)
+
+    def process_record(self, record):
+        record = record.split()
+        share = record[0]
+
+        i = 1
+        while i < len(record):
+            action = record[i]
+            size = int(record[i+1])
+            price = int(record[i+2])
+
+            if action == 'BUY':
+                self._process_buy(share, size, price)
+            elif action == 'SELL':
+                self._process_sell(share, size, price)
+            elif action == 'OFFER':
+                self._process_offer(share, size, price)
+            elif action == 'BID':
+                self._process_bid(share, size, price)
+
+            i += 3
 
     def _process_buy(self, share, size, price):
-        while size > 0 and self.offer_books[share] and self.offer_books[share][0][0] <= price:
-            offer_price, offer_size, isOwn = self.offer_books[share].popleft()
-            minSize = min(size, offer_size)
-            if not isOwn:
-                self.profit += minSize * (price - offer_price)
-            size -= minSize
-            offer_size -= minSize
-            if offer_size > 0:
-                self.offer_books[share].appendleft((offer_price, offer_size, isOwn))
+        size, own_size, own_value, external_size, external_value = self.offer_books[share].match(size, price)
+        self._add_profit(share, external_size * price - external_value)
+        self._add_short(share, -own_value)
         if size > 0:
-            insort_left(self.bid_books[share], (price, size, True))
+            self.bid_books[share].add(price, size, True)
+            self._add_long(share, size * price)
 
     def _process_sell(self, share, size, price):
-        while size > 0 and self.bid_books[share] and self.bid_books[share][-1][0] >= price:
-            bid_price, bid_size, isOwn = self.bid_books[share].pop()
-            minSize = min(size, bid_size)
-            if not isOwn:
-                self.profit += minSize * (bid_price - price)
-            size -= minSize
-            bid_size -= minSize
-            if bid_size > 0:
-                self.bid_books[share].append((bid_price, bid_size, isOwn))
+        size, own_size, own_value, external_size, external_value = self.bid_books[share].match(size, price)
+        self._add_profit(share, external_value - external_size * price)
+        self._add_long(share, -own_value)
         if size > 0:
-            insort_right(self.offer_books[share], (price, size, True))
+            self.offer_books[share].add(price, size, True)
+            self._add_short(share, size * price)
 
     def _process_offer(self, share, size, price):
-        while size > 0 and self.bid_books[share] and self.bid_books[share][-1][0] >= price:
-            bid_price, bid_size, isOwn = self.bid_books[share].pop()
-            minSize = min(size, bid_size)
-            if isOwn:
-                self.profit += minSize * (bid_price - price)
-            size -= minSize
-            bid_size -= minSize
-            if bid_size > 0:
-                self.bid_books[share].append((bid_price, bid_size, isOwn))
+        size, own_size, own_value, external_size, external_value = self.bid_books[share].match(size, price)
+        self._add_profit(share, own_value - own_size * price)
+        self._add_long(share, -own_value)
         if size > 0:
-            insort_right(self.offer_books[share], (price, size, False))
+            self.offer_books[share].add(price, size, False)
 
     def _process_bid(self, share, size, price):
-        while size > 0 and self.offer_books[share] and self.offer_books[share][0][0] <= price:
-            offer_price, offer_size, isOwn = self.offer_books[share].popleft()
-            minSize = min(size, offer_size)
-            if isOwn:
-                self.profit += minSize * (price - offer_price)
-            size -= minSize
-            offer_size -= minSize
-            if offer_size > 0:
-                self.offer_books[share].appendleft((offer_price, offer_size, isOwn))
+        size, own_size, own_value, external_size, external_value = self.offer_books[share].match(size, price)
+        self._add_profit(share, own_size * price - own_value)
+        self._add_short(share, -own_value)
         if size > 0:
-            insort_left(self.bid_books[share], (price, size, False))
+            self.bid_books[share].add(price, size, False)
 
 class TestOrderBook(unittest.TestCase):
 
@@ -159,5 +168,32 @@ class TestOrderBook(unittest.TestCase):
         result = self.order_book.trade(records)
         self.assertEqual(result, (expected_profit, expected_long_exposure, expected_short_exposure))
 
+    def test_priority_within_level(self):
+        # Entries at one price fill in the old tuple-book order: offers smallest first, bids largest first
+        self.assertEqual(self.order_book.trade(["A SELL 7 100", "A OFFER 17 100", "A BUY 14 100"]), (0, 0, 0))
+        # The bid of 9 is partly filled and what is left of it still fills first
+        self.assertEqual(self.order_book.trade(["A BID 3 100", "A BUY 9 100", "A OFFER 8 100", "A SELL 2 99"]), (1, 0, 0))
+
+    def test_running_totals(self):
+        records = [
+            "CHEMCO SELL 100 67",
+            "FLYCARS BID 50 80 OFFER 100 90",
+            "CHEMCO BUY 20 60",
+            "FLYCARS BUY 200 100",
+            "CHEMCO BID 1000 77 OFFER 500 88",
+            "CHEMCO SELL 10 50"
+        ]
+        for record in records:
+            self.order_book.process_record(record)
+            # The running totals must always agree with a full rescan of the books
+            self.assertEqual(self.order_book.risk_snapshot(),
+                             (self.order_book.profit, self.order_book.getExposure(self.order_book.bid_books),
+                              self.order_book.getExposure(self.order_book.offer_books)))
+
+        self.assertEqual(self.order_book.risk_snapshot("FLYCARS"), (1000, 10000, 0))
+        self.assertEqual(self.order_book.risk_snapshot("CHEMCO"), (1270, 1200, 0))
+        self.assertEqual(self.order_book.risk_snapshot("UNKNOWN"), (0, 0, 0))
+        self.assertEqual(self.order_book.risk_snapshot(), (2270, 11200, 0))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
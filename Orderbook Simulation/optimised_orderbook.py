@@ -1,12 +1,27 @@
-from collections import defaultdict, deque
-from bisect import insort_left, insort_right
+from collections import defaultdict
 import unittest
 
+from price_level_book import BidSide, OfferSide
+
 class OrderBook:
     def __init__(self):
-        self.offer_books = defaultdict(deque)
-        self.bid_books = defaultdict(deque)
+        self.offer_books = defaultdict(OfferSide)
+        self.bid_books = defaultdict(BidSide)
         self.profit = 0
+        self._reset_risk()
+
+    def _reset_risk(self):
+        # Running exposure totals plus [profit, long exposure, short exposure] per share,
+        # updated on every insert and fill so they can be read at any point in O(1)
+        self.long_exposure = 0
+        self.short_exposure = 0
+        self.share_risk = defaultdict(lambda: [0, 0, 0])
+
+    def risk_snapshot(self, share=None):
+        """(profit, long exposure, short exposure) so far, for one share or all of them."""
+        if share is None:
+            return (self.profit, self.long_exposure, self.short_exposure)
+        return tuple(self.share_risk[share]) if share in self.share_risk else (0, 0, 0)
 
     def getExposure(self, books):
         return sum(sum(a * b if owned else 0 for a, b, owned in book) for book in books.values())
@@ -15,16 +30,20 @@ class OrderBook:
         self.profit = 0
         self.offer_books.clear()
         self.bid_books.clear()
+        self._reset_risk()
 
         for record in records:
-            record = record.split()
-            share = record[0]
+            self.process_record(record)
+
+        return (self.profit, self.long_exposure, self.short_exposure)
 
-            for i in range(1, len(record), 3):
-                action, size, price = record[i], int(record[i+1]), int(record[i+2])
-                self._process_action(share, action, size, price)
+    def process_record(self, record):
+        record = record.split()
+        share = record[0]
 
-        return (self.profit, self.getExposure(self.bid_books), self.getExposure(self.offer_books))
+        for i in range(1, len(record), 3):
+            action, size, price = record[i], int(record[i+1]), int(record[i+2])
+            self._process_action(share, action, size, price)
 
     def _process_action(self, share, action, size, price):
         if action in ['BUY', 'BID']:
@@ -35,25 +54,33 @@ class OrderBook:
                                 is_buy=False, is_own=(action == 'SELL'))
 
     def _process_order(self, share, size, price, opposite_book, same_book, is_buy, is_own):
-        while size > 0 and opposite_book[share]:
-            opposite_price, opposite_size, opposite_own = (opposite_book[share].popleft() if is_buy else opposite_book[share].pop())
-            if (is_buy and opposite_price > price) or (not is_buy and opposite_price < price):
-                opposite_book[share].append((opposite_price, opposite_size, opposite_own))
-                break
-
-            trade_size = min(size, opposite_size)
-            if is_own != opposite_own:
-                self.profit += trade_size * (price - opposite_price) * (1 if is_buy else -1)
-
-            size -= trade_size
-            opposite_size -= trade_size
-
-            if opposite_size > 0:
-                opposite_book[share].append((opposite_price, opposite_size, opposite_own))
+        risk = self.share_risk[share]
+        size, own_size, own_value, external_size, external_value = opposite_book[share].match(size, price)
+
+        # Profit only comes from fills between our side and the market
+        if is_own:
+            trade_profit = (external_size * price - external_value) * (1 if is_buy else -1)
+        else:
+            trade_profit = (own_size * price - own_value) * (1 if is_buy else -1)
+        self.profit += trade_profit
+        risk[0] += trade_profit
+        # Our resting orders that were hit: fills against bids reduce long exposure, against offers short
+        if is_buy:
+            self.short_exposure -= own_value
+            risk[2] -= own_value
+        else:
+            self.long_exposure -= own_value
+            risk[1] -= own_value
 
         if size > 0:
-            insort_fn = insort_left if is_buy else insort_right
-            insort_fn(same_book[share], (price, size, is_own))
+            same_book[share].add(price, size, is_own)
+            if is_own:
+                if is_buy:
+                    self.long_exposure += size * price
+                    risk[1] += size * price
+                else:
+                    self.short_exposure += size * price
+                    risk[2] += size * price
 
 class TestOrderBook(unittest.TestCase):
 
@@ -118,5 +145,26 @@ class TestOrderBook(unittest.TestCase):
         result = self.order_book.trade(records)
         self.assertEqual(result, (expected_profit, expected_long_exposure, expected_short_exposure))
 
+    def test_running_totals(self):
+        records = [
+            "CHEMCO SELL 100 67",
+            "FLYCARS BID 50 80 OFFER 100 90",
+            "CHEMCO BUY 20 60",
+            "FLYCARS BUY 200 100",
+            "CHEMCO BID 1000 77 OFFER 500 88",
+            "CHEMCO SELL 10 50"
+        ]
+        for record in records:
+            self.order_book.process_record(record)
+            # The running totals must always agree with a full rescan of the books
+            self.assertEqual(self.order_book.risk_snapshot(),
+                             (self.order_book.profit, self.order_book.getExposure(self.order_book.bid_books),
+                              self.order_book.getExposure(self.order_book.offer_books)))
+
+        self.assertEqual(self.order_book.risk_snapshot("FLYCARS"), (1000, 10000, 0))
+        self.assertEqual(self.order_book.risk_snapshot("CHEMCO"), (1270, 1200, 0))
+        self.assertEqual(self.order_book.risk_snapshot("UNKNOWN"), (0, 0, 0))
+        self.assertEqual(self.order_book.risk_snapshot(), (2270, 11200, 0))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,237 @@
+from bisect import insort, insort_left, insort_right
+from collections import deque
+import random
+import unittest
+
+class PriceLevel:
+    """Resting size at one price: running ``own`` and ``external`` totals, and the entries in fill order.
+
+    ``entries`` keeps each resting ``[size, owned]`` in the order the old tuple
+    books filled them, which is the order the totals alone cannot give. Entries
+    are stored as ``[sign * size, sign * owned]`` and kept ascending, so both
+    sides fill from the end of the list.
+    """
+    __slots__ = ('own', 'external', 'entries')
+
+    def __init__(self):
+        self.own = 0
+        self.external = 0
+        self.entries = []
+
+class BookSide:
+    """One side of one share's book, grouped by price level.
+
+    ``keys`` is a sorted list of level prices (negated for offers) with the best
+    level last, so matching consumes it from the end and a new level costs one
+    ``insort`` into a list of distinct prices rather than into every resting order.
+    ``levels`` maps each price to its ``PriceLevel``; partial fills update the
+    front entry and the level totals in place.
+
+    Within a level, entries fill in the order the old tuple books gave them:
+    bids largest ``(size, owned)`` first and offers smallest first, with a
+    partly filled entry left at the front. On a bid that can leave the level out
+    of order, and the old book then placed new entries with a bisect over the
+    whole side. Such levels are in ``unsorted``, mapped to the number of entries
+    resting below them, which is all the bisect needs to be replayed in
+    O(log n). A level only becomes unsorted while it is the best, when that
+    number is every other entry on the side, and after that only adds below it
+    change it, since fills take the best level.
+    """
+    __slots__ = ('keys', 'levels', 'count', 'unsorted')
+    sign = 1
+
+    def __init__(self):
+        self.keys = []
+        self.levels = {}
+        self.count = 0
+        self.unsorted = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        # (price, size, owned) from worst to best level, own size first within a level
+        sign, levels = self.sign, self.levels
+        for key in self.keys:
+            price = key * sign
+            level = levels[price]
+            if level.own:
+                yield (price, level.own, True)
+            if level.external:
+                yield (price, level.external, False)
+
+    def best_price(self):
+        return self.keys[-1] * self.sign if self.keys else None
+
+    def add(self, price, size, owned):
+        sign = self.sign
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = PriceLevel()
+            insort(self.keys, price * sign)
+        if owned:
+            level.own += size
+        else:
+            level.external += size
+        entry = [size * sign, owned * sign]
+        unsorted = self.unsorted
+        if unsorted:
+            if price in unsorted:
+                self._insort_as_book(price, level.entries, entry)
+            else:
+                insort(level.entries, entry)
+            for key in unsorted:
+                if key > price:
+                    unsorted[key] += 1
+        else:
+            insort(level.entries, entry)
+        self.count += 1
+
+    def _insort_as_book(self, price, entries, entry):
+        # insort_left over the old book of ascending tuples, where this level was a
+        # slice starting after ``before`` entries; only bid levels end up unsorted
+        before = self.unsorted[price]
+        end = before + len(entries)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if middle < before or (middle < end and entries[middle - before] < entry):
+                low = middle + 1
+            else:
+                high = middle
+        entries.insert(low - before, entry)
+
+    def match(self, size, price):
+        """Fill up to ``size`` against every level that crosses ``price``, best level first.
+
+        Returns ``(remaining, own_size, own_value, external_size, external_value)``
+        where the values are the filled size times the resting level price.
+        """
+        keys, sign = self.keys, self.sign
+        limit = price * sign
+        if not keys or keys[-1] < limit:
+            return size, 0, 0, 0, 0
+
+        levels = self.levels
+        own_size = own_value = external_size = external_value = 0
+        while size > 0 and keys and keys[-1] >= limit:
+            level_price = keys[-1] * sign
+            level = levels[level_price]
+            entries = level.entries
+            while size > 0 and entries:
+                entry = entries[-1]
+                resting = entry[0] * sign
+                if resting > size:
+                    entry[0] = (resting - size) * sign
+                    fill, size = size, 0
+                    # A bid's front is its largest entry, so what is left of it may now be out of order
+                    if sign > 0 and len(entries) > 1 and entries[-2] > entry and level_price not in self.unsorted:
+                        self.unsorted[level_price] = self.count - len(entries)
+                else:
+                    entries.pop()
+                    self.count -= 1
+                    fill = resting
+                    size -= resting
+                if entry[1]:
+                    level.own -= fill
+                    own_size += fill
+                    own_value += fill * level_price
+                else:
+                    level.external -= fill
+                    external_size += fill
+                    external_value += fill * level_price
+            if not entries:
+                keys.pop()
+                del levels[level_price]
+                self.unsorted.pop(level_price, None)
+        return size, own_size, own_value, external_size, external_value
+
+class BidSide(BookSide):
+    # The old bid deques filled from their right end, largest (size, owned) first
+    __slots__ = ()
+    sign = 1
+
+class OfferSide(BookSide):
+    # ... and the offer deques from their left end, smallest first, hence the negated entries
+    __slots__ = ()
+    sign = -1
+
+class TestPriceLevelBook(unittest.TestCase):
+
+    def test_levels_sorted_best_last(self):
+        bids, offers = BidSide(), OfferSide()
+        for price in (90, 110, 100, 110):
+            bids.add(price, 5, False)
+            offers.add(price, 5, False)
+        self.assertEqual(bids.best_price(), 110)
+        self.assertEqual(offers.best_price(), 90)
+        self.assertEqual(len(bids), 3)
+        self.assertEqual(list(bids), [(90, 5, False), (100, 5, False), (110, 10, False)])
+
+    def test_partial_fill_in_place(self):
+        offers = OfferSide()
+        offers.add(100, 20, False)
+        offers.add(100, 10, True)
+        offers.add(101, 5, False)
+        # Offers at a level fill smallest first, whoever owns them
+        self.assertEqual(offers.match(25, 100), (0, 10, 1000, 15, 1500))
+        self.assertEqual(list(offers), [(101, 5, False), (100, 5, False)])
+        self.assertEqual(offers.match(20, 100), (15, 0, 0, 5, 500))
+        self.assertEqual(offers.best_price(), 101)
+
+    def test_tuple_book_priority_within_level(self):
+        # The order the old deques of (price, size, owned) tuples gave
+        offers = OfferSide()
+        offers.add(100, 7, True)
+        offers.add(100, 17, False)
+        self.assertEqual(offers.match(14, 100), (0, 7, 700, 7, 700))
+        bids = BidSide()
+        bids.add(100, 5, False)
+        bids.add(100, 5, True)
+        bids.add(100, 3, False)
+        # Largest (size, owned) first; the partly filled entry keeps its place at the front
+        self.assertEqual(bids.match(4, 100), (0, 4, 400, 0, 0))
+        self.assertEqual(bids.match(4, 100), (0, 1, 100, 3, 300))
+        self.assertEqual(list(bids), [(100, 5, False)])
+
+    def test_match_sweeps_levels(self):
+        bids = BidSide()
+        bids.add(100, 10, False)
+        bids.add(99, 10, True)
+        bids.add(98, 10, False)
+        self.assertEqual(bids.match(25, 99), (5, 10, 990, 10, 1000))
+        self.assertEqual(list(bids), [(98, 10, False)])
+
+    def test_matches_tuple_book(self):
+        # Reference: one side as the old deque of (price, size, owned) tuples
+        def tuple_match(book, size, price, is_bid):
+            filled = []
+            while size > 0 and book and (book[-1][0] >= price if is_bid else book[0][0] <= price):
+                level_price, resting, owned = book.pop() if is_bid else book.popleft()
+                fill = min(size, resting)
+                filled.append((level_price, fill, owned))
+                size -= fill
+                if resting > fill:
+                    (book.append if is_bid else book.appendleft)((level_price, resting - fill, owned))
+            own = [(p, n) for p, n, owned in filled if owned]
+            external = [(p, n) for p, n, owned in filled if not owned]
+            return (size, sum(n for _, n in own), sum(p * n for p, n in own),
+                    sum(n for _, n in external), sum(p * n for p, n in external))
+
+        rng = random.Random(7)
+        for _ in range(300):
+            for side, is_bid in ((BidSide(), True), (OfferSide(), False)):
+                book = deque()
+                for _ in range(60):
+                    size, price = rng.randint(1, 12), rng.randint(98, 102)
+                    if rng.random() < 0.6:
+                        owned = rng.random() < 0.5
+                        side.add(price, size, owned)
+                        (insort_left if is_bid else insort_right)(book, (price, size, owned))
+                    else:
+                        self.assertEqual(side.match(size, price), tuple_match(book, size, price, is_bid))
+                own = sum(size for _, size, owned in book if owned)
+                self.assertEqual(sum(size for _, size, owned in side if owned), own)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import unittest
+import zlib
+
+import base_orderbook
+import class_orderbook
+import optimised_orderbook
+
+ENGINES = {
+    'base': lambda records: base_orderbook.trade(records),
+    'class': lambda records: class_orderbook.OrderBook().trade(records),
+    'optimised': lambda records: optimised_orderbook.OrderBook().trade(records),
+}
+
+def _trade_shard(args):
+    engine, records = args
+    return ENGINES[engine](records)
+
+def partition_records(records, shards):
+    # A record only ever touches the books of its own share, so shares can be split across processes
+    partitions = [[] for _ in range(shards)]
+    for record in records:
+        share = record.split(maxsplit=1)[0]
+        partitions[zlib.crc32(share.encode()) % shards].append(record)
+    return partitions
+
+def sharded_trade(records, shards=None, engine='optimised'):
+    """Run ``trade`` with shares hash-partitioned over a process pool and sum the results.
+
+    Profit and both exposures are sums over shares, so the totals are identical to
+    a single-process ``trade(records)`` whatever the shard count.
+    """
+    shards = shards or os.cpu_count() or 1
+    partitions = [(engine, partition) for partition in partition_records(records, shards) if partition]
+    if len(partitions) <= 1:
+        results = [_trade_shard(partition) for partition in partitions]
+    else:
+        with multiprocessing.get_context().Pool(len(partitions)) as pool:
+            results = pool.map(_trade_shard, partitions)
+    return tuple(sum(values) for values in zip(*results)) if results else (0, 0, 0)
+
+class TestShardedTrade(unittest.TestCase):
+
+    def test_matches_single_process(self):
+        records = [
+            "TINYCORP SELL 27 1",
+            "MAVEN BID 5 20 OFFER 5 25",
+            "MEDPHARMA BID 3 120 OFFER 7 150",
+            "NEWFIRM BID 10 140 BID 7 150 OFFER 14 180",
+            "TINYCORP BID 25 3 OFFER 25 6",
+            "FASTAIR BID 21 65 OFFER 35 85",
+            "FLYCARS BID 50 80 OFFER 100 90",
+            "BIGBANK BID 200 13 OFFER 100 19",
+            "REDCHIP BID 55 25 OFFER 80 30",
+            "FASTAIR BUY 50 100",
+            "CHEMCO SELL 100 67",
+            "MAVEN BUY 5 30",
+            "REDCHIP SELL 5 30",
+            "NEWFIRM BUY 2 200",
+            "MEDPHARMA BUY 2 150",
+            "BIGBANK SELL 50 11",
+            "FLYCARS BUY 200 100",
+            "CHEMCO BID 1000 77 OFFER 500 88"
+        ]
+        for engine in ENGINES:
+            for shards in (1, 3):
+                self.assertEqual(sharded_trade(records, shards, engine), (2740, 11500, 152))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+FREQUENCIES = ('none', 'daily', 'weekly', 'monthly', 'quarterly')
+TRADING_DAYS = 252
+
+def rebalance_mask(dates, frequency):
+    """True on the first trading day of each rebalance period; 'none' only rebalances on day one."""
+    if frequency == 'daily':
+        mask = np.ones(len(dates), dtype=bool)
+    elif frequency == 'none':
+        mask = np.zeros(len(dates), dtype=bool)
+    else:
+        periods = pd.DatetimeIndex(dates).to_period({'weekly': 'W', 'monthly': 'M', 'quarterly': 'Q'}[frequency]).asi8
+        mask = np.r_[True, periods[1:] != periods[:-1]]
+    mask[0] = True
+    return mask
+
+def _turnover(prices, bought, rebalanced):
+    """Traded fraction of the portfolio when an equal-weight basket bought at row ``bought`` is reset at ``rebalanced``."""
+    drift = prices[rebalanced] / prices[bought]
+    weights = drift / drift.sum(axis=1, keepdims=True)
+    return np.abs(weights - 1 / prices.shape[1]).sum(axis=1)
+
+def _basket_growth(prices, rows):
+    # growth[t, j] = value at row t of an equal-weight basket worth 1 at rows[j]
+    return prices @ (1 / prices[rows]).T / prices.shape[1]
+
+def _running_sums(returns, axis):
+    return np.cumsum(returns, axis=axis), np.cumsum(returns ** 2, axis=axis)
+
+def backtest(prices, start_dates=None, frequencies=FREQUENCIES, costs_bps=(0,), horizon=None, initial_investment=10000):
+    """Evaluate every (start date, rebalance frequency, transaction cost) scenario in one pass.
+
+    ``prices`` has one column of adjusted closes per stock. Each scenario buys an
+    equal-weight basket on its start date, resets it to equal weights on the first
+    trading day of every rebalance period, and pays ``cost_bps`` on the traded
+    value, including the initial purchase. It runs to the last row, or for
+    ``horizon`` trading days. Stocks missing a price after forward-filling are
+    dropped.
+
+    The basket's growth from every start date comes from a single matrix product.
+    After a scenario's first rebalance its path follows a chain shared by all
+    scenarios with the same frequency and cost, so running sums of that chain's
+    returns give every scenario's volatility without building its path.
+
+    Returns a DataFrame with one row per scenario and the ``calculate_metrics``
+    figures as floats.
+    """
+    prices = prices.ffill().dropna(axis=1)
+    dates = prices.index
+    P = prices.to_numpy(dtype=float)
+    T = len(P)
+
+    if start_dates is None:
+        starts = np.arange(T)
+    else:
+        starts = np.unique(dates.searchsorted(pd.DatetimeIndex(start_dates)))
+    ends = np.full(len(starts), T - 1) if horizon is None else starts + horizon
+    # Volatility needs at least two daily returns
+    keep = (ends < T) & (ends - starts >= 2)
+    starts, ends = starts[keep], ends[keep]
+    S = len(starts)
+    columns = np.arange(S)
+    costs = np.asarray(costs_bps, dtype=float) / 1e4
+    C = len(costs)
+
+    growth = _basket_growth(P, starts)
+    basket_returns = np.zeros_like(growth)
+    basket_returns[1:] = growth[1:] / growth[:-1] - 1
+    B1, B2 = _running_sums(basket_returns, axis=0)
+    n = ends - starts
+    days = n + 1
+
+    tables = []
+    for frequency in frequencies:
+        rebalances = np.flatnonzero(rebalance_mask(dates, frequency))
+        K = len(rebalances)
+
+        # Chain: a portfolio that has been through every rebalance, worth 1 on day one, for each cost
+        segment_growth = _basket_growth(P, rebalances)
+        segment = np.searchsorted(rebalances, np.arange(T), side='right') - 1
+        steps = segment_growth[rebalances[1:], np.arange(K - 1)] * (1 - costs[:, None] * _turnover(P, rebalances[:-1], rebalances[1:]))
+        chain_at_rebalance = np.concatenate([np.ones((C, 1)), np.cumprod(steps, axis=1)], axis=1)
+        chain = chain_at_rebalance[:, segment] * segment_growth[np.arange(T), segment]
+        chain_returns = np.zeros_like(chain)
+        chain_returns[:, 1:] = chain[:, 1:] / chain[:, :-1] - 1
+        L1, L2 = _running_sums(chain_returns, axis=1)
+
+        # First rebalance after each start; scenarios that end before it never leave their first basket
+        following = np.searchsorted(rebalances, starts, side='right')
+        rebalanced = following < K
+        first = rebalances[np.minimum(following, K - 1)]
+        rebalanced &= first <= ends
+        first = np.where(rebalanced, first, ends)
+
+        before = first - rebalanced  # last row still held in the first basket
+        sum1 = B1[before, columns] - B1[starts, columns]
+        sum2 = B2[before, columns] - B2[starts, columns]
+        value = np.broadcast_to(growth[first, columns], (C, S)) * (1 - costs[:, None])
+        sum1 = np.broadcast_to(sum1, (C, S)).copy()
+        sum2 = np.broadcast_to(sum2, (C, S)).copy()
+
+        if rebalanced.any():
+            turnover = _turnover(P, starts, first)
+            after_cost = 1 - costs[:, None] * turnover
+            rebalance_return = growth[first, columns] * after_cost / growth[first - 1, columns] - 1
+            tail1 = L1[:, ends] - L1[:, first]
+            tail2 = L2[:, ends] - L2[:, first]
+            rebalanced_value = value * after_cost * chain[:, ends] / chain[:, first]
+            value = np.where(rebalanced, rebalanced_value, value)
+            sum1 = np.where(rebalanced, sum1 + rebalance_return + tail1, sum1)
+            sum2 = np.where(rebalanced, sum2 + rebalance_return ** 2 + tail2, sum2)
+
+        total_return = value - 1
+        annualized_return = (1 + total_return) ** (TRADING_DAYS / days) - 1
+        variance = (sum2 - sum1 ** 2 / n) / (n - 1)
+        volatility = np.sqrt(np.maximum(variance, 0)) * np.sqrt(TRADING_DAYS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe_ratio = annualized_return / volatility
+
+        tables.append(pd.DataFrame({
+            'Start': np.tile(dates[starts], C),
+            'End': np.tile(dates[ends], C),
+            'Rebalance': frequency,
+            'Cost (bps)': np.repeat(costs * 1e4, S),
+            'Final Value': (value * initial_investment).ravel(),
+            'Total Return': total_return.ravel(),
+            'Annualized Return': annualized_return.ravel(),
+            'Volatility': volatility.ravel(),
+            'Sharpe Ratio': sharpe_ratio.ravel(),
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+def _simulate(prices, start, end, frequency, cost):
+    """Day-by-day reference for one scenario: (final value, daily returns)."""
+    P = prices.ffill().dropna(axis=1).to_numpy(dtype=float)
+    mask = rebalance_mask(prices.index, frequency)
+    N = P.shape[1]
+    value = 1 - cost
+    shares = value / N / P[start]
+    values = [value]
+    for t in range(start + 1, end + 1):
+        value = shares @ P[t]
+        if mask[t]:
+            weights = shares * P[t] / value
+            value *= 1 - cost * np.abs(weights - 1 / N).sum()
+            shares = value / N / P[t]
+        values.append(value)
+    values = np.array(values)
+    return values[-1], values[1:] / values[:-1] - 1
+
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        dates = pd.bdate_range('2021-01-01', periods=160)
+        closes = 50 * np.exp(np.cumsum(rng.normal(0.0005, 0.02, (len(dates), 5)), axis=0))
+        self.prices = pd.DataFrame(closes, index=dates, columns=list('ABCDE'))
+        self.prices.iloc[40:45, 2] = np.nan  # gaps are forward-filled
+        self.prices['LATE'] = np.r_[np.full(10, np.nan), closes[10:, 0]]  # no price on day one, so dropped
+
+    def test_matches_day_by_day_simulation(self):
+        starts = self.prices.index[[0, 3, 17, 60, 100]]
+        results = backtest(self.prices, starts, FREQUENCIES, costs_bps=(0, 25), horizon=50)
+        self.assertEqual(len(results), len(starts) * len(FREQUENCIES) * 2)
+        rows = self.prices.index.get_indexer(results['Start'])
+        for row, (_, result) in zip(rows, results.iterrows()):
+            final, returns = _simulate(self.prices, row, row + 50, result['Rebalance'], result['Cost (bps)'] / 1e4)
+            total_return = final - 1
+            annualized_return = (1 + total_return) ** (TRADING_DAYS / 51) - 1
+            volatility = returns.std(ddof=1) * np.sqrt(TRADING_DAYS)
+            np.testing.assert_allclose(
+                result[['Final Value', 'Total Return', 'Annualized Return', 'Volatility', 'Sharpe Ratio']].to_numpy(dtype=float),
+                [final * 10000, total_return, annualized_return, volatility, annualized_return / volatility], rtol=1e-10)
+            self.assertEqual(result['End'], self.prices.index[row + 50])
+
+    def test_runs_to_the_last_row_without_a_horizon(self):
+        results = backtest(self.prices, frequencies=('none', 'monthly'))
+        # Every start date that leaves at least two daily returns
+        self.assertEqual(len(results), 2 * (len(self.prices) - 2))
+        self.assertTrue((results['End'] == self.prices.index[-1]).all())
+        buy_and_hold = results[(results['Rebalance'] == 'none') & (results['Start'] == self.prices.index[0])].iloc[0]
+        final, _ = _simulate(self.prices, 0, len(self.prices) - 1, 'none', 0)
+        self.assertAlmostEqual(buy_and_hold['Total Return'], final - 1, places=12)
+
+    def test_costs_only_lower_returns(self):
+        results = backtest(self.prices, self.prices.index[:20], ('weekly',), costs_bps=(0, 10, 50), horizon=60)
+        by_cost = results.pivot(index='Start', columns='Cost (bps)', values='Final Value')
+        self.assertTrue((by_cost[0.0] > by_cost[10.0]).all() and (by_cost[10.0] > by_cost[50.0]).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,52 @@
-import yfinance as yf
+import argparse
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from backtest import FREQUENCIES, backtest
+from data_sources import FixtureSource, LocalPriceStore, StoredSource, YFinanceSource
+from monte_carlo import bootstrap, path_metrics, summarize
+from rolling_metrics import rolling_metrics
+from universe import load_universe, read_tickers
+
+# Prices are cached here after the first download
+DEFAULT_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'price_store')
+
 class SP500EqualWeightETF:
-    def __init__(self):
-        self.sp500_tickers = self.get_sp500_tickers()
+    def __init__(self, data_source=None, tickers=None, chunk_size=100, workers=8):
+        self.sp500_tickers = list(tickers) if tickers is not None else self.get_sp500_tickers()
         self.portfolio = pd.DataFrame()
+        self.universe = None
+        # Any object with fetch(tickers, start, end) returning adjusted closes, one column per ticker
+        self.data_source = data_source if data_source is not None else StoredSource(YFinanceSource(), LocalPriceStore(DEFAULT_STORE))
+        self.chunk_size = chunk_size
+        self.workers = workers
 
     def get_sp500_tickers(self):
         # We'll use a predefined list of S&P 500 tickers
         # In a real-world scenario, you might want to fetch this list dynamically
-        return ["AAPL", "MSFT", "AMZN", "GOOGL", "FB", "TSLA", "BRK-B", "JNJ", "JPM", "V", "PG", "UNH", "HD", "MA", "NVDA"]  # This is a sample, not the full 500
+        return ["AAPL", "MSFT", "AMZN", "GOOGL", "META", "TSLA", "BRK-B", "JNJ", "JPM", "V", "PG", "UNH", "HD", "MA", "NVDA"]  # This is a sample, not the full 500
 
     def fetch_data(self, period="1mo"):
-        data = yf.download(self.sp500_tickers, period=period)
-        return data['Adj Close']
+        # Prices are float32, fetched in concurrent chunks; tickers with no data are left out
+        self.universe = load_universe(self.sp500_tickers, self.data_source, period,
+                                      chunk_size=self.chunk_size, workers=self.workers)
+        if not self.universe.tickers:
+            raise ValueError(f"No price data for any of the {len(self.sp500_tickers)} tickers over {period}")
+        return self.universe.frame()
 
     def calculate_returns(self, prices):
         return prices.pct_change()
 
     def calculate_portfolio_value(self, initial_investment=10000):
-        num_stocks = len(self.sp500_tickers)
-        investment_per_stock = initial_investment / num_stocks
-        
-        stock_quantities = investment_per_stock / self.portfolio.iloc[0]
-        portfolio_value = (self.portfolio * stock_quantities).sum(axis=1)
+        # Only stocks trading on the first day are bought; delisted ones are held at their last price
+        prices = self.portfolio.ffill()
+        first_prices = prices.iloc[0].dropna()
+        investment_per_stock = initial_investment / len(first_prices)
+
+        stock_quantities = investment_per_stock / first_prices.astype(float)
+        portfolio_value = (prices[first_prices.index] * stock_quantities).sum(axis=1)
         
         return portfolio_value
 
@@ -45,10 +66,19 @@ class SP500EqualWeightETF:
             'Sharpe Ratio': f'{sharpe_ratio:.2f}'
         }
 
+    def calculate_rolling_metrics(self, portfolio_value, window=21):
+        """Metrics over each trailing ``window`` bars; feed live values to ``rolling_metrics.RollingMetrics`` instead."""
+        return rolling_metrics(portfolio_value, window)
+
     def run_simulation(self, initial_investment=10000, period="1mo"):
         print(f"Fetching data for {len(self.sp500_tickers)} S&P 500 stocks...")
         self.portfolio = self.fetch_data(period)
-        
+        stats = self.universe.stats
+        print(f"Loaded {stats['loaded']} of {stats['requested']} tickers x {stats['days']} days in {stats['load_seconds']:.2f}s "
+              f"({stats['matrix_mb']:.1f} MB matrix, {stats['peak_memory_mb']:.1f} MB peak)")
+        if self.universe.missing:
+            print(f"No data for: {', '.join(self.universe.missing)}")
+
         print("Calculating portfolio value...")
         portfolio_value = self.calculate_portfolio_value(initial_investment)
         
@@ -64,9 +94,43 @@ class SP500EqualWeightETF:
 
         return portfolio_value, metrics
 
+    def run_backtest(self, period="5y", start_dates=None, frequencies=FREQUENCIES, costs_bps=(0, 10, 25), horizon=None,
+                     initial_investment=10000):
+        """Metrics for every start date, rebalance frequency and cost; see ``backtest.backtest``."""
+        prices = self.fetch_data(period)
+        return backtest(prices, start_dates, frequencies, costs_bps, horizon, initial_investment)
+
+    def run_bootstrap(self, period="5y", resamples=10000, block_size=21, seed=0, workers=None, confidence=0.95):
+        """Confidence intervals for the buy-and-hold metrics from block-bootstrapped return paths."""
+        prices = self.fetch_data(period).ffill().dropna(axis=1)
+        observed = path_metrics((prices / prices.iloc[0]).mean(axis=1).to_numpy(dtype=float))[0]
+        samples = bootstrap(prices, resamples, block_size, seed=seed, workers=workers)
+        return summarize(samples, observed, confidence)
+
 def main():
-    etf = SP500EqualWeightETF()
-    etf.run_simulation(initial_investment=10000, period="1mo")
+    parser = argparse.ArgumentParser(description="Simulate an equal-weight portfolio of S&P 500 stocks.")
+    parser.add_argument('--period', default="1mo")
+    parser.add_argument('--offline', action='store_true', help="use deterministic synthetic prices instead of Yahoo Finance")
+    parser.add_argument('--tickers', help="file of tickers to hold, one per line (default: a 15-stock sample)")
+    parser.add_argument('--chunk-size', type=int, default=100, help="tickers per download request")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent download requests")
+    parser.add_argument('--bootstrap', type=int, metavar='RESAMPLES', help="confidence intervals from this many bootstrapped paths")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backtest', action='store_true', help="sweep every start date, rebalance frequency and cost over the period")
+    args = parser.parse_args()
+
+    source = StoredSource(FixtureSource(), LocalPriceStore(os.path.join(DEFAULT_STORE, 'fixture'))) if args.offline else None
+    tickers = read_tickers(args.tickers) if args.tickers else None
+    etf = SP500EqualWeightETF(data_source=source, tickers=tickers, chunk_size=args.chunk_size, workers=args.workers)
+    if args.bootstrap:
+        print(f"{args.bootstrap:,} block-bootstrapped paths over {args.period}:")
+        print(etf.run_bootstrap(period=args.period, resamples=args.bootstrap, seed=args.seed))
+    elif args.backtest:
+        results = etf.run_backtest(period=args.period, horizon=63)
+        print(f"{len(results):,} scenarios over {args.period}, 63-day horizon; median by rebalance frequency and cost:")
+        print(results.groupby(['Rebalance', 'Cost (bps)'])[['Total Return', 'Volatility', 'Sharpe Ratio']].median())
+    else:
+        etf.run_simulation(initial_investment=10000, period=args.period)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,257 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zlib
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# One structured .npy file per ticker, memory-mapped on read
+BAR_DTYPE = np.dtype([('date', 'M8[D]'), ('close', 'f8')])
+ONE_DAY = np.timedelta64(1, 'D')
+
+def today():
+    return np.datetime64(pd.Timestamp.today().date(), 'D')
+
+def period_start(period, end):
+    """First date of a yfinance-style period ("5d", "1wk", "1mo", "1y", "ytd") ending at ``end``."""
+    end = pd.Timestamp(end)
+    if period == 'ytd':
+        return np.datetime64(end.replace(month=1, day=1).date(), 'D')
+    for suffix, unit in (('mo', 'months'), ('wk', 'weeks'), ('y', 'years'), ('d', 'days')):
+        if period.endswith(suffix):
+            return np.datetime64((end - pd.DateOffset(**{unit: int(period[:-len(suffix)])})).date(), 'D')
+    raise ValueError(f"Unsupported period: {period}")
+
+class YFinanceSource:
+    """Adjusted closes from Yahoo Finance; yfinance is only imported when data is fetched."""
+
+    def fetch(self, tickers, start, end):
+        import yfinance as yf
+        # yfinance treats end as exclusive
+        data = yf.download(list(tickers), start=str(start), end=str(end + ONE_DAY), auto_adjust=False, progress=False)
+        if data.empty:
+            return pd.DataFrame(columns=list(tickers), dtype=float)
+        closes = data['Adj Close']
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(tickers[0])
+        return closes
+
+class FixtureSource:
+    """Deterministic synthetic closes for tests and offline runs.
+
+    Each ticker gets its own seeded random walk over business days from ``epoch``,
+    so the same date always has the same price however the range is split up.
+    """
+    def __init__(self, seed=0, epoch='2000-01-03'):
+        self.seed = seed
+        self.epoch = np.datetime64(epoch, 'D')
+        self.calls = 0
+
+    def fetch(self, tickers, start, end):
+        self.calls += 1
+        dates = np.arange(self.epoch, end + ONE_DAY, dtype='M8[D]')
+        dates = dates[np.is_busday(dates)]
+        keep = dates >= start
+        closes = {}
+        for ticker in tickers:
+            crc = zlib.crc32(ticker.encode())
+            rng = np.random.default_rng([self.seed, crc])
+            walk = np.cumsum(rng.normal(0.0003, 0.015, len(dates)))
+            closes[ticker] = (20 + crc % 480) * np.exp(walk)[keep]
+        return pd.DataFrame(closes, index=pd.DatetimeIndex(dates[keep], name='Date'), columns=list(tickers))
+
+class LocalPriceStore:
+    """Per-ticker partitions of daily closes in ``directory``.
+
+    Each ticker is a sorted ``<ticker>.npy`` of ``BAR_DTYPE`` rows, and ``coverage.json``
+    records the date range already requested for it, so days without a bar
+    (holidays, dates before a listing) are not fetched again. Different tickers
+    can be written from different threads.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'coverage.json')
+        self.index = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, f"{ticker}.npy")
+
+    def coverage(self, ticker):
+        covered = self.index.get(ticker)
+        return None if covered is None else (np.datetime64(covered[0], 'D'), np.datetime64(covered[1], 'D'))
+
+    def bars(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.load(path, mmap_mode='r')
+
+    def write(self, ticker, dates, closes, start, end):
+        """Merge new bars for ``ticker`` and mark ``start``..``end`` as covered (see ``save``)."""
+        new = np.empty(len(dates), dtype=BAR_DTYPE)
+        new['date'] = dates
+        new['close'] = closes
+        bars = np.concatenate([np.asarray(self.bars(ticker)), new])
+        _, first = np.unique(bars['date'][::-1], return_index=True)  # newest write wins on overlap
+        bars = bars[::-1][first]
+
+        temporary = self._path(ticker) + '.tmp.npy'
+        np.save(temporary, bars)
+        os.replace(temporary, self._path(ticker))
+
+        if start > end:
+            return
+        with self.lock:
+            covered = self.coverage(ticker)
+            if covered is not None:
+                start, end = min(start, covered[0]), max(end, covered[1])
+            self.index[ticker] = [str(start), str(end)]
+
+    def save(self):
+        """Persist coverage; until then a crash only means some dates are fetched again."""
+        with self.lock:
+            with open(self.index_path + '.tmp', 'w') as f:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            os.replace(self.index_path + '.tmp', self.index_path)
+
+    def frame(self, tickers, start, end):
+        stored = []
+        for ticker in tickers:
+            bars = self.bars(ticker)
+            lo, hi = np.searchsorted(bars['date'], [start, end + ONE_DAY])
+            stored.append(bars[lo:hi])
+        # Aligning on the union of dates with numpy is much cheaper than one Series per ticker
+        dates = np.unique(np.concatenate([bars['date'] for bars in stored])) if stored else np.empty(0, dtype='M8[D]')
+        closes = np.full((len(dates), len(stored)), np.nan)
+        for j, bars in enumerate(stored):
+            closes[np.searchsorted(dates, bars['date']), j] = bars['close']
+        return pd.DataFrame(closes, index=pd.DatetimeIndex(dates, name='Date'), columns=list(tickers))
+
+class StoredSource:
+    """Serves closes from a ``LocalPriceStore``, fetching from ``source`` only the dates it is missing."""
+
+    def __init__(self, source, store):
+        self.source = source
+        self.store = store
+
+    def fetch(self, tickers, start=None, end=None, period='1mo'):
+        end = today() if end is None else np.datetime64(end, 'D')
+        start = period_start(period, end) if start is None else np.datetime64(start, 'D')
+
+        missing = defaultdict(list)
+        for ticker in tickers:
+            covered = self.store.coverage(ticker)
+            if covered is None:
+                missing[(start, end)].append(ticker)
+                continue
+            if start < covered[0]:
+                missing[(start, covered[0] - ONE_DAY)].append(ticker)
+            if end > covered[1]:
+                missing[(covered[1] + ONE_DAY, end)].append(ticker)
+        self._download(missing)
+        return self.store.frame(tickers, start, end)
+
+    def refresh(self, tickers, end=None):
+        """Fetch only the bars after each ticker's last stored date."""
+        end = today() if end is None else np.datetime64(end, 'D')
+        missing = defaultdict(list)
+        for ticker in tickers:
+            covered = self.store.coverage(ticker)
+            if covered is not None and end > covered[1]:
+                missing[(covered[1] + ONE_DAY, end)].append(ticker)
+        self._download(missing)
+
+    def _download(self, missing):
+        # Tickers missing the same range are fetched together in one request
+        # Today's bar can still change, so it is stored but left uncovered and fetched again next time
+        last_final = today() - ONE_DAY
+        for (fetch_start, fetch_end), group in missing.items():
+            closes = self.source.fetch(group, fetch_start, fetch_end)
+            for ticker in group:
+                column = closes[ticker].dropna() if ticker in closes else pd.Series(dtype=float)
+                self.store.write(ticker, column.index.values.astype('M8[D]'), column.values,
+                                 fetch_start, min(fetch_end, last_final))
+        if missing:
+            self.store.save()
+
+class _RecordingSource(FixtureSource):
+    """A FixtureSource that remembers each request's (tickers, start, end)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = []
+
+    def fetch(self, tickers, start, end):
+        self.requests.append((sorted(tickers), str(start), str(end)))
+        return super().fetch(tickers, start, end)
+
+class TestPriceStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_store_round_trip(self):
+        store = LocalPriceStore(self.directory)
+        dates = np.array(['2020-01-06', '2020-01-02', '2020-01-03'], dtype='M8[D]')
+        store.write('AAA', dates, [3.0, 1.0, 2.0], np.datetime64('2020-01-01'), np.datetime64('2020-01-07'))
+        # Overlapping bars are replaced by the newer write
+        store.write('AAA', dates[:1], [4.0], np.datetime64('2020-01-06'), np.datetime64('2020-01-08'))
+        store.save()
+
+        reopened = LocalPriceStore(self.directory)
+        bars = reopened.bars('AAA')
+        self.assertEqual([str(date) for date in bars['date']], ['2020-01-02', '2020-01-03', '2020-01-06'])
+        self.assertEqual(bars['close'].tolist(), [1.0, 2.0, 4.0])
+        self.assertEqual(reopened.coverage('AAA'), (np.datetime64('2020-01-01'), np.datetime64('2020-01-08')))
+        self.assertIsNone(reopened.coverage('BBB'))
+
+        frame = reopened.frame(['AAA', 'BBB'], np.datetime64('2020-01-03'), np.datetime64('2020-01-10'))
+        self.assertEqual(list(frame.columns), ['AAA', 'BBB'])
+        self.assertEqual(frame['AAA'].tolist(), [2.0, 4.0])
+        self.assertTrue(frame['BBB'].isna().all())
+
+    def test_covered_dates_without_bars_are_not_fetched_again(self):
+        source = _RecordingSource(epoch='2020-01-03')
+        stored = StoredSource(source, LocalPriceStore(self.directory))
+        # 2020-01-04/05 is a weekend, and the fixture has no bars before its epoch
+        first = stored.fetch(['AAA'], '2019-12-20', '2020-01-10')
+        self.assertEqual(str(first.index[0].date()), '2020-01-03')
+        self.assertNotIn(np.datetime64('2020-01-04'), first.index.values.astype('M8[D]'))
+
+        again = StoredSource(source, LocalPriceStore(self.directory)).fetch(['AAA'], '2019-12-25', '2020-01-06')
+        self.assertEqual(len(source.requests), 1)
+        pd.testing.assert_frame_equal(again, first.loc[:'2020-01-06'])
+
+    def test_only_missing_ranges_are_fetched(self):
+        source = _RecordingSource()
+        stored = StoredSource(source, LocalPriceStore(self.directory))
+        stored.fetch(['AAA', 'BBB'], '2021-03-01', '2021-03-31')
+        stored.fetch(['BBB'], '2021-04-01', '2021-04-30')
+        source.requests.clear()
+
+        closes = stored.fetch(['AAA', 'BBB', 'CCC'], '2021-02-15', '2021-04-15')
+        self.assertEqual(sorted(source.requests), [
+            (['AAA'], '2021-04-01', '2021-04-15'),
+            (['AAA', 'BBB'], '2021-02-15', '2021-02-28'),
+            (['CCC'], '2021-02-15', '2021-04-15'),
+        ])
+        expected = FixtureSource().fetch(['AAA', 'BBB', 'CCC'], np.datetime64('2021-02-15'), np.datetime64('2021-04-15'))
+        np.testing.assert_allclose(closes.to_numpy(), expected.to_numpy())
+
+        source.requests.clear()
+        stored.refresh(['AAA', 'BBB', 'DDD'], end='2021-05-07')
+        self.assertEqual(sorted(source.requests), [(['AAA'], '2021-04-16', '2021-05-07'), (['BBB'], '2021-05-01', '2021-05-07')])
+
+if __name__ == '__main__':
+    unittest.main()
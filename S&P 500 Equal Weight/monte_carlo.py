@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import unittest
+from multiprocessing import shared_memory
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+METRICS = ('Total Return', 'Annualized Return', 'Volatility', 'Sharpe Ratio', 'Max Drawdown')
+# Each task draws its block starts from its own seeded stream, so results do not depend on the worker count
+TASK_SIZE = 64
+# Upper bound on the (paths, days, stocks) growth array a task builds at once
+TASK_MEMORY = 64 * 2**20
+
+# Attached shared arrays, set once per worker process by _attach
+_shared = {}
+
+def path_metrics(values, periods_per_year=TRADING_DAYS):
+    """``calculate_metrics`` figures plus max drawdown for each row of a (paths, days) value matrix."""
+    values = np.atleast_2d(values)
+    total_return = values[:, -1] / values[:, 0] - 1
+    annualized_return = (1 + total_return) ** (periods_per_year / values.shape[1]) - 1
+    volatility = (values[:, 1:] / values[:, :-1] - 1).std(axis=1, ddof=1) * np.sqrt(periods_per_year)
+    max_drawdown = (1 - values / np.maximum.accumulate(values, axis=1)).max(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe_ratio = annualized_return / volatility
+    return np.column_stack([total_return, annualized_return, volatility, sharpe_ratio, max_drawdown])
+
+def _simulate(returns, results, task, seed, block_size, horizon):
+    """Fill rows ``task * TASK_SIZE`` onward of ``results`` with metrics of block-bootstrapped paths."""
+    lo = task * TASK_SIZE
+    hi = min(lo + TASK_SIZE, len(results))
+    days, stocks = returns.shape
+    blocks = -(-horizon // block_size)
+    # Circular blocks, so every day is equally likely to be drawn
+    starts = np.random.default_rng([seed, task]).integers(0, days, (hi - lo, blocks))
+    rows = ((starts[:, :, None] + np.arange(block_size)) % days).reshape(hi - lo, -1)[:, :horizon]
+
+    batch = max(1, TASK_MEMORY // (horizon * stocks * returns.itemsize))
+    for first in range(0, hi - lo, batch):
+        # Buy and hold: each stock's growth from an equal initial stake, averaged across stocks
+        growth = np.cumprod(1 + returns[rows[first:first + batch]], axis=1).mean(axis=2)
+        values = np.concatenate([np.ones((len(growth), 1)), growth], axis=1)
+        results[lo + first:lo + first + len(growth)] = path_metrics(values)
+
+def _attach(returns_name, returns_shape, results_name, results_shape):
+    for key, name, shape in (('returns', returns_name, returns_shape), ('results', results_name, results_shape)):
+        memory = shared_memory.SharedMemory(name=name)
+        _shared[key + '_memory'] = memory
+        _shared[key] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+def _run_task(args):
+    _simulate(_shared['returns'], _shared['results'], *args)
+
+def _shared_array(shape):
+    memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+    return memory, np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+def bootstrap(prices, resamples=10000, block_size=21, horizon=None, seed=0, workers=None):
+    """Metrics of ``resamples`` block-bootstrapped equal-weight portfolio paths.
+
+    Daily returns of every stock priced on the first day are resampled together,
+    in circular blocks of ``block_size`` days, into paths of ``horizon`` days
+    (default: the length of the history). Resampling whole rows keeps the
+    correlation between stocks; resampling blocks keeps short-term
+    autocorrelation.
+
+    The returns matrix is copied into shared memory once and the resamples
+    are split into tasks of ``TASK_SIZE``. Each task is run by a process pool of
+    ``workers`` (default: one per CPU). Workers map the matrix without
+    pickling it and write their metrics straight into a shared result matrix.
+    The same ``seed`` gives the same result for any worker count.
+
+    Returns a DataFrame with one row per resample.
+    """
+    prices = prices.ffill().dropna(axis=1)
+    P = prices.to_numpy(dtype=np.float64)
+    horizon = len(P) - 1 if horizon is None else horizon
+    if len(P) < 2 or horizon < 2:
+        raise ValueError("bootstrap needs at least two days of returns")
+    workers = workers or os.cpu_count() or 1
+    tasks = [(task, seed, block_size, horizon) for task in range(-(-resamples // TASK_SIZE))]
+
+    returns_memory, returns = _shared_array((len(P) - 1, P.shape[1]))
+    results_memory, results = _shared_array((resamples, len(METRICS)))
+    try:
+        np.divide(P[1:], P[:-1], out=returns)
+        returns -= 1
+        if workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                _simulate(returns, results, *task)
+        else:
+            initargs = (returns_memory.name, returns.shape, results_memory.name, results.shape)
+            with multiprocessing.get_context().Pool(min(workers, len(tasks)), _attach, initargs) as pool:
+                pool.map(_run_task, tasks, chunksize=max(1, len(tasks) // (4 * workers)))
+        samples = pd.DataFrame(results.copy(), columns=list(METRICS))
+    finally:
+        del returns, results
+        for memory in (returns_memory, results_memory):
+            memory.close()
+            memory.unlink()
+    return samples
+
+def summarize(samples, observed=None, confidence=0.95):
+    """Mean, spread and a ``confidence`` interval of each metric, next to the observed values if given."""
+    tail = (1 - confidence) / 2
+    summary = pd.DataFrame({
+        'Mean': samples.mean(),
+        'Std': samples.std(),
+        f'{tail:.1%}': samples.quantile(tail),
+        'Median': samples.median(),
+        f'{1 - tail:.1%}': samples.quantile(1 - tail),
+    })
+    if observed is not None:
+        summary.insert(0, 'Observed', pd.Series(observed, index=samples.columns))
+    return summary
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        dates = pd.bdate_range('2022-01-03', periods=90)
+        closes = 30 * np.exp(np.cumsum(rng.normal(0.0004, 0.02, (len(dates), 6)), axis=0))
+        self.prices = pd.DataFrame(closes, index=dates, columns=list('ABCDEF'))
+
+    def run_bootstrap(self, **kwargs):
+        """bootstrap(), recording the shared-memory segments it creates in ``self.created``."""
+        self.created = []
+        create = _shared_array
+        def recording(shape):
+            memory, array = create(shape)
+            self.created.append(memory.name)
+            return memory, array
+        with mock.patch(f'{__name__}._shared_array', recording):
+            return bootstrap(self.prices, **kwargs)
+
+    def assert_unlinked(self):
+        self.assertEqual(len(self.created), 2)
+        for name in self.created:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_worker_count_does_not_change_results(self):
+        # Tasks do not divide the resamples evenly, so the last one is short
+        resamples = 3 * TASK_SIZE + 5
+        single = self.run_bootstrap(resamples=resamples, block_size=5, seed=42, workers=1)
+        self.assert_unlinked()
+        pooled = self.run_bootstrap(resamples=resamples, block_size=5, seed=42, workers=3)
+        self.assert_unlinked()
+        pd.testing.assert_frame_equal(single, pooled)
+        self.assertFalse(single.isna().any().any())
+
+        other = self.run_bootstrap(resamples=resamples, block_size=5, seed=43, workers=3)
+        self.assertFalse(np.allclose(single.to_numpy(), other.to_numpy()))
+
+    def test_paths_match_day_by_day_simulation(self):
+        samples = bootstrap(self.prices, resamples=10, block_size=4, horizon=30, seed=7, workers=1)
+        P = self.prices.to_numpy()
+        returns = P[1:] / P[:-1] - 1
+        # The block starts task 0 draws: 8 blocks of 4 days cover the 30-day horizon
+        starts = np.random.default_rng([7, 0]).integers(0, len(returns), (10, 8))
+        for path, path_starts in enumerate(starts):
+            days = [(start + offset) % len(returns) for start in path_starts for offset in range(4)][:30]
+            # Equal stakes in each stock, held through the resampled days
+            holdings = np.full(P.shape[1], 1 / P.shape[1])
+            values = [1.0]
+            for day in days:
+                holdings = holdings * (1 + returns[day])
+                values.append(holdings.sum())
+            np.testing.assert_allclose(samples.iloc[path].to_numpy(), path_metrics(np.array(values))[0], rtol=1e-12)
+
+    def test_shared_memory_released_on_error(self):
+        # A zero block size fails inside the worker processes
+        with self.assertRaises(ZeroDivisionError):
+            self.run_bootstrap(resamples=2 * TASK_SIZE, block_size=0, workers=2)
+        self.assert_unlinked()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+import math
+import unittest
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+METRICS = ('Total Return', 'Annualized Return', 'Volatility', 'Sharpe Ratio', 'Max Drawdown', 'Drawdown Duration')
+
+def _combine(first, second):
+    # A window summary is (high, low, max drawdown); combining two adjacent windows is associative
+    return (first[0] if first[0] >= second[0] else second[0],
+            first[1] if first[1] <= second[1] else second[1],
+            max(first[2], second[2], 1 - second[1] / first[0]))
+
+class RollingMetrics:
+    """Portfolio metrics over the last ``window`` bars, updated in O(1) per bar.
+
+    A window of ``window`` bars holds ``window + 1`` values, and its figures are
+    the ones ``calculate_metrics`` would give for those values. There are two
+    additions: Max Drawdown, the largest fall from a high within the window, and
+    Drawdown Duration, the bars since the window's high. Until the window has
+    filled every figure is NaN.
+
+    Volatility comes from running sums of returns and squared returns, resummed
+    exactly once per window so rounding cannot build up. Max drawdown uses a
+    two-stack queue of window summaries, and the window high a monotonic deque.
+    Both are amortized O(1).
+    """
+    def __init__(self, window=21, periods_per_year=TRADING_DAYS):
+        if window < 2:
+            raise ValueError("window must be at least 2 bars")
+        self.window = window
+        self.periods_per_year = periods_per_year
+        self.count = 0
+        self.values = deque()
+        self.returns = deque()
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.until_resum = window
+        self.moves = 0  # nonzero returns in the window; a flat window has exactly zero volatility
+        self.highs = deque()  # (bar, value) with strictly decreasing values
+        self.front = []  # summaries from each value to the end of the front stack, oldest on top
+        self.back = []
+        self.back_summary = None
+
+    def _push(self, value):
+        bar = self.count
+        self.count += 1
+        values = self.values
+        values.append(value)
+        if len(values) > 1:
+            r = value / values[-2] - 1
+            self.returns.append(r)
+            self.sum += r
+            self.sum_squares += r * r
+            self.moves += r != 0
+            if len(self.returns) > self.window:
+                old = self.returns.popleft()
+                self.sum -= old
+                self.sum_squares -= old * old
+                self.moves -= old != 0
+            self.until_resum -= 1
+            if self.until_resum == 0:
+                self.sum = math.fsum(self.returns)
+                self.sum_squares = math.fsum(r * r for r in self.returns)
+                self.until_resum = self.window
+
+        if len(values) > self.window + 1:
+            values.popleft()
+            if not self.front:
+                summary = None
+                for item in reversed(self.back):
+                    summary = item if summary is None else _combine(item, summary)
+                    self.front.append(summary)
+                self.back.clear()
+                self.back_summary = None
+            self.front.pop()
+        item = (value, value, 0.0)
+        self.back.append(item)
+        self.back_summary = item if self.back_summary is None else _combine(self.back_summary, item)
+
+        highs = self.highs
+        while highs and highs[-1][1] <= value:
+            highs.pop()
+        highs.append((bar, value))
+        if highs[0][0] < bar - self.window:
+            highs.popleft()
+
+    def update(self, value):
+        """Add the next bar's value and return the metrics for the window ending at it."""
+        self._push(float(value))
+        return self.metrics()
+
+    def update_many(self, values):
+        """Add a block of bars and return the metrics for the window ending at the last one."""
+        for value in values:
+            self._push(float(value))
+        return self.metrics()
+
+    def metrics(self):
+        if len(self.values) <= self.window:
+            return dict.fromkeys(METRICS, math.nan)
+        n = self.window
+        total_return = self.values[-1] / self.values[0] - 1
+        annualized_return = (1 + total_return) ** (self.periods_per_year / (n + 1)) - 1
+        variance = (self.sum_squares - self.sum * self.sum / n) / (n - 1) if self.moves else 0.0
+        volatility = math.sqrt(max(variance, 0.0)) * math.sqrt(self.periods_per_year)
+        if not self.front:
+            summary = self.back_summary
+        elif self.back_summary is None:
+            summary = self.front[-1]
+        else:
+            summary = _combine(self.front[-1], self.back_summary)
+        return {
+            'Total Return': total_return,
+            'Annualized Return': annualized_return,
+            'Volatility': volatility,
+            'Sharpe Ratio': annualized_return / volatility if volatility > 0 else math.nan,
+            'Max Drawdown': summary[2],
+            'Drawdown Duration': self.count - 1 - self.highs[0][0],
+        }
+
+def _window_drawdowns(v, n):
+    """Max drawdown and bars since the high for every window of ``n + 1`` values, in O(len(v)).
+
+    The series is cut into blocks of one window's length, so each window is a
+    suffix of one block followed by a prefix of the next. Prefix and suffix
+    summaries of every block are running accumulations, which are then
+    combined the same way ``_combine`` does.
+    """
+    L = n + 1
+    K = -(-len(v) // L)
+    blocks = np.pad(v, (0, K * L - len(v)), mode='edge').reshape(K, L)
+    col = np.arange(L)
+
+    prefix_high = np.maximum.accumulate(blocks, axis=1)
+    prefix_low = np.minimum.accumulate(blocks, axis=1)
+    prefix_drawdown = np.maximum.accumulate(1 - blocks / prefix_high, axis=1)
+    prefix_high_at = np.maximum.accumulate(np.where(blocks == prefix_high, col, 0), axis=1)
+
+    reverse = blocks[:, ::-1]
+    suffix_high = np.maximum.accumulate(reverse, axis=1)[:, ::-1]
+    suffix_low = np.minimum.accumulate(reverse, axis=1)[:, ::-1]
+    suffix_drawdown = np.maximum.accumulate((1 - suffix_low / blocks)[:, ::-1], axis=1)[:, ::-1]
+    # The latest high of a suffix is the first value at or after its start that beats everything after it
+    beats_rest = np.ones_like(blocks, dtype=bool)
+    beats_rest[:, :-1] = blocks[:, :-1] > suffix_high[:, 1:]
+    suffix_high_at = np.minimum.accumulate(np.where(beats_rest, col, L)[:, ::-1], axis=1)[:, ::-1]
+
+    prefix_high, prefix_low, prefix_drawdown, prefix_high_at = (
+        a.ravel() for a in (prefix_high, prefix_low, prefix_drawdown, prefix_high_at))
+    suffix_high, suffix_drawdown, suffix_high_at = (a.ravel() for a in (suffix_high, suffix_drawdown, suffix_high_at))
+    starts = np.arange(len(v) - n)
+    ends = starts + n
+    high = suffix_high[starts]
+    drawdown = np.maximum(np.maximum(suffix_drawdown[starts], prefix_drawdown[ends]), 1 - prefix_low[ends] / high)
+    high_at = np.where(prefix_high[ends] >= high, ends - ends % L + prefix_high_at[ends],
+                       starts - starts % L + suffix_high_at[starts])
+
+    # A window starting on a block boundary is that whole block
+    whole = starts[starts % L == 0]
+    drawdown[whole] = suffix_drawdown[whole]
+    high_at[whole] = whole + suffix_high_at[whole]
+    return drawdown, ends - high_at
+
+def rolling_metrics(values, window=21, periods_per_year=TRADING_DAYS):
+    """The ``RollingMetrics`` figures for every bar of ``values`` at once.
+
+    Returns a DataFrame indexed like ``values``; everything is O(len(values)).
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    v = np.asarray(values, dtype=float)
+    T, n = len(v), window
+    columns = {metric: np.full(T, np.nan) for metric in METRICS}
+    if T > n:
+        returns = v[1:] / v[:-1] - 1
+        sums = np.concatenate([[0.0], np.cumsum(returns)])
+        sums_squares = np.concatenate([[0.0], np.cumsum(returns * returns)])
+        # The window ending at bar t holds returns[t - n:t]
+        s1 = sums[n:] - sums[:-n]
+        s2 = sums_squares[n:] - sums_squares[:-n]
+        moves = np.concatenate([[0], np.cumsum(returns != 0)])
+        flat = moves[n:] == moves[:-n]
+
+        total_return = v[n:] / v[:-n] - 1
+        annualized_return = (1 + total_return) ** (periods_per_year / (n + 1)) - 1
+        variance = np.where(flat, 0.0, (s2 - s1 * s1 / n) / (n - 1))
+        volatility = np.sqrt(np.maximum(variance, 0)) * math.sqrt(periods_per_year)
+        columns['Total Return'][n:] = total_return
+        columns['Annualized Return'][n:] = annualized_return
+        columns['Volatility'][n:] = volatility
+        with np.errstate(divide='ignore', invalid='ignore'):
+            columns['Sharpe Ratio'][n:] = np.where(volatility > 0, annualized_return / volatility, np.nan)
+
+        columns['Max Drawdown'][n:], columns['Drawdown Duration'][n:] = _window_drawdowns(v, n)
+    return pd.DataFrame(columns, index=index)
+
+def _brute_force(values, window, periods_per_year=TRADING_DAYS):
+    """Every window's figures recomputed from scratch, the way ``calculate_metrics`` does."""
+    rows = []
+    for t in range(len(values)):
+        if t < window:
+            rows.append([math.nan] * len(METRICS))
+            continue
+        w = pd.Series(values[t - window:t + 1])
+        total_return = (w.iloc[-1] - w.iloc[0]) / w.iloc[0]
+        annualized_return = (1 + total_return) ** (periods_per_year / len(w)) - 1
+        volatility = w.pct_change().std() * np.sqrt(periods_per_year)
+        high = np.maximum.accumulate(w.to_numpy())
+        last_high = len(w) - 1 - int(np.argmax(w.to_numpy()[::-1]))
+        rows.append([total_return, annualized_return, volatility,
+                     annualized_return / volatility if volatility > 0 else math.nan,
+                     float(np.max(1 - w.to_numpy() / high)), window - last_high])
+    return np.array(rows)
+
+class TestRollingMetrics(unittest.TestCase):
+
+    def series(self):
+        rng = np.random.default_rng(11)
+        yield 'random', 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 120)))
+        # Repeated highs and lows, so ties decide the drawdown duration
+        yield 'tied', rng.integers(95, 100, 120).astype(float)
+        yield 'flat', np.full(60, 42.0)
+        yield 'stepped', np.repeat([100.0, 90.0, 100.0, 80.0, 110.0], 13)
+
+    def check(self, name, window, metrics, expected):
+        # Volatility and Sharpe come from running sums, so they agree to rounding only
+        np.testing.assert_allclose(metrics, expected, rtol=1e-9, atol=1e-12, equal_nan=True,
+                                   err_msg=f"{name} series, window {window}")
+
+    def test_streaming_matches_brute_force(self):
+        for name, values in self.series():
+            for window in (2, 5, 21):
+                rolling = RollingMetrics(window)
+                streamed = [list(rolling.update(value).values()) for value in values]
+                self.check(name, window, np.array(streamed), _brute_force(values, window))
+
+    def test_blocks_match_single_bars(self):
+        for name, values in self.series():
+            single, blocks = RollingMetrics(10), RollingMetrics(10)
+            for start in range(0, len(values), 7):
+                block = blocks.update_many(values[start:start + 7])
+                single_result = [single.update(value) for value in values[start:start + 7]][-1]
+                self.assertEqual(list(block.values()), list(single_result.values()), name)
+
+    def test_batch_matches_brute_force(self):
+        for name, values in self.series():
+            for window in (2, 5, 21, len(values) - 1):
+                dates = pd.bdate_range('2020-01-01', periods=len(values))
+                batch = rolling_metrics(pd.Series(values, index=dates), window)
+                self.assertTrue(batch.index.equals(dates))
+                self.assertEqual(list(batch.columns), list(METRICS))
+                self.check(name, window, batch.to_numpy(), _brute_force(values, window))
+
+    def test_flat_window_has_zero_volatility(self):
+        values = np.r_[np.linspace(100, 110, 10), np.full(30, 110.0)]
+        streamed = RollingMetrics(20).update_many(values)
+        batch = rolling_metrics(values, 20).iloc[-1]
+        for metrics in (streamed, batch):
+            self.assertEqual(metrics['Volatility'], 0.0)
+            self.assertTrue(math.isnan(metrics['Sharpe Ratio']))
+
+    def test_window_must_hold_two_returns(self):
+        with self.assertRaises(ValueError):
+            RollingMetrics(1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+"""Throughput, latency and memory benchmarks for the matching engines in this repository.
+
+The engines live in directories with spaces in their names, so they are put on
+``sys.path`` here and imported as top-level modules, the same way their own
+scripts import each other.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYTHON_ENGINE_DIR = os.path.join(ROOT, 'Equity Matching Engine', 'Python Version')
+CPP_ENGINE_DIR = os.path.join(ROOT, 'Equity Matching Engine', 'CPP-Version')
+ORDERBOOK_SIMULATION_DIR = os.path.join(ROOT, 'Orderbook Simulation')
+
+for _path in (PYTHON_ENGINE_DIR, ORDERBOOK_SIMULATION_DIR):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
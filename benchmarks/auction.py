@@ -0,0 +1,78 @@
+"""Measure opening many symbols with a call auction against matching the same orders continuously.
+
+    python -m benchmarks.auction --symbols 20000 --orders 1000000
+
+The flow is collected pre-open by ``auction.CallAuction`` and uncrossed in one
+call; the same orders are then fed one by one to a plain engine, which is
+what opening without an auction would do.
+"""
+import argparse
+import time
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink
+from auction import CallAuction
+
+from .order_flow import generate_order_flow, TICK_SIZE
+
+def _orders(events):
+    return [Order(order_id, order_id, symbol, order_type, side, price * TICK_SIZE, quantity,
+                  'IOC' if order_type == 'M' else 'GTC')
+            for _, order_id, symbol, side, order_type, price, quantity, _ in events]
+
+def benchmark_auction(events) -> dict:
+    symbols = sorted({event[2] for event in events})
+    engine = MatchingEngine(fill_sink=NullFillSink())
+    auction = CallAuction(engine)
+    auction.start(symbols)
+    for order in _orders(events):
+        auction.add_order(order)
+    start = time.perf_counter()
+    opened = auction.uncross()
+    auction_seconds = time.perf_counter() - start
+
+    continuous = MatchingEngine(fill_sink=NullFillSink())
+    orders = _orders(events)
+    start = time.perf_counter()
+    for order in orders:
+        continuous.add_order(order)
+    continuous_seconds = time.perf_counter() - start
+    tape = continuous.trade_tape
+    prices = set(zip(tape.columns['symbol_id'][:len(tape)], tape.columns['price'][:len(tape)]))
+
+    return {
+        'symbols': len(symbols),
+        'orders': len(events),
+        'auction': {
+            'seconds': auction_seconds,
+            'symbols_opened': len(opened),
+            'fills': len(engine.trade_tape),
+            'volume': sum(volume for _, volume in opened.values()),
+            'prices_per_symbol': 1.0,
+        },
+        'continuous': {
+            'seconds': continuous_seconds,
+            'fills': len(tape),
+            'volume': sum(tape.columns['quantity'][:len(tape)]),
+            'prices_per_symbol': len(prices) / max(1, len({symbol_id for symbol_id, _ in prices})),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark call-auction uncrossing.")
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--symbols', type=int, default=20000)
+    parser.add_argument('--depth', type=int, default=20, help="limit prices land within this many ticks of the mid")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    events = generate_order_flow(args.orders, args.symbols, depth=args.depth, cancel_ratio=0, own_ratio=0, seed=args.seed)
+    result = benchmark_auction(events)
+    print(f"{result['orders']:,} pre-open orders across {result['symbols']:,} symbols")
+    print(f"{'mode':12} {'seconds':>9} {'fills':>10} {'volume':>12} {'prices/symbol':>14}")
+    for mode in ('auction', 'continuous'):
+        stats = result[mode]
+        print(f"{mode:12} {stats['seconds']:>9.3f} {stats['fills']:>10,} {stats['volume']:>12,} {stats['prices_per_symbol']:>14.1f}")
+    print(f"symbols opened by the auction: {result['auction']['symbols_opened']:,}")
+
+if __name__ == "__main__":
+    main()
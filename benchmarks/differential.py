@@ -0,0 +1,365 @@
+"""Differential fuzzing of mini_matching_engine against CPP-Version/matching_engine.cpp, and against itself.
+
+    python -m benchmarks.differential --commands 1000000 --profile agreed
+    python -m benchmarks.differential --commands 1000000 --profile stops
+
+Seeded command streams are run through several engines, and their fills and
+acknowledgements are compared. The reference is ``MatchingEngine`` on its
+default ``PriceLevelOrderBook``, fed one ``add_order`` at a time. Every stream
+also runs on the heap ``OrderBook``, and through ``add_orders`` with each run
+of consecutive new orders as one batch; those must agree with the reference
+on every profile. A stream is cut into short sessions. Each
+session has its own symbols and ends with a cancel for every order it sent, so
+many sessions can share one C++ process without its linear scans growing.
+
+The C++ engine only matches on ``M``, so every new order and amend is followed
+by ``M,<timestamp>,<symbol>``. With that, it behaves like a continuous engine
+whose incoming order is always last in its book.
+
+Outside a common subset the two engines disagree by design. The C++ matcher
+walks resting orders in arrival order, without price priority, and prints each
+fill at the incoming order's price. It matches market and IOC orders only
+against orders of the same type, and it amends orders in place.
+
+``--profile agreed`` stays inside the subset: limit orders at one price per
+symbol, and amends down to one share. There, any divergence is a bug in one of
+the engines. ``--profile full`` draws from every command and shows where the
+engines differ.
+
+The other profiles are not run through C++, since they rely on price priority
+or on orders it lacks. ``--profile levels`` sends limit orders at several
+prices per symbol, with amends to any price and quantity, so orders sweep
+several levels. ``--profile stops`` adds market, IOC, stop and stop-limit
+orders, with stop prices around the symbol's price so they trigger each other.
+
+The first ``--shrink`` diverging sessions are reduced by delta debugging to a
+short stream that still diverges, and printed as C++ input, or as commands for
+the profiles C++ does not run.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from mini_matching_engine import MatchingEngine, Order, OrderBook, MemoryFillSink, ACCEPTED
+
+from .engines import compile_cpp_engine
+from .order_flow import TICK_SIZE
+
+PROFILES = ('agreed', 'full', 'levels', 'stops')
+CPP_PROFILES = ('agreed', 'full')
+# Order types drawn by each profile past 'agreed': C++ codes, plus the Python engine's stop types
+ORDER_TYPES = {'full': 'LLLLLLMI', 'levels': 'L', 'stops': ('L',) * 6 + ('M', 'I', 'S', 'SL')}
+# Python engines diffed against the reference, the first one
+VARIANTS = ('price levels', 'heap book', 'add_orders')
+
+# (kind, order_id, symbol, order_type, side, ticks, quantity, stop_ticks); a cancel leaves the last five None.
+# Order types are L, M and I as the C++ engine has them, or S and SL for stops.
+Command = Tuple[str, int, str, Optional[str], Optional[str], Optional[int], Optional[int], Optional[int]]
+# Fills per symbol as (resting_id, aggressor_id, quantity, price), in the order they happened
+Fills = dict
+
+def _symbol(index: int) -> str:
+    # C++ symbols are alphabetic only
+    letters = ''
+    while True:
+        index, digit = divmod(index, 26)
+        letters = chr(ord('A') + digit) + letters
+        if not index:
+            return letters
+
+def generate_session(rng: random.Random, profile: str, length: int, symbols: List[str], first_order_id: int) -> List[Command]:
+    """``length`` random commands on ``symbols``, then a cancel for every order they sent."""
+    prices = {symbol: rng.randrange(1000, 20000) for symbol in symbols}
+    orders = {}
+    commands = []
+    for order_id in range(first_order_id, first_order_id + length):
+        roll = rng.random()
+        if orders and roll < 0.15:
+            target = rng.choice(list(orders))
+            commands.append(('X', target, orders[target][0], None, None, None, None, None))
+        elif orders and roll < 0.25:
+            target = rng.choice(list(orders))
+            symbol, order_type, side, ticks, stop_ticks = orders[target]
+            if profile == 'agreed':
+                # Down to one share is never an increase, so both engines keep the order's place
+                commands.append(('A', target, symbol, order_type, side, ticks, 1, stop_ticks))
+            else:
+                commands.append(('A', target, symbol, order_type, side, prices[symbol] + rng.randrange(-3, 4),
+                                 rng.randrange(1, 100), stop_ticks))
+        else:
+            symbol = rng.choice(symbols)
+            side = rng.choice('BS')
+            stop_ticks = None
+            if profile == 'agreed':
+                order_type, ticks = 'L', prices[symbol]
+            else:
+                order_type = rng.choice(ORDER_TYPES[profile])
+                ticks = 0 if order_type in ('M', 'S') else prices[symbol] + rng.randrange(-3, 4)
+                if order_type in ('S', 'SL'):
+                    stop_ticks = prices[symbol] + rng.randrange(-3, 4)
+            orders[order_id] = (symbol, order_type, side, ticks, stop_ticks)
+            commands.append(('N', order_id, symbol, order_type, side, ticks, rng.randrange(1, 100), stop_ticks))
+    commands += [('X', order_id, symbol, None, None, None, None, None) for order_id, (symbol, *_) in orders.items()]
+    return commands
+
+def _order_fields(order_type: str, ticks: int, stop_ticks: Optional[int]) -> tuple:
+    """The Python type, price, time in force and stop price of a command's order.
+
+    ``I`` orders become IOC limits and ``M`` orders IOC market orders, as the
+    problem statement defines them. Stop orders are IOC, as a triggered stop is.
+    """
+    stop_price = stop_ticks * TICK_SIZE if stop_ticks is not None else None
+    return ('L' if order_type == 'I' else order_type, ticks * TICK_SIZE,
+            'GTC' if order_type in ('L', 'SL') else 'IOC', stop_price)
+
+def run_python(commands: List[Command], variant: str = VARIANTS[0]) -> Tuple[List[bool], Fills, float]:
+    """Acknowledgements, fills and seconds taken on a fresh MatchingEngine set up as ``variant``."""
+    engine = MatchingEngine(order_book=OrderBook() if variant == 'heap book' else None, fill_sink=MemoryFillSink())
+    add_order, amend_order, cancel_order = engine.add_order, engine.amend_order, engine.cancel_order
+    batched = variant == 'add_orders'
+    acks = []
+    start = time.perf_counter()
+    batch = []
+    for timestamp, (kind, order_id, symbol, order_type, side, ticks, quantity, stop_ticks) in enumerate(commands, 1):
+        if kind == 'N':
+            python_type, price, time_in_force, stop_price = _order_fields(order_type, ticks, stop_ticks)
+            if batched:
+                batch.append((order_id, timestamp, symbol, python_type, side, price, quantity, time_in_force, stop_price))
+                continue
+            add_order(Order(order_id, timestamp, symbol, python_type, side, price, quantity, time_in_force,
+                            stop_price=stop_price))
+            acks.append(True)
+            continue
+        if batch:
+            acks += _add_batch(engine, batch)
+            batch = []
+        if kind == 'A':
+            acks.append(amend_order(order_id, ticks * TICK_SIZE, quantity, timestamp))
+        else:
+            acks.append(cancel_order(order_id))
+    if batch:
+        acks += _add_batch(engine, batch)
+    seconds = time.perf_counter() - start
+
+    fills = {}
+    for symbol, aggressor_id, resting_id, quantity, price in engine.fill_sink.fills:
+        fills.setdefault(symbol, []).append((resting_id, aggressor_id, quantity, f"{price:.2f}"))
+    return acks, fills, seconds
+
+def _add_batch(engine: MatchingEngine, rows: list) -> List[bool]:
+    order_ids, timestamps, symbols, types, sides, prices, quantities, times_in_force, stop_prices = zip(*rows)
+    acks, _ = engine.add_orders({
+        'order_id': order_ids, 'timestamp': timestamps, 'symbol': symbols, 'type': types, 'side': sides,
+        'price': prices, 'quantity': quantities, 'time_in_force': times_in_force,
+        'stop_price': [float('nan') if stop_price is None else stop_price for stop_price in stop_prices]})
+    return (acks['status'] == ACCEPTED).tolist()
+
+def cpp_input(commands: List[Command]) -> List[str]:
+    lines = []
+    for timestamp, (kind, order_id, symbol, order_type, side, ticks, quantity, _) in enumerate(commands, 1):
+        if kind == 'X':
+            lines.append(f"X,{order_id},{timestamp}")
+        else:
+            lines.append(f"{kind},{order_id},{timestamp},{symbol},{order_type},{side},{ticks * TICK_SIZE:.2f},{quantity}")
+            lines.append(f"M,{timestamp},{symbol}")
+    return [str(len(lines))] + lines
+
+def run_cpp(binary: str, workdir: str, commands: List[Command]):
+    """Acknowledgements, fills and seconds taken by one C++ process, or None for the first two if it crashed."""
+    payload = ("\n".join(cpp_input(commands)) + "\n").encode()
+    start = time.perf_counter()
+    completed = subprocess.run([binary], input=payload, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        return None, None, seconds
+    with open(os.path.join(workdir, 'output.txt')) as f:
+        lines = f.read().splitlines()
+
+    # Each M prints every fill its symbol has had so far, so only the symbol's last block is kept.
+    # Blocks are separated by the acknowledgement of the command before each M.
+    acks, blocks, done, current = [], {}, set(), None
+    for line in reversed(lines):
+        bar = line.find('|')
+        if bar < 0:
+            if current is not None:
+                done.add(current)
+                current = None
+            if line:
+                acks.append(line.split(' - ')[1] in ('Accept', 'CancelAccept', 'AmendAccept'))
+            continue
+        symbol = line[:bar]
+        if symbol != current:
+            if current is not None:
+                done.add(current)
+                current = None
+            if symbol in done:
+                continue
+            current = symbol
+            blocks[symbol] = []
+        blocks[symbol].append(line)
+    acks.reverse()
+
+    fills = {}
+    for symbol, block in blocks.items():
+        rows = fills[symbol] = []
+        for line in reversed(block):
+            _, resting, aggressor = line.split('|')
+            resting_id, _, quantity, _ = resting.split(',')
+            price, _, _, aggressor_id = aggressor.split(',')
+            rows.append((int(resting_id), int(aggressor_id), int(quantity), price))
+    return acks, fills, seconds
+
+def difference(commands: List[Command], reference: tuple, other: tuple, names: Tuple[str, str] = ('Python', 'C++')) -> Optional[str]:
+    """The first way the ``other`` run of ``commands`` differs from the ``reference`` run, or None.
+
+    Runs are the (acknowledgements, fills, seconds) ``run_python`` and ``run_cpp`` return.
+    """
+    (reference_acks, reference_fills, _), (other_acks, other_fills, _) = reference, other
+    first, second = names
+    if other_acks is None:
+        return f"{second} engine crashed"
+    for index, (command, expected, actual) in enumerate(zip(commands, reference_acks, other_acks)):
+        if expected != actual:
+            outcome = {True: 'accepted', False: 'rejected'}
+            return (f"command {index + 1} {command[0]},{command[1]}: {first} {outcome[expected]}, "
+                    f"{second} {outcome[actual]}")
+    if len(other_acks) != len(reference_acks):
+        return f"{second} acknowledged {len(other_acks)} of {len(reference_acks)} commands"
+    for symbol in sorted(set(reference_fills) | set(other_fills)):
+        expected, actual = reference_fills.get(symbol, []), other_fills.get(symbol, [])
+        for index, (reference_fill, other_fill) in enumerate(zip(expected, actual)):
+            if reference_fill != other_fill:
+                return f"{symbol} fill {index + 1}: {first} {reference_fill}, {second} {other_fill}"
+        if len(expected) != len(actual):
+            return f"{symbol}: {first} has {len(expected)} fills, {second} {len(actual)}"
+    return None
+
+def shrink(commands: List[Command], diverges) -> List[Command]:
+    """Delta debugging: drop ever smaller slices of ``commands`` while what is left still diverges."""
+    granularity = 2
+    while len(commands) > 1:
+        size = -(-len(commands) // granularity)
+        for start in range(0, len(commands), size):
+            candidate = commands[:start] + commands[start + size:]
+            if diverges(candidate):
+                commands = candidate
+                granularity = max(granularity - 1, 2)
+                break
+        else:
+            if size == 1:
+                break
+            granularity = min(granularity * 2, len(commands))
+    return commands
+
+def fuzz(binary: str, workdir: str, profile: str, total: int, seed: int, session_length: int = 64,
+         symbols_per_session: int = 2, run_commands: int = 50000, shrink_limit: int = 1) -> dict:
+    """Fuzz ``total`` commands of ``profile``; ``binary`` is only run for the profiles in ``CPP_PROFILES``."""
+    rng = random.Random(seed)
+    engines = VARIANTS + ('C++',) if profile in CPP_PROFILES else VARIANTS
+    result = {'profile': profile, 'seed': seed, 'commands': 0, 'sessions': 0, 'diverging_sessions': 0,
+              'diverging': {name: 0 for name in engines[1:]}, 'crashed_runs': 0,
+              'seconds': {name: 0.0 for name in engines}, 'divergences': []}
+    order_id = 1
+
+    def run(commands):
+        runs = {name: run_python(commands, name) for name in VARIANTS}
+        if 'C++' in engines:
+            runs['C++'] = run_cpp(binary, workdir, commands)
+        return runs
+
+    def differences(commands, runs=None) -> dict:
+        """How each engine that differs from the reference engine on ``commands`` differs, by engine."""
+        runs = runs or run(commands)
+        reference = VARIANTS[0]
+        found = {}
+        for name in engines[1:]:
+            names = ('Python', 'C++') if name == 'C++' else (reference, name)
+            found[name] = difference(commands, runs[reference], runs[name], names)
+        return {name: text for name, text in found.items() if text is not None}
+
+    def compare(commands):
+        return next(iter(differences(commands).values()), None)
+
+    while result['commands'] < total:
+        sessions = []
+        while sum(map(len, sessions)) < run_commands and result['commands'] + sum(map(len, sessions)) < total:
+            symbols = [_symbol(result['sessions'] * symbols_per_session + k) for k in range(symbols_per_session)]
+            sessions.append(generate_session(rng, profile, session_length, symbols, order_id))
+            order_id += session_length
+            result['sessions'] += 1
+        commands = [command for session in sessions for command in session]
+        result['commands'] += len(commands)
+
+        runs = run(commands)
+        for name, (_, _, seconds) in runs.items():
+            result['seconds'][name] += seconds
+        if not differences(commands, runs):
+            continue
+
+        # Sessions share no symbols or orders, so each can be checked on its own
+        if 'C++' in runs and runs['C++'][0] is None:
+            result['crashed_runs'] += 1
+        for session in sessions:
+            found = differences(session)
+            if not found:
+                continue
+            result['diverging_sessions'] += 1
+            for name in found:
+                result['diverging'][name] += 1
+            if len(result['divergences']) < shrink_limit:
+                minimal = shrink(session, lambda candidate: compare(candidate) is not None)
+                # Stops have no C++ input line, so only the C++ profiles print as C++ input
+                result['divergences'].append({'difference': compare(minimal), 'commands': len(session),
+                                              'shrunk': len(minimal),
+                                              'input': cpp_input(minimal) if 'C++' in engines else list(map(repr, minimal))})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff the Python matching engines, and the C++ one, on seeded random command streams.")
+    parser.add_argument('--commands', type=int, default=1000000)
+    parser.add_argument('--profile', choices=PROFILES, default='agreed')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--session-length', type=int, default=64, help="random commands per session, before its cancels")
+    parser.add_argument('--symbols', type=int, default=2, help="symbols per session")
+    parser.add_argument('--run-commands', type=int, default=50000, help="commands per C++ process")
+    parser.add_argument('--shrink', type=int, default=1, help="diverging sessions to shrink and print")
+    parser.add_argument('--output', help="also write the result as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        binary = None
+        if args.profile in CPP_PROFILES:
+            binary = compile_cpp_engine(tmp)
+            if binary is None:
+                parser.error("no C++ compiler found")
+        result = fuzz(binary, tmp, args.profile, args.commands, args.seed, args.session_length, args.symbols,
+                      args.run_commands, args.shrink)
+
+    print(f"profile {result['profile']}, seed {result['seed']}: "
+          f"{result['commands']:,} commands in {result['sessions']:,} sessions")
+    by_engine = ", ".join(f"{name} {count:,}" for name, count in result['diverging'].items())
+    crashes = f"; {result['crashed_runs']} C++ runs crashed" if args.profile in CPP_PROFILES else ""
+    print(f"diverging sessions: {result['diverging_sessions']:,} ({by_engine}{crashes})")
+    rates = {name: result['commands'] / seconds for name, seconds in result['seconds'].items()}
+    for name, rate in rates.items():
+        note = "  (one process per run, M after every order)" if name == 'C++' else ""
+        print(f"{name:<13}{rate:>12,.0f} commands/s{note}")
+    if 'C++' in rates:
+        print(f"Python / C++ throughput: {rates[VARIANTS[0]] / rates['C++']:.2f}x")
+    for divergence in result['divergences']:
+        form = "C++ input" if args.profile in CPP_PROFILES else "commands"
+        print(f"\n{divergence['difference']}, shrunk from {divergence['commands']} to {divergence['shrunk']} commands, "
+              f"as {form}:")
+        print("\n".join(divergence['input']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
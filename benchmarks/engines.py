@@ -0,0 +1,211 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+import base_orderbook
+import class_orderbook
+import optimised_orderbook
+from mini_matching_engine import MatchingEngine, Order, OrderBook, PriceLevelOrderBook, NullFillSink
+
+from . import CPP_ENGINE_DIR
+from .order_flow import Event, TICK_SIZE
+
+Call = Tuple[Callable, tuple]
+
+def _simulation_action(side: str, owned: bool) -> str:
+    if side == 'B':
+        return 'BUY' if owned else 'BID'
+    return 'SELL' if owned else 'OFFER'
+
+class MatchingEngineAdapter:
+    """Drives mini_matching_engine.MatchingEngine one command at a time."""
+    batch = False
+
+    def __init__(self, name: str, book_factory):
+        self.name = name
+        self.book_factory = book_factory
+        self.engine = None
+
+    def reset(self):
+        self.engine = MatchingEngine(self.book_factory(), fill_sink=NullFillSink())
+
+    def prepare(self, events: List[Event]) -> List[Call]:
+        # Orders are built up front so the timed loop only measures the engine
+        add_order, cancel_order = self.engine.add_order, self.engine.cancel_order
+        calls = []
+        for kind, order_id, symbol, side, order_type, price, quantity, _ in events:
+            if kind == 'X':
+                calls.append((cancel_order, (order_id,)))
+            else:
+                time_in_force = 'IOC' if order_type == 'M' else 'GTC'
+                order = Order(order_id, order_id, symbol, order_type, side, price * TICK_SIZE, quantity, time_in_force)
+                calls.append((add_order, (order,)))
+        return calls
+
+class MatchingEngineColumnsAdapter(MatchingEngineAdapter):
+    """Builds each Order inside the timed call, as a caller holding plain columns must: the baseline for add_orders."""
+
+    def __init__(self):
+        super().__init__('mini_matching_engine.MatchingEngine[level, columns]', PriceLevelOrderBook)
+
+    def prepare(self, events: List[Event]) -> List[Call]:
+        add_order, cancel_order = self.engine.add_order, self.engine.cancel_order
+
+        def add(order_id, symbol, order_type, side, price, quantity, time_in_force):
+            add_order(Order(order_id, order_id, symbol, order_type, side, price, quantity, time_in_force))
+
+        return [(cancel_order, (order_id,)) if kind == 'X' else
+                (add, (order_id, symbol, order_type, side, price * TICK_SIZE, quantity, 'IOC' if order_type == 'M' else 'GTC'))
+                for kind, order_id, symbol, side, order_type, price, quantity, _ in events]
+
+class MatchingEngineBatchAdapter:
+    """Feeds each run of new orders between two cancels to MatchingEngine.add_orders as one batch of columns.
+
+    Batches are only as long as those runs, so the flow's cancel ratio decides
+    whether the per-batch setup pays off.
+    """
+    batch = True
+    name = 'mini_matching_engine.MatchingEngine.add_orders'
+
+    def reset(self):
+        self.engine = MatchingEngine(fill_sink=NullFillSink())
+
+    def prepare(self, events: List[Event]) -> list:
+        segments = []
+        run = []
+
+        def flush():
+            if run:
+                order_ids, symbols, sides, order_types, prices, quantities = zip(*run)
+                segments.append((self.engine.add_orders, ({
+                    'order_id': np.array(order_ids), 'timestamp': np.array(order_ids), 'symbol': np.array(symbols),
+                    'side': np.array(sides), 'type': np.array(order_types), 'price': np.array(prices) * TICK_SIZE,
+                    'quantity': np.array(quantities),
+                    'time_in_force': np.where(np.array(order_types) == 'M', 'IOC', 'GTC'),
+                },)))
+                run.clear()
+
+        for kind, order_id, symbol, side, order_type, price, quantity, _ in events:
+            if kind == 'X':
+                flush()
+                segments.append((self.engine.cancel_order, (order_id,)))
+            else:
+                run.append((order_id, symbol, side, order_type, price, quantity))
+        flush()
+        return segments
+
+    def run_batch(self, segments: list):
+        for fn, args in segments:
+            fn(*args)
+
+    def count(self, segments: list) -> int:
+        return sum(len(args[0]['order_id']) if fn == self.engine.add_orders else 1 for fn, args in segments)
+
+class ClassOrderbookAdapter:
+    """Drives class_orderbook.OrderBook through its per-action helpers; it has no cancel."""
+    batch = False
+    name = 'class_orderbook.OrderBook'
+
+    def reset(self):
+        self.book = class_orderbook.OrderBook()
+
+    def prepare(self, events: List[Event]) -> List[Call]:
+        handlers = {'BUY': self.book._process_buy, 'SELL': self.book._process_sell,
+                    'BID': self.book._process_bid, 'OFFER': self.book._process_offer}
+        return [(handlers[_simulation_action(side, owned)], (symbol, quantity, price))
+                for kind, _, symbol, side, _, price, quantity, owned in events if kind == 'N']
+
+class OptimisedOrderbookAdapter:
+    """Drives optimised_orderbook.OrderBook through _process_action; it has no cancel."""
+    batch = False
+    name = 'optimised_orderbook.OrderBook'
+
+    def reset(self):
+        self.book = optimised_orderbook.OrderBook()
+
+    def prepare(self, events: List[Event]) -> List[Call]:
+        process_action = self.book._process_action
+        return [(process_action, (symbol, _simulation_action(side, owned), quantity, price))
+                for kind, _, symbol, side, _, price, quantity, owned in events if kind == 'N']
+
+class BaseOrderbookAdapter:
+    """base_orderbook.trade only takes a whole day of records, so it is timed as one batch."""
+    batch = True
+    name = 'base_orderbook.trade'
+
+    def reset(self):
+        pass
+
+    def prepare(self, events: List[Event]) -> List[str]:
+        return [f"{symbol} {_simulation_action(side, owned)} {quantity} {price}"
+                for kind, _, symbol, side, _, price, quantity, owned in events if kind == 'N']
+
+    def run_batch(self, records: List[str]):
+        return base_orderbook.trade(records)
+
+    def count(self, records: List[str]) -> int:
+        return len(records)
+
+def python_engines() -> list:
+    return [
+        MatchingEngineAdapter('mini_matching_engine.MatchingEngine[level]', PriceLevelOrderBook),
+        MatchingEngineAdapter('mini_matching_engine.MatchingEngine[heap]', OrderBook),
+        MatchingEngineColumnsAdapter(),
+        MatchingEngineBatchAdapter(),
+        OptimisedOrderbookAdapter(),
+        ClassOrderbookAdapter(),
+        BaseOrderbookAdapter(),
+    ]
+
+def compile_cpp_engine(directory: str):
+    """Build matching_engine.cpp into ``directory`` and return the binary's path, or None without a C++ compiler."""
+    compiler = shutil.which('g++') or shutil.which('clang++')
+    if compiler is None:
+        return None
+    binary = os.path.join(directory, 'matching_engine')
+    subprocess.run([compiler, '-O2', '-std=c++17', '-o', binary,
+                    os.path.join(CPP_ENGINE_DIR, 'matching_engine.cpp')], check=True)
+    return binary
+
+def run_cpp_engine(events: List[Event]) -> dict:
+    """Compile matching_engine.cpp and time one run over ``events``.
+
+    The C++ engine reads a whole command file and matches on a trailing ``M``
+    command, so only end-to-end throughput is reported. ``matched`` is False when
+    the match step crashed and only ingestion was timed. Returns None when no
+    C++ compiler is available.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        binary = compile_cpp_engine(tmp)
+        if binary is None:
+            return None
+
+        lines = []
+        for kind, order_id, symbol, side, order_type, price, quantity, _ in events:
+            if kind == 'X':
+                lines.append(f"X,{order_id},{order_id}")
+            else:
+                # C++ symbols are alphabetic only
+                cpp_symbol = ''.join(chr(ord('A') + int(c)) for c in symbol[3:])
+                lines.append(f"N,{order_id},{order_id},{cpp_symbol},{order_type},{side},{price * TICK_SIZE:.2f},{quantity}")
+        result = {'orders': len(events)}
+        # The trailing M command runs the C++ matcher, which aborts on many realistic books
+        # (its erase/index bookkeeping goes out of range); fall back to timing ingestion alone
+        for match in (True, False):
+            commands = lines + [f"M,{len(events) + 1}"] if match else lines
+            payload = "\n".join([str(len(commands))] + commands) + "\n"
+            start = time.perf_counter()
+            completed = subprocess.run([binary], input=payload.encode(), cwd=tmp,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            if completed.returncode == 0:
+                break
+            result['error'] = f"matching exited with status {completed.returncode}"
+
+        result.update({'matched': match, 'seconds': elapsed, 'orders_per_sec': len(events) / elapsed})
+        return result
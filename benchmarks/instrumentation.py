@@ -0,0 +1,98 @@
+"""Measure the cost of instrumentation.Instrumentation on MatchingEngine.
+
+    python -m benchmarks.instrumentation --orders 200000 --sample-every 128
+
+The same flow runs on a plain engine, on one that was instrumented and then
+detached, and on instrumented engines sampling every ``--sample-every``
+commands and every command. Differences of a few percent are far below the
+run-to-run noise of whole-flow timings, so the variants are run in lockstep,
+``--block`` commands at a time, and each block keeps its fastest time over
+``--repeat`` passes.
+"""
+import argparse
+import gc
+import time
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink
+from instrumentation import Instrumentation
+
+from .order_flow import generate_order_flow, TICK_SIZE
+
+def _commands(events, sample_every=None, detach=False):
+    engine = MatchingEngine(fill_sink=NullFillSink())
+    instrumentation = None
+    if sample_every is not None:
+        instrumentation = Instrumentation(sample_every).attach(engine)
+        if detach:
+            instrumentation.detach()
+    add_order, cancel_order = engine.add_order, engine.cancel_order
+    commands = [(cancel_order, order_id) if kind == 'X' else
+                (add_order, Order(order_id, order_id, symbol, order_type, side, price * TICK_SIZE, quantity,
+                                  'IOC' if order_type == 'M' else 'GTC'))
+                for kind, order_id, symbol, side, order_type, price, quantity, _ in events]
+    return commands, instrumentation
+
+def benchmark_instrumentation(events, sample_every: int, repeat: int, block: int) -> dict:
+    variants = {
+        'plain': {},
+        'detached': {'sample_every': sample_every, 'detach': True},
+        f'sampled 1/{sample_every}': {'sample_every': sample_every},
+        'every command': {'sample_every': 1},
+    }
+    blocks = range(0, len(events), block)
+    best = {name: [float('inf')] * len(blocks) for name in variants}
+    instrumentations = {}
+    clock = time.perf_counter
+    for _ in range(repeat):
+        runs = {name: _commands(events, **options) for name, options in variants.items()}
+        gc.collect()
+        for i, start in enumerate(blocks):
+            for name, (commands, _) in runs.items():
+                chunk = commands[start:start + block]
+                began = clock()
+                for fn, arg in chunk:
+                    fn(arg)
+                best[name][i] = min(best[name][i], clock() - began)
+        instrumentations = {name: instrumentation for name, (_, instrumentation) in runs.items()}
+
+    plain = sum(best['plain'])
+    return {name: {
+        'seconds': sum(times),
+        'orders_per_sec': len(events) / sum(times),
+        'overhead_pct': (sum(times) / plain - 1) * 100,
+        'instrumentation': instrumentations[name],
+    } for name, times in best.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of MatchingEngine instrumentation.")
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=20, help="limit prices land within this many ticks of the mid")
+    parser.add_argument('--cancel-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sample-every', type=int, default=128, help="time one command in this many")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--block', type=int, default=1000, help="commands each variant runs before the next takes a turn")
+    parser.add_argument('--prometheus', action='store_true', help="print the sampled run's Prometheus snapshot")
+    args = parser.parse_args()
+
+    events = generate_order_flow(args.orders, args.symbols, depth=args.depth, cancel_ratio=args.cancel_ratio, seed=args.seed)
+    results = benchmark_instrumentation(events, args.sample_every, args.repeat, args.block)
+
+    print(f"{'variant':20} {'orders/s':>12} {'overhead':>9}")
+    for name, result in results.items():
+        print(f"{name:20} {result['orders_per_sec']:>12,.0f} {result['overhead_pct']:>8.1f}%")
+
+    instrumentation = results[f'sampled 1/{args.sample_every}']['instrumentation']
+    if args.prometheus:
+        print(instrumentation.to_prometheus(), end='')
+        return
+    snapshot = instrumentation.snapshot()
+    print(f"\ncounters: {snapshot['counters']}")
+    print(f"gauges:   {snapshot['gauges']}")
+    print(f"{'stage':22} {'samples':>8} {'mean ns':>9} {'p50 ns':>9} {'p99 ns':>9}")
+    for stage, summary in snapshot['stages'].items():
+        print(f"{stage:22} {summary['samples']:>8,} {summary['mean_ns']:>9,.0f} {summary['p50_ns']:>9,} {summary['p99_ns']:>9,}")
+
+if __name__ == "__main__":
+    main()
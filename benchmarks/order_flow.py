@@ -0,0 +1,56 @@
+import random
+from typing import List, Tuple
+
+# Event layout shared by every adapter:
+#   ('N', order_id, symbol, side, order_type, price_ticks, quantity, owned)
+#   ('X', order_id, symbol, None, None, 0, 0, False)
+# Prices are integer ticks; adapters scale them by TICK_SIZE where an engine wants floats.
+Event = Tuple[str, int, str, str, str, int, int, bool]
+
+TICK_SIZE = 0.01
+
+def generate_order_flow(num_orders: int, num_symbols: int = 10, volatility: float = 2.0, depth: int = 20,
+                        cancel_ratio: float = 0.2, market_ratio: float = 0.05, own_ratio: float = 0.1,
+                        start_price: int = 10000, seed: int = 42) -> List[Event]:
+    """Build a reproducible synthetic order flow.
+
+    Each symbol's mid price is a random walk moving ``volatility`` ticks per order on
+    average. Limit prices land up to ``depth`` ticks either side of the mid, so roughly
+    half of them cross. ``cancel_ratio`` of the events cancel a random earlier limit
+    order of the same symbol (which may already be filled), ``market_ratio`` of the new
+    orders are market orders and ``own_ratio`` are flagged as our own orders for the
+    ``Orderbook Simulation`` engines' profit accounting.
+    """
+    rng = random.Random(seed)
+    symbols = [f"SYM{i:04d}" for i in range(num_symbols)]
+    mids = {symbol: start_price for symbol in symbols}
+    live = {symbol: [] for symbol in symbols}
+    events: List[Event] = []
+    order_id = 1
+
+    for _ in range(num_orders):
+        symbol = symbols[rng.randrange(num_symbols)]
+        if live[symbol] and rng.random() < cancel_ratio:
+            ids = live[symbol]
+            index = rng.randrange(len(ids))
+            ids[index], ids[-1] = ids[-1], ids[index]
+            events.append(('X', ids.pop(), symbol, None, None, 0, 0, False))
+            continue
+
+        mid = max(depth + 1, mids[symbol] + round(rng.gauss(0, volatility)))
+        mids[symbol] = mid
+        side = 'B' if rng.random() < 0.5 else 'S'
+        quantity = rng.randint(1, 10) * 10
+        owned = rng.random() < own_ratio
+        if rng.random() < market_ratio:
+            # Engines without market orders treat this protection price as a marketable limit
+            price = mid + depth if side == 'B' else mid - depth
+            events.append(('N', order_id, symbol, side, 'M', price, quantity, owned))
+        else:
+            offset = rng.randint(-depth, depth)
+            price = mid - offset if side == 'B' else mid + offset
+            events.append(('N', order_id, symbol, side, 'L', price, quantity, owned))
+            live[symbol].append(order_id)
+        order_id += 1
+
+    return events
@@ -0,0 +1,99 @@
+"""Measure journaling overhead, snapshot pauses and crash-recovery time.
+
+    python -m benchmarks.recovery --orders 200000 --snapshot-every 60000
+
+The flow is journaled with periodic snapshots, then the engine is rebuilt twice:
+from the latest snapshot plus the journal tail, and from the full journal alone.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink
+from journal import JournaledEngine, recover, SNAPSHOT_FILE
+
+from .order_flow import generate_order_flow, TICK_SIZE
+
+def _orders(events):
+    return [('X', order_id) if kind == 'X' else
+            ('N', Order(order_id, order_id, symbol, order_type, side, price * TICK_SIZE, quantity,
+                        'IOC' if order_type == 'M' else 'GTC'))
+            for kind, order_id, symbol, side, order_type, price, quantity, _ in events]
+
+def _drive(engine, commands) -> float:
+    add_order, cancel_order = engine.add_order, engine.cancel_order
+    start = time.perf_counter()
+    for kind, value in commands:
+        if kind == 'N':
+            add_order(value)
+        else:
+            cancel_order(value)
+    return time.perf_counter() - start
+
+def benchmark_recovery(events, snapshot_every: int, group_size: int, directory: str) -> dict:
+    plain_seconds = _drive(MatchingEngine(fill_sink=NullFillSink()), _orders(events))
+
+    journaled = JournaledEngine(directory, group_size=group_size)
+    commands = _orders(events)
+    pauses = []
+    add_order, cancel_order = journaled.add_order, journaled.cancel_order
+    start = time.perf_counter()
+    for i, (kind, value) in enumerate(commands, start=1):
+        if kind == 'N':
+            add_order(value)
+        else:
+            cancel_order(value)
+        if i % snapshot_every == 0:
+            pause_start = time.perf_counter()
+            journaled.snapshot()
+            pauses.append(time.perf_counter() - pause_start)
+    journaled.sync()
+    journaled_seconds = time.perf_counter() - start
+    resting = len(journaled.engine.order_book.orders)
+    journaled.close()
+
+    _, from_snapshot = recover(directory)
+    os.remove(os.path.join(directory, SNAPSHOT_FILE))
+    _, from_journal = recover(directory)
+
+    return {
+        'commands': len(commands),
+        'resting_orders': resting,
+        'plain_per_sec': len(commands) / plain_seconds,
+        'journaled_per_sec': len(commands) / journaled_seconds,
+        'fsyncs': journaled.journal.commits,
+        'snapshots': len(pauses),
+        'max_snapshot_pause_ms': max(pauses, default=0) * 1000,
+        'snapshot_recovery_ms': from_snapshot['seconds'] * 1000,
+        'snapshot_recovery_records': from_snapshot['journal_records'],
+        'full_replay_ms': from_journal['seconds'] * 1000,
+        'full_replay_records': from_journal['journal_records'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark journaling, snapshots and recovery of MatchingEngine.")
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=200, help="limit prices land within this many ticks of the mid")
+    parser.add_argument('--cancel-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--snapshot-every', type=int, default=60000, help="commands between snapshots")
+    parser.add_argument('--group-size', type=int, default=256, help="journal records per fsync")
+    parser.add_argument('--directory', help="journal directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    events = generate_order_flow(args.orders, args.symbols, depth=args.depth, cancel_ratio=args.cancel_ratio, seed=args.seed)
+    directory = args.directory or tempfile.mkdtemp(prefix='journal-bench-')
+    try:
+        results = benchmark_recovery(events, args.snapshot_every, args.group_size, directory)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for key, value in results.items():
+        print(f"{key:28} {value:,.2f}" if isinstance(value, float) else f"{key:28} {value:,}")
+
+if __name__ == "__main__":
+    main()
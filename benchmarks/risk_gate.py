@@ -0,0 +1,95 @@
+"""Measure the cost of risk_gate.RiskGate in front of MatchingEngine.
+
+    python -m benchmarks.risk_gate --orders 200000 --accounts 100
+
+The same flow, with orders spread round-robin over ``--accounts`` accounts,
+runs on a plain engine and behind gates with no limits, with only the
+stateless size and collar checks, and checking every limit. The limits are
+loose enough that only self-trade prevention rejects anything. Rejected
+orders never reach matching, so throughput counts only the commands that
+reached the engine, and the overhead compares time per such command with the
+plain engine's. As in ``benchmarks.instrumentation``, the variants run in
+lockstep, ``--block`` commands at a time, and each block keeps its fastest
+time over ``--repeat`` passes.
+"""
+import argparse
+import gc
+import time
+
+from mini_matching_engine import MatchingEngine, Order, NullFillSink
+from risk_gate import RiskGate, RiskLimits, REASONS
+
+from .order_flow import generate_order_flow, TICK_SIZE
+
+LOOSE_LIMITS = RiskLimits(max_order_quantity=10**6, price_collar=0.5, max_open_notional=1e12, max_position=10**9)
+STATELESS_LIMITS = RiskLimits(max_order_quantity=10**6, price_collar=0.5, self_trade_prevention=False)
+
+def _commands(events, accounts: int, limits=None):
+    engine = MatchingEngine(fill_sink=NullFillSink())
+    target = engine if limits is None else RiskGate(engine, limits)
+    add_order, cancel_order = target.add_order, target.cancel_order
+    commands = [(cancel_order, order_id) if kind == 'X' else
+                (add_order, Order(order_id, order_id, symbol, order_type, side, price * TICK_SIZE, quantity,
+                                  'IOC' if order_type == 'M' else 'GTC', account=order_id % accounts))
+                for kind, order_id, symbol, side, order_type, price, quantity, _ in events]
+    return commands, target
+
+def benchmark_risk_gate(events, accounts: int, repeat: int, block: int) -> dict:
+    variants = {
+        'plain': None,
+        'gate, no limits': RiskLimits(self_trade_prevention=False),
+        'gate, size/collar': STATELESS_LIMITS,
+        'gate, all checks': LOOSE_LIMITS,
+    }
+    blocks = range(0, len(events), block)
+    best = {name: [float('inf')] * len(blocks) for name in variants}
+    targets = {}
+    clock = time.perf_counter
+    for _ in range(repeat):
+        runs = {name: _commands(events, accounts, limits) for name, limits in variants.items()}
+        gc.collect()
+        for i, start in enumerate(blocks):
+            for name, (commands, _) in runs.items():
+                chunk = commands[start:start + block]
+                began = clock()
+                for fn, arg in chunk:
+                    fn(arg)
+                best[name][i] = min(best[name][i], clock() - began)
+        targets = {name: target for name, (_, target) in runs.items()}
+
+    results = {}
+    for name, times in best.items():
+        rejections = getattr(targets[name], 'rejections', [0] * len(REASONS))
+        accepted = len(events) - sum(rejections[1:])
+        results[name] = {
+            'seconds': sum(times),
+            'accepted': accepted,
+            'orders_per_sec': accepted / sum(times),
+            'rejections': dict(zip(REASONS[1:], rejections[1:])),
+        }
+    plain = results['plain']['orders_per_sec']
+    for result in results.values():
+        result['overhead_pct'] = (plain / result['orders_per_sec'] - 1) * 100
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of the pre-trade risk gate.")
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--accounts', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=20, help="limit prices land within this many ticks of the mid")
+    parser.add_argument('--cancel-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--block', type=int, default=1000, help="commands each variant runs before the next takes a turn")
+    args = parser.parse_args()
+
+    events = generate_order_flow(args.orders, args.symbols, depth=args.depth, cancel_ratio=args.cancel_ratio, seed=args.seed)
+    results = benchmark_risk_gate(events, args.accounts, args.repeat, args.block)
+    print(f"{'variant':20} {'accepted/s':>12} {'overhead':>9}  rejections")
+    for name, result in results.items():
+        rejected = {reason: count for reason, count in result['rejections'].items() if count}
+        print(f"{name:20} {result['orders_per_sec']:>12,.0f} {result['overhead_pct']:>8.1f}%  {rejected or '-'}")
+
+if __name__ == "__main__":
+    main()
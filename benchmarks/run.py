@@ -0,0 +1,164 @@
+"""Run every engine over the same synthetic order flow and save the results as JSON.
+
+    python -m benchmarks.run --orders 200000 --symbols 50 --cancel-ratio 0.3
+    python -m benchmarks.run --compare benchmarks/results/<old>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import List
+
+from . import ROOT
+from .engines import python_engines, run_cpp_engine
+from .order_flow import Event, generate_order_flow
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+def percentile(sorted_values: List[int], fraction: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def _run(adapter, events: List[Event]):
+    adapter.reset()
+    work = adapter.prepare(events)
+    if adapter.batch:
+        start = time.perf_counter()
+        adapter.run_batch(work)
+        return adapter.count(work), time.perf_counter() - start
+    start = time.perf_counter()
+    for fn, args in work:
+        fn(*args)
+    return len(work), time.perf_counter() - start
+
+def _latencies(adapter, events: List[Event]) -> List[int]:
+    adapter.reset()
+    work = adapter.prepare(events)
+    clock = time.perf_counter_ns
+    latencies = [0] * len(work)
+    for i, (fn, args) in enumerate(work):
+        start = clock()
+        fn(*args)
+        latencies[i] = clock() - start
+    latencies.sort()
+    return latencies
+
+def _peak_memory(adapter, events: List[Event]) -> int:
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        _run(adapter, events)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+def benchmark_engine(adapter, events: List[Event], repeat: int = 3) -> dict:
+    """Best-of-``repeat`` throughput, then one timed pass for latency and one traced pass for memory.
+
+    The passes are separate so per-order clock reads and tracemalloc do not skew throughput.
+    """
+    processed, seconds = min((_run(adapter, events) for _ in range(repeat)), key=lambda run: run[1])
+    result = {
+        'orders': processed,
+        'seconds': seconds,
+        'orders_per_sec': processed / seconds if seconds > 0 else 0.0,
+        'peak_memory_bytes': _peak_memory(adapter, events),
+    }
+    if adapter.batch:
+        result.update({'p50_ns': None, 'p99_ns': None, 'p999_ns': None})
+    else:
+        latencies = _latencies(adapter, events)
+        result.update({
+            'p50_ns': percentile(latencies, 0.50),
+            'p99_ns': percentile(latencies, 0.99),
+            'p999_ns': percentile(latencies, 0.999),
+        })
+    return result
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_results(results: dict):
+    print(f"{'engine':48} {'orders/s':>12} {'p50 ns':>9} {'p99 ns':>9} {'p999 ns':>9} {'peak MB':>9}")
+    for name, result in results.items():
+        latencies = [f"{result[key]:>9,}" if result.get(key) is not None else f"{'-':>9}"
+                     for key in ('p50_ns', 'p99_ns', 'p999_ns')]
+        memory = result.get('peak_memory_bytes')
+        memory = f"{memory / 2**20:>9.1f}" if memory is not None else f"{'-':>9}"
+        print(f"{name:48} {result['orders_per_sec']:>12,.0f} {' '.join(latencies)} {memory}")
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nThroughput versus {baseline['commit']} ({baseline_path}):")
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old:
+            print(f"  {name:48} {result['orders_per_sec'] / old['orders_per_sec']:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matching engines on a seeded synthetic order flow.")
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--volatility', type=float, default=2.0, help="random-walk step of each mid price, in ticks")
+    parser.add_argument('--depth', type=int, default=20, help="limit prices land within this many ticks of the mid")
+    parser.add_argument('--cancel-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engines', nargs='*', help="only run engines whose name contains one of these strings")
+    parser.add_argument('--cpp-orders', type=int, default=0,
+                        help="also time the C++ engine on this many orders (it is quadratic, keep it small)")
+    parser.add_argument('--output', help="JSON result path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', help="earlier result file to compare throughput against")
+    args = parser.parse_args()
+
+    config = {
+        'orders': args.orders, 'symbols': args.symbols, 'volatility': args.volatility,
+        'depth': args.depth, 'cancel_ratio': args.cancel_ratio, 'seed': args.seed,
+    }
+    events = generate_order_flow(args.orders, num_symbols=args.symbols, volatility=args.volatility,
+                                 depth=args.depth, cancel_ratio=args.cancel_ratio, seed=args.seed)
+
+    results = {}
+    for adapter in python_engines():
+        if args.engines and not any(pattern in adapter.name for pattern in args.engines):
+            continue
+        results[adapter.name] = benchmark_engine(adapter, events, args.repeat)
+
+    if args.cpp_orders:
+        cpp_events = generate_order_flow(args.cpp_orders, num_symbols=args.symbols, volatility=args.volatility,
+                                         depth=args.depth, cancel_ratio=args.cancel_ratio, seed=args.seed)
+        cpp_result = run_cpp_engine(cpp_events)
+        if cpp_result is not None:
+            results['matching_engine.cpp'] = cpp_result
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
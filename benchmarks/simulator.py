@@ -0,0 +1,439 @@
+"""Discrete-event, agent-based market simulator for load and capacity testing.
+
+    python -m benchmarks.simulator --duration 600 --symbols 20 --replay session.txt
+
+Each kind of agent is one population, with its agents' parameters in numpy
+arrays:
+
+- market makers quote a bid and an offer around their symbol's fair value,
+  and replace both every time they act
+- noise takers send market orders, and limit orders that they cancel after a
+  while
+- momentum takers trade in the direction the mid has moved once it strays far
+  enough from its moving average
+- news moves a symbol's fair value and multiplies activity on it for a while
+
+A population acts as one Poisson process. Its event times, the unit acting
+and the random numbers each event needs are drawn with numpy a chunk at a
+time. A heap interleaves the populations' next events with one-off scheduled
+events such as the end of a news burst.
+
+Agents read the book they trade against, so a session depends on the engine
+as well as the seed. The same seed and engine always produce the same
+commands. ``--replay`` saves them in the N/X command format that
+``order_replay.py`` reads.
+"""
+import argparse
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+import optimised_orderbook
+from mini_matching_engine import MatchingEngine, Order, NullFillSink, SYMBOLS, BUY, SELL
+
+from .engines import _simulation_action
+from .order_flow import TICK_SIZE
+
+# ('N', order_id, timestamp_us, symbol, order_type, side, price_ticks, quantity) or ('X', order_id, timestamp_us)
+Command = Tuple
+
+class Scheduler:
+    """Runs callbacks in time order off a heap; callbacks due at the same time run in the order they were scheduled."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.heap = []
+        self.sequence = itertools.count()
+        self.events = 0
+
+    def at(self, when: float, callback, argument=None):
+        heapq.heappush(self.heap, (when, next(self.sequence), callback, argument))
+
+    def run(self, until: float):
+        heap, pop = self.heap, heapq.heappop
+        while heap and heap[0][0] <= until:
+            self.now, _, callback, argument = pop(heap)
+            self.events += 1
+            callback(argument)
+        self.now = until
+
+class Population:
+    """Agents of one kind acting as one Poisson process.
+
+    ``weights`` gives each unit (a symbol, or one agent for market makers) its
+    share of ``rate`` events per second per unit of weight. Event times, units
+    and whatever ``draw`` adds are generated ``CHUNK`` events at a time.
+    Reweighting redraws from the current time, which exponential gaps allow,
+    and leaves the event already on the heap to be dropped as stale.
+    """
+    CHUNK = 4096
+
+    def __init__(self, simulator: 'MarketSimulator', rate: float, weights):
+        self.simulator = simulator
+        self.rng = simulator.rng
+        self.rate = rate
+        self.weights = np.asarray(weights, dtype=float)
+        self.generation = 0
+        self.events = 0
+
+    def draw(self, count: int) -> tuple:
+        """Per-event random numbers for ``act``, as lists of ``count``."""
+        return ()
+
+    def act(self, index: int):
+        raise NotImplementedError
+
+    def units_for(self, symbol: int) -> List[int]:
+        return [symbol]
+
+    def start(self):
+        self._redraw(self.simulator.scheduler.now)
+
+    def _redraw(self, now: float):
+        self.generation += 1
+        total = self.weights.sum()
+        if self.rate <= 0 or total <= 0:
+            return
+        rng, count = self.rng, self.CHUNK
+        self.times = (now + np.cumsum(rng.exponential(1 / (self.rate * total), count))).tolist()
+        self.units = rng.choice(len(self.weights), count, p=self.weights / total).tolist()
+        self.draws = self.draw(count)
+        self.index = 0
+        self.simulator.scheduler.at(self.times[0], self._fire, self.generation)
+
+    def _fire(self, generation: int):
+        if generation != self.generation:
+            return
+        index = self.index
+        self.events += 1
+        self.act(index)
+        index += 1
+        if index == self.CHUNK:
+            self._redraw(self.times[-1])
+        else:
+            self.index = index
+            self.simulator.scheduler.at(self.times[index], self._fire, generation)
+
+    def reweight(self, symbol: int, factor: float):
+        self.weights[self.units_for(symbol)] *= factor
+        self._redraw(self.simulator.scheduler.now)
+
+class MarketMakers(Population):
+    """Each maker quotes one symbol, ``half_spread`` ticks either side of fair value, and requotes ``rate`` times a second."""
+
+    def __init__(self, simulator: 'MarketSimulator', per_symbol: int, rate: float):
+        count = per_symbol * simulator.symbol_count
+        super().__init__(simulator, rate, np.ones(count))
+        symbols = np.arange(count) % simulator.symbol_count
+        self.symbol = symbols.tolist()
+        self.agents = [np.flatnonzero(symbols == symbol) for symbol in range(simulator.symbol_count)]
+        self.half_spread = self.rng.integers(1, 6, count).tolist()
+        self.size = (self.rng.integers(1, 11, count) * 100).tolist()
+        self.quotes = [None] * count
+
+    def units_for(self, symbol: int):
+        return self.agents[symbol]
+
+    def draw(self, count: int):
+        return (self.rng.integers(-1, 2, count).tolist(),)
+
+    def act(self, index: int):
+        agent = self.units[index]
+        simulator, symbol = self.simulator, self.symbol[agent]
+        quotes = self.quotes[agent]
+        if quotes is not None:
+            simulator.cancel(quotes[0])
+            simulator.cancel(quotes[1])
+        fair = round(simulator.fair_value(symbol)) + self.draws[0][index]
+        half_spread, size = self.half_spread[agent], self.size[agent]
+        self.quotes[agent] = (simulator.send(symbol, 'B', 'L', fair - half_spread, size, True),
+                              simulator.send(symbol, 'S', 'L', fair + half_spread, size, True))
+
+class NoiseTakers(Population):
+    """Random orders: ``market_ratio`` market orders, the rest limits within ``depth`` ticks of fair value, cancelled after ``lifetime`` seconds."""
+
+    def __init__(self, simulator: 'MarketSimulator', rate: float, market_ratio: float = 0.3, depth: int = 10,
+                 lifetime: float = 30.0):
+        super().__init__(simulator, rate, np.ones(simulator.symbol_count))
+        self.market_ratio = market_ratio
+        self.depth = depth
+        self.lifetime = lifetime
+        self.resting = deque()
+
+    def draw(self, count: int):
+        rng = self.rng
+        return ((rng.random(count) < 0.5).tolist(), (rng.integers(1, 11, count) * 10).tolist(),
+                (rng.random(count) < self.market_ratio).tolist(), rng.integers(-self.depth, self.depth + 1, count).tolist())
+
+    def act(self, index: int):
+        simulator, resting = self.simulator, self.resting
+        now = simulator.scheduler.now
+        while resting and resting[0][0] <= now:
+            simulator.cancel(resting.popleft()[1])
+        symbol = self.units[index]
+        buys, sizes, markets, offsets = self.draws
+        side = 'B' if buys[index] else 'S'
+        fair = round(simulator.fair_value(symbol))
+        if markets[index]:
+            simulator.send_market(symbol, side, sizes[index], fair)
+        else:
+            price = fair - offsets[index] if side == 'B' else fair + offsets[index]
+            resting.append((now + self.lifetime, simulator.send(symbol, side, 'L', price, sizes[index])))
+
+class MomentumTakers(Population):
+    """Agents that compare a symbol's mid with its moving average and send a market order once the gap passes their threshold."""
+
+    def __init__(self, simulator: 'MarketSimulator', count: int, rate: float, smoothing: float = 0.1):
+        super().__init__(simulator, rate, np.ones(simulator.symbol_count))
+        self.count = count
+        self.smoothing = smoothing
+        self.threshold = self.rng.uniform(2, 8, count).tolist()
+        self.size = (self.rng.integers(1, 11, count) * 50).tolist()
+        self.average = [None] * simulator.symbol_count
+
+    def draw(self, count: int):
+        return (self.rng.integers(0, self.count, count).tolist(),)
+
+    def act(self, index: int):
+        simulator, symbol = self.simulator, self.units[index]
+        bid, ask = simulator.driver.touch(simulator.symbols[symbol])
+        if bid is None or ask is None:
+            return
+        mid = (bid + ask) / 2
+        average = self.average[symbol]
+        self.average[symbol] = mid if average is None else average + self.smoothing * (mid - average)
+        if average is None:
+            return
+        agent = self.draws[0][index]
+        if abs(mid - average) > self.threshold[agent]:
+            simulator.send_market(symbol, 'B' if mid > average else 'S', self.size[agent], round(mid))
+
+class News(Population):
+    """News on a symbol moves its fair value by a normal ``jump`` (in ticks) and multiplies every other population's activity on it by ``burst`` for ``duration`` seconds."""
+
+    def __init__(self, simulator: 'MarketSimulator', rate: float, jump: float = 20.0, burst: float = 10.0,
+                 duration: float = 5.0):
+        super().__init__(simulator, rate, np.ones(simulator.symbol_count))
+        self.jump = jump
+        self.burst = burst
+        self.duration = duration
+
+    def draw(self, count: int):
+        return (self.rng.normal(0, self.jump, count).tolist(),)
+
+    def act(self, index: int):
+        simulator, symbol = self.simulator, self.units[index]
+        simulator.fair_value(symbol)
+        simulator.fair[symbol] += self.draws[0][index]
+        self._reweight(symbol, self.burst)
+        simulator.scheduler.at(simulator.scheduler.now + self.duration, self._end, symbol)
+
+    def _end(self, symbol: int):
+        self._reweight(symbol, 1 / self.burst)
+
+    def _reweight(self, symbol: int, factor: float):
+        for population in self.simulator.populations:
+            if population is not self:
+                population.reweight(symbol, factor)
+
+class MatchingEngineDriver:
+    """Sends the simulator's commands to mini_matching_engine.MatchingEngine."""
+    name = 'mini_matching_engine.MatchingEngine'
+
+    def __init__(self, engine: MatchingEngine = None):
+        self.engine = engine if engine is not None else MatchingEngine(fill_sink=NullFillSink())
+
+    def add(self, order_id: int, timestamp: int, symbol: str, side: str, order_type: str, ticks: int, quantity: int,
+            owned: bool):
+        self.engine.add_order(Order(order_id, timestamp, symbol, order_type, side, ticks * TICK_SIZE, quantity,
+                                    'IOC' if order_type == 'M' else 'GTC'))
+
+    def cancel(self, order_id: int):
+        self.engine.cancel_order(order_id)
+
+    def touch(self, symbol: str):
+        """Best bid and offer in ticks; either is None while its side is empty."""
+        symbol_id, book = SYMBOLS.ids.get(symbol), self.engine.order_book
+        bid, ask = book.peek_best(symbol_id, BUY), book.peek_best(symbol_id, SELL)
+        return bid.ticks if bid is not None else None, ask.ticks if ask is not None else None
+
+    def fills(self):
+        return self.engine.trade_tape.total
+
+class OrderbookSimulationDriver:
+    """Sends the simulator's commands to optimised_orderbook.OrderBook.
+
+    That engine has no cancels or market orders. Cancels are dropped, so
+    replaced quotes stay on its book, and market orders are limits at the
+    simulator's protection price. Market makers' orders count as own orders
+    for its profit and exposure.
+    """
+    name = 'optimised_orderbook.OrderBook'
+
+    def __init__(self, book: optimised_orderbook.OrderBook = None):
+        self.book = book if book is not None else optimised_orderbook.OrderBook()
+
+    def add(self, order_id: int, timestamp: int, symbol: str, side: str, order_type: str, ticks: int, quantity: int,
+            owned: bool):
+        self.book._process_action(symbol, _simulation_action(side, owned), quantity, ticks)
+
+    def cancel(self, order_id: int):
+        pass
+
+    def touch(self, symbol: str):
+        return self.book.bid_books[symbol].best_price(), self.book.offer_books[symbol].best_price()
+
+    def fills(self):
+        return None
+
+class NullDriver:
+    """Accepts every command and does nothing, to measure the simulator on its own."""
+    name = 'none'
+
+    def add(self, *command):
+        pass
+
+    def cancel(self, order_id: int):
+        pass
+
+    def touch(self, symbol: str):
+        return None, None
+
+    def fills(self):
+        return None
+
+DRIVERS = {'matching': MatchingEngineDriver, 'optimised': OrderbookSimulationDriver, 'none': NullDriver}
+
+class MarketSimulator:
+    """One seeded session: ``symbols`` symbols, fair values that random-walk ``volatility`` ticks per root second, and the agent populations trading them.
+
+    Rates are events per second per symbol, except ``maker_rate``, which is per maker.
+    """
+
+    def __init__(self, driver, symbols: int = 20, seed: int = 42, start_price: int = 10000, volatility: float = 2.0,
+                 makers_per_symbol: int = 2, maker_rate: float = 5.0, noise_rate: float = 10.0, momentum_takers: int = 50,
+                 momentum_rate: float = 5.0, news_rate: float = 1 / 120, protection: int = 50, record: bool = True):
+        self.driver = driver
+        self.rng = np.random.default_rng(seed)
+        self.scheduler = Scheduler()
+        self.symbol_count = symbols
+        self.symbols = [f"SYM{i:04d}" for i in range(symbols)]
+        self.fair = [float(start_price)] * symbols
+        self.updated = [0.0] * symbols
+        self.volatility = volatility
+        self.protection = protection
+        self.normals = []
+        self.next_order_id = 1
+        self.orders = 0
+        self.cancels = 0
+        self.commands: List[Command] = [] if record else None
+        self.populations = [
+            MarketMakers(self, makers_per_symbol, maker_rate),
+            NoiseTakers(self, noise_rate),
+            MomentumTakers(self, momentum_takers, momentum_rate),
+            News(self, news_rate),
+        ]
+
+    def fair_value(self, symbol: int) -> float:
+        now = self.scheduler.now
+        elapsed = now - self.updated[symbol]
+        if elapsed > 0:
+            if not self.normals:
+                self.normals = self.rng.standard_normal(Population.CHUNK).tolist()
+            self.fair[symbol] = max(self.protection + 1.0,
+                                    self.fair[symbol] + self.volatility * math.sqrt(elapsed) * self.normals.pop())
+            self.updated[symbol] = now
+        return self.fair[symbol]
+
+    def send(self, symbol: int, side: str, order_type: str, ticks: int, quantity: int, owned: bool = False) -> int:
+        order_id = self.next_order_id
+        self.next_order_id += 1
+        self.orders += 1
+        name, timestamp = self.symbols[symbol], round(self.scheduler.now * 1e6)
+        self.driver.add(order_id, timestamp, name, side, order_type, ticks, quantity, owned)
+        if self.commands is not None:
+            self.commands.append(('N', order_id, timestamp, name, order_type, side, ticks, quantity))
+        return order_id
+
+    def send_market(self, symbol: int, side: str, quantity: int, reference: int) -> int:
+        # Engines without market orders get a limit this far through the reference price
+        price = reference + self.protection if side == 'B' else reference - self.protection
+        return self.send(symbol, side, 'M', price, quantity)
+
+    def cancel(self, order_id: int):
+        self.cancels += 1
+        self.driver.cancel(order_id)
+        if self.commands is not None:
+            self.commands.append(('X', order_id, round(self.scheduler.now * 1e6)))
+
+    def run(self, duration: float) -> dict:
+        for population in self.populations:
+            population.start()
+        start = time.perf_counter()
+        self.scheduler.run(duration)
+        seconds = time.perf_counter() - start
+        return {
+            'engine': self.driver.name,
+            'simulated_seconds': duration,
+            'events': self.scheduler.events,
+            'agent_events': {type(population).__name__: population.events for population in self.populations},
+            'orders': self.orders,
+            'cancels': self.cancels,
+            'fills': self.driver.fills(),
+            'seconds': seconds,
+            'events_per_minute': round(self.scheduler.events / seconds * 60),
+            'commands_per_sec': round((self.orders + self.cancels) / seconds),
+        }
+
+def save_replay(commands: List[Command], path: str):
+    """Write ``commands`` as N/X lines; market orders get price 0.00 as in the C++ format."""
+    with open(path, 'w') as f:
+        for command in commands:
+            if command[0] == 'X':
+                f.write(f"X,{command[1]},{command[2]}\n")
+            else:
+                _, order_id, timestamp, symbol, order_type, side, ticks, quantity = command
+                price = 0.0 if order_type == 'M' else ticks * TICK_SIZE
+                f.write(f"N,{order_id},{timestamp},{symbol},{order_type},{side},{price:.2f},{quantity}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a matching engine with a seeded agent-based market simulation.")
+    parser.add_argument('--engine', choices=sorted(DRIVERS), default='matching')
+    parser.add_argument('--duration', type=float, default=600.0, help="simulated seconds")
+    parser.add_argument('--symbols', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--volatility', type=float, default=2.0, help="fair value random walk, ticks per root second")
+    parser.add_argument('--makers-per-symbol', type=int, default=2)
+    parser.add_argument('--maker-rate', type=float, default=5.0, help="requotes per second per maker")
+    parser.add_argument('--noise-rate', type=float, default=10.0, help="noise orders per second per symbol")
+    parser.add_argument('--momentum-takers', type=int, default=50)
+    parser.add_argument('--momentum-rate', type=float, default=5.0, help="momentum checks per second per symbol")
+    parser.add_argument('--news-rate', type=float, default=1 / 120, help="news events per second per symbol")
+    parser.add_argument('--replay', help="save the session's commands to this file")
+    args = parser.parse_args()
+
+    simulator = MarketSimulator(DRIVERS[args.engine](), symbols=args.symbols, seed=args.seed, volatility=args.volatility,
+                                makers_per_symbol=args.makers_per_symbol, maker_rate=args.maker_rate,
+                                noise_rate=args.noise_rate, momentum_takers=args.momentum_takers,
+                                momentum_rate=args.momentum_rate, news_rate=args.news_rate,
+                                record=args.replay is not None)
+    result = simulator.run(args.duration)
+    for key, value in result.items():
+        if isinstance(value, dict):
+            value = ', '.join(f"{name} {count:,}" for name, count in value.items())
+        elif isinstance(value, float):
+            value = f"{value:,.2f}"
+        elif isinstance(value, int):
+            value = f"{value:,}"
+        print(f"{key}: {value}")
+    if args.replay:
+        save_replay(simulator.commands, args.replay)
+        print(f"Saved {len(simulator.commands):,} commands to {args.replay}")
+
+if __name__ == "__main__":
+    main()